@@ -0,0 +1,217 @@
+"""Ограничение одновременных запросов по классам маршрутов.
+
+Тяжёлые запросы (рендер чека, загрузка изображения, каскадное удаление клиента,
+пакетное создание заказов) и обычные записи получают свои небольшие лимиты, чтобы
+всплеск загрузок не занимал весь пул потоков и не тормозил GET /orders. Чтения
+идут в отдельный, самый широкий пул и никогда не ждут за тяжёлыми запросами.
+
+Сверх лимита запрос ждёт в ограниченной очереди своего класса не дольше timeout
+секунд. Если очередь полна или время ожидания вышло — 503 с Retry-After, оценённым
+по средней длительности запросов класса. Лимиты действуют в пределах одного
+процесса uvicorn; настраиваются переменными ADMISSION_<CLASS>_LIMIT, _QUEUE,
+_TIMEOUT. Счётчики отдаёт GET /metrics/admission.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from collections import deque
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+RETRY_AFTER_MAX = 60
+# Сглаживание средней длительности запроса для оценки Retry-After
+DURATION_SMOOTHING = 0.2
+
+# (методы, шаблон пути, только multipart) — остальные запросы классифицируются по методу
+HEAVY_ROUTES = [
+    ({"GET", "POST"}, re.compile(r"^/orders/[^/]+/receipt$"), False),
+    ({"POST"}, re.compile(r"^/products$"), False),
+    ({"PUT"}, re.compile(r"^/products/by-name/image$"), False),
+    # PUT /products/{id} тяжёлый, только если несёт файл; PUT /products/by-name — обычная правка полей
+    ({"PUT"}, re.compile(r"^/products/\d+$"), True),
+    ({"DELETE"}, re.compile(r"^/clients/.+$"), False),
+    ({"POST"}, re.compile(r"^/orders/bulk$"), False),
+]
+# Проверки, долгие потоки событий, статика и сами метрики лимитам не подчиняются
+EXEMPT_PREFIXES = ("/healthz", "/readyz", "/events/", "/uploads/", "/metrics/")
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def _setting(route_class: str, name: str, default):
+    return type(default)(os.getenv(f"ADMISSION_{route_class.upper()}_{name}", str(default)))
+
+
+class Limiter:
+    """Семафор с ограниченной FIFO-очередью; работает в одном цикле событий."""
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.peak_queued = 0
+        self.wait_seconds = 0.0
+        self.avg_duration = 0.0
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self.waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        self.peak_queued = max(self.peak_queued, len(self.waiters))
+        started = time.monotonic()
+        try:
+            # shield: по таймауту future не отменяется, и слот, переданный в последний
+            # момент, не теряется
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.waiters.remove(future)
+                self.timed_out += 1
+                return False
+        except asyncio.CancelledError:
+            # Клиент ушёл, пока ждал
+            if future.done():
+                self.release()
+            else:
+                future.cancel()
+                self.waiters.remove(future)
+            raise
+        self.wait_seconds += time.monotonic() - started
+        self.admitted += 1
+        return True
+
+    def release(self):
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                # Слот переходит следующему в очереди, active не меняется
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def record_duration(self, seconds: float):
+        if self.avg_duration == 0:
+            self.avg_duration = seconds
+        else:
+            self.avg_duration += DURATION_SMOOTHING * (seconds - self.avg_duration)
+
+    def retry_after(self) -> int:
+        # Сколько примерно понадобится, чтобы разобрать очередь перед новым запросом
+        estimate = self.avg_duration * (len(self.waiters) + 1) / max(self.limit, 1)
+        return min(max(math.ceil(estimate), 1), RETRY_AFTER_MAX)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "peak_queued": self.peak_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self.wait_seconds * 1000 / self.admitted, 1) if self.admitted else 0.0,
+            "avg_duration_ms": round(self.avg_duration * 1000, 1),
+        }
+
+
+def default_limiters():
+    defaults = {
+        # класс: (лимит, очередь, ожидание в секундах)
+        "heavy": (4, 16, 10.0),
+        "write": (16, 64, 10.0),
+        "read": (64, 256, 5.0),
+    }
+    return {
+        route_class: Limiter(
+            route_class,
+            limit=_setting(route_class, "LIMIT", limit),
+            queue_size=_setting(route_class, "QUEUE", queue_size),
+            timeout=_setting(route_class, "TIMEOUT", timeout),
+        )
+        for route_class, (limit, queue_size, timeout) in defaults.items()
+    }
+
+
+def classify(method: str, path: str, content_type: str = ""):
+    """Класс маршрута или None, если запрос не ограничивается."""
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    multipart = content_type.startswith("multipart/")
+    for methods, pattern, multipart_only in HEAVY_ROUTES:
+        if method in methods and pattern.match(path) and (multipart or not multipart_only):
+            return "heavy"
+    return "read" if method in READ_METHODS else "write"
+
+
+class AdmissionMiddleware:
+    # Чистый ASGI: слот держится до конца отправки ответа, включая потоковые
+    def __init__(self, app, limiters: dict = None, enabled: bool = ADMISSION_ENABLED):
+        self.app = app
+        self.limiters = limiters if limiters is not None else default_limiters()
+        self.enabled = enabled
+        registry.append(self)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        content_type = ""
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+                break
+        route_class = classify(scope["method"], scope["path"], content_type)
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters[route_class]
+        if not await limiter.acquire():
+            await self._reject(send, limiter)
+            return
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.record_duration(time.monotonic() - started)
+            limiter.release()
+
+    async def _reject(self, send, limiter: Limiter):
+        body = json.dumps({"detail": "Server is busy, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(limiter.retry_after()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    def stats(self) -> dict:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+# Экземпляры middleware создаёт Starlette при сборке стека; метрики берём отсюда
+registry = []
+
+
+def stats() -> dict:
+    return registry[-1].stats() if registry else {}
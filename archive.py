@@ -0,0 +1,213 @@
+"""Архив отгруженных заказов.
+
+Заказы со статусом shipped старше ARCHIVE_AFTER_DAYS переносятся пачками из
+orders/order_items в archived_orders (одна строка на заказ, позиции и клиент — в
+payload), а их PDF-чеки упаковываются в помесячные zip-архивы receipts/archive/.
+Zip хранит оглавление, поэтому отдельный чек читается без распаковки всего архива.
+
+Чтение архивных заказов и чеков по id/identifier — get_archived_order* и
+read_archived_receipt; эндпоинты обращаются к ним, если заказа нет в горячих таблицах.
+
+    python manage.py archive-orders --older-than-days 90
+"""
+import os
+import shutil
+import zipfile
+from sqlalchemy import select, text, update
+from sqlalchemy.orm import Session
+
+import models
+import receipt_store
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_LOCK_ID = 7_301_002
+RECEIPTS_ARCHIVE_DIR = receipt_store.RECEIPTS_DIR / "archive"
+
+MOVE_BATCH = """
+WITH batch AS (
+    SELECT id FROM orders
+    -- created_at хранится без зоны по часам сервера БД, поэтому и границу считаем там же
+    WHERE status = 'shipped' AND created_at < now() - make_interval(days => :days)
+    ORDER BY id
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+)
+INSERT INTO archived_orders (id, identifier, status, client_id, total_amount, item_count, created_at, archived_at, payload)
+SELECT o.id, o.identifier, o.status::text, o.client_id, o.total_amount, o.item_count, o.created_at, now(),
+       jsonb_build_object(
+           'client', CASE WHEN c.id IS NULL THEN NULL ELSE jsonb_build_object(
+               'first_name', c.first_name, 'last_name', c.last_name, 'middle_name', c.middle_name,
+               'birth_date', c.birth_date, 'phone', c.phone, 'address', c.address
+           ) END,
+           'items', COALESCE((
+               SELECT jsonb_agg(jsonb_build_object(
+                   'id', oi.id, 'product_id', oi.product_id, 'quantity', oi.quantity, 'price', oi.price,
+                   'product', jsonb_build_object(
+                       'name', COALESCE(p.name, ''), 'image', COALESCE(p.image, ''),
+                       'price', COALESCE(oi.price, p.price, 0), 'stock', COALESCE(p.stock, 0)
+                   )
+               ) ORDER BY oi.id)
+               FROM order_items oi LEFT JOIN products p ON p.id = oi.product_id
+               WHERE oi.order_id = o.id
+           ), '[]'::jsonb)
+       )
+FROM orders o
+JOIN batch b ON b.id = o.id
+LEFT JOIN clients c ON c.id = o.client_id
+RETURNING id
+"""
+
+UNCOUNT_BATCH = """
+INSERT INTO order_status_counts AS t (status, shard, count)
+SELECT status::text, rollup_shard(), -COUNT(*) FROM orders
+WHERE id = ANY(:ids) AND status IS NOT NULL
+GROUP BY status
+ON CONFLICT (status, shard) DO UPDATE SET count = t.count + EXCLUDED.count
+"""
+
+
+def run(engine, older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = 500):
+    """Перенос заказов и упаковка чеков; одновременно работает только один архиватор."""
+    with engine.connect() as connection:
+        if not connection.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": ARCHIVE_LOCK_ID}).scalar():
+            raise RuntimeError("Архивация уже выполняется")
+        try:
+            moved = archive_shipped_orders(engine, older_than_days, batch_size)
+            packed = pack_receipts(engine)
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": ARCHIVE_LOCK_ID})
+            connection.commit()
+    return moved, packed
+
+
+def archive_shipped_orders(engine, older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = 500):
+    """Переносит отгруженные заказы в архив; возвращает число перенесённых заказов."""
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            # Триггеры итогов, агрегатов и счётчиков пропускают перенос
+            connection.execute(text("SET LOCAL app.archiving = 'on'"))
+            # Большую пачку не обрываем по DB_STATEMENT_TIMEOUT, как и backup.py
+            connection.execute(text("SET LOCAL statement_timeout = 0"))
+            ids = connection.execute(text(MOVE_BATCH), {"days": older_than_days, "limit": batch_size}).scalars().all()
+            if ids:
+                # Итоги и агрегаты продаж архивные заказы сохраняют, а счётчики статусов
+                # считают только живые заказы (как /orders?status=) — вычитаем перенесённые
+                connection.execute(text(UNCOUNT_BATCH), {"ids": ids})
+                connection.execute(text("DELETE FROM order_items WHERE order_id = ANY(:ids)"), {"ids": ids})
+                connection.execute(text("DELETE FROM orders WHERE id = ANY(:ids)"), {"ids": ids})
+        moved += len(ids)
+        if len(ids) < batch_size:
+            return moved
+
+
+def pack_receipts(engine) -> int:
+    """Упаковывает чеки архивных заказов в zip по месяцу архивации и удаляет исходные PDF."""
+    RECEIPTS_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    packed = 0
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(models.ArchivedOrder.id, models.ArchivedOrder.identifier, models.ArchivedOrder.archived_at)
+            .where(models.ArchivedOrder.receipt_archive.is_(None))
+            .order_by(models.ArchivedOrder.id)
+        ).all()
+
+    by_archive = {}
+    for order_id, identifier, archived_at in rows:
+        by_archive.setdefault(f"receipts-{archived_at:%Y-%m}.zip", []).append((order_id, identifier))
+
+    for archive_name, orders in by_archive.items():
+        archive_path = RECEIPTS_ARCHIVE_DIR / archive_name
+        # Дописываем во временную копию и подменяем архив атомарно: читатели не увидят
+        # недописанное оглавление zip
+        temp_path = archive_path.with_suffix(".zip.tmp")
+        if archive_path.exists():
+            shutil.copyfile(archive_path, temp_path)
+        stored = []
+        with zipfile.ZipFile(temp_path, "a", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+            existing = set(archive.namelist())
+            for order_id, identifier in orders:
+                name = receipt_store.file_name(identifier)
+                if name not in existing:
+                    receipt_path = receipt_store.locate(identifier)
+                    if receipt_path is None:
+                        continue
+                    archive.write(receipt_path, arcname=name)
+                stored.append((order_id, identifier))
+        if not stored:
+            temp_path.unlink(missing_ok=True)
+            continue
+        os.replace(temp_path, archive_path)
+        with engine.begin() as connection:
+            connection.execute(
+                update(models.ArchivedOrder)
+                .where(models.ArchivedOrder.id.in_([order_id for order_id, _ in stored]))
+                .values(receipt_archive=archive_name)
+            )
+        # Исходные файлы удаляем только после того, как архив записан и отмечен в базе
+        for _, identifier in stored:
+            try:
+                receipt_store.delete_receipt(identifier)
+            except Exception as e:
+                print(f"Не удалось удалить чек заказа {identifier} после архивации: {str(e)}")
+        packed += len(stored)
+    return packed
+
+
+def _as_response(record):
+    payload = record.payload
+    return {
+        "id": record.id,
+        "status": record.status,
+        "client_id": record.client_id,
+        "identifier": record.identifier,
+        "total_amount": record.total_amount,
+        "item_count": record.item_count,
+        "client": payload.get("client"),
+        "items": payload.get("items", []),
+    }
+
+
+def get_archived_order(db: Session, identifier: str):
+    record = db.query(models.ArchivedOrder).filter(models.ArchivedOrder.identifier == identifier).first()
+    return _as_response(record) if record else None
+
+
+def get_archived_orders(db: Session, identifiers):
+    """Архивные заказы по списку идентификаторов одним запросом: identifier -> ответ."""
+    if not identifiers:
+        return {}
+    records = db.query(models.ArchivedOrder).filter(models.ArchivedOrder.identifier.in_(set(identifiers))).all()
+    return {record.identifier: _as_response(record) for record in records}
+
+
+def get_archived_order_by_id(db: Session, order_id: int):
+    record = db.get(models.ArchivedOrder, order_id)
+    return _as_response(record) if record else None
+
+
+def read_archived_receipt(db: Session, identifier: str):
+    """Возвращает байты PDF архивного заказа, None — если заказа или чека в архиве нет."""
+    row = db.execute(
+        select(models.ArchivedOrder.receipt_archive).where(models.ArchivedOrder.identifier == identifier)
+    ).first()
+    if row is None:
+        return None
+    archive_name = row[0]
+    if archive_name:
+        try:
+            with zipfile.ZipFile(RECEIPTS_ARCHIVE_DIR / archive_name) as archive:
+                return archive.read(receipt_store.file_name(identifier))
+        except (FileNotFoundError, KeyError):
+            return None
+    # Заказ уже в архиве, а чек ещё не упакован
+    receipt_path = receipt_store.locate(identifier)
+    if receipt_path is not None:
+        return receipt_path.read_bytes()
+    return None
+
+
+def is_archived(db: Session, identifier: str) -> bool:
+    return db.execute(
+        select(models.ArchivedOrder.id).where(models.ArchivedOrder.identifier == identifier)
+    ).first() is not None
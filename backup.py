@@ -0,0 +1,308 @@
+"""Инкрементальные резервные копии базы и файлов.
+
+Каталог BACKUP_DIR:
+
+    blobs/ab/abcdef...        содержимое по sha256: куски таблиц и файлы uploads/receipts
+    snapshots/<время>.json    манифест снимка: какие блобы из чего состоят
+
+Таблицы выгружаются из одного снимка REPEATABLE READ курсором на сервере, по
+BACKUP_CHUNK_ROWS строк в порядке первичного ключа, как gzip с NDJSON (строки
+готовит сам PostgreSQL через row_to_json). Сжатие детерминированное, поэтому
+неизменившиеся куски и файлы дают те же хэши и повторно не записываются.
+Файлы, у которых совпали размер и mtime с прошлым снимком, даже не перечитываются.
+
+    python manage.py backup
+    python manage.py backup-verify [--snapshot ...]
+    python manage.py backup-restore --snapshot ... [--clean] [--workers 4]
+    python manage.py backup-prune --keep 14
+"""
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import text
+
+import models
+
+BACKUP_DIR = Path(os.getenv("BACKUP_DIR", "backups"))
+BACKUP_CHUNK_ROWS = int(os.getenv("BACKUP_CHUNK_ROWS", "10000"))
+BACKUP_WORKERS = int(os.getenv("BACKUP_WORKERS", "4"))
+FILE_ROOTS = ("uploads", "receipts")
+# Служебные таблицы, которые не нужно восстанавливать
+SKIP_TABLES = {"cache_versions", "idempotency_keys", "jobs"}
+READ_BUFFER = 1024 * 1024
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Lock:
+    """Файловая блокировка: backup и prune не работают одновременно."""
+
+    def __enter__(self):
+        BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+        self.file = open(BACKUP_DIR / ".lock", "w")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise BackupError("Другая операция с резервными копиями уже выполняется")
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+# --- хранилище блобов ---
+
+def _blob_path(digest: str) -> Path:
+    return BACKUP_DIR / "blobs" / digest[:2] / digest
+
+
+def _put_bytes(data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as temp:
+            temp.write(data)
+        os.replace(temp.name, path)
+    return digest
+
+
+def _put_file(source: Path) -> str:
+    # Копируем во временный файл, считая хэш по пути, и переименовываем в блоб
+    (BACKUP_DIR / "blobs").mkdir(parents=True, exist_ok=True)
+    sha = hashlib.sha256()
+    with open(source, "rb") as src, tempfile.NamedTemporaryFile(dir=BACKUP_DIR / "blobs", delete=False) as temp:
+        while chunk := src.read(READ_BUFFER):
+            sha.update(chunk)
+            temp.write(chunk)
+    digest = sha.hexdigest()
+    path = _blob_path(digest)
+    if path.exists():
+        os.unlink(temp.name)
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp.name, path)
+    return digest
+
+
+def _file_digest(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_BUFFER):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# --- снимки ---
+
+def list_snapshots():
+    directory = BACKUP_DIR / "snapshots"
+    if not directory.exists():
+        return []
+    return sorted(path.stem for path in directory.glob("*.json"))
+
+
+def load_manifest(snapshot: str = None) -> dict:
+    snapshots = list_snapshots()
+    if not snapshots:
+        raise BackupError(f"В {BACKUP_DIR} нет снимков")
+    snapshot = snapshot or snapshots[-1]
+    path = BACKUP_DIR / "snapshots" / f"{snapshot}.json"
+    if not path.exists():
+        raise BackupError(f"Снимок {snapshot} не найден")
+    return json.loads(path.read_text())
+
+
+def _tables():
+    return [table for table in models.Base.metadata.sorted_tables if table.name not in SKIP_TABLES]
+
+
+def _dump_table(connection, table) -> dict:
+    order_by = ", ".join(column.name for column in table.primary_key.columns)
+    result = connection.execution_options(stream_results=True, yield_per=BACKUP_CHUNK_ROWS).execute(
+        text(f"SELECT row_to_json(t)::text FROM {table.name} AS t ORDER BY {order_by}")
+    )
+    chunks = []
+    rows = 0
+    for partition in result.partitions():
+        data = "\n".join(row[0] for row in partition).encode() + b"\n"
+        # mtime=0: одинаковые строки дают одинаковый блоб
+        digest = _put_bytes(gzip.compress(data, compresslevel=6, mtime=0))
+        chunks.append({"blob": digest, "rows": len(partition)})
+        rows += len(partition)
+    return {"rows": rows, "chunks": chunks}
+
+
+def _collect_files(previous: dict) -> list:
+    known = {item["path"]: item for item in previous.get("files", [])}
+    files = []
+    for root in FILE_ROOTS:
+        base = Path(root)
+        if not base.exists():
+            continue
+        for path in sorted(p for p in base.rglob("*") if p.is_file()):
+            stat = path.stat()
+            key = path.as_posix()
+            entry = known.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns \
+                    and _blob_path(entry["blob"]).exists():
+                files.append(entry)
+                continue
+            files.append({"path": key, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "blob": _put_file(path)})
+    return files
+
+
+def create_backup(engine) -> str:
+    """Делает снимок таблиц и файлов; возвращает имя снимка."""
+    with _Lock():
+        return _create_backup(engine)
+
+
+def _create_backup(engine) -> str:
+    snapshot = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    try:
+        previous = load_manifest()
+    except BackupError:
+        previous = {}
+
+    manifest = {"snapshot": snapshot, "created_at": datetime.utcnow().isoformat(), "tables": {}, "files": []}
+    with engine.connect() as connection:
+        # Все таблицы читаются из одного согласованного снимка базы
+        connection.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY"))
+        connection.execute(text("SET LOCAL statement_timeout = 0"))
+        for table in _tables():
+            manifest["tables"][table.name] = _dump_table(connection, table)
+        connection.rollback()
+    manifest["files"] = _collect_files(previous)
+
+    directory = BACKUP_DIR / "snapshots"
+    directory.mkdir(parents=True, exist_ok=True)
+    # Манифест пишется последним: недоделанный снимок не виден restore и prune
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".tmp") as temp:
+        json.dump(manifest, temp, ensure_ascii=False, indent=1)
+    os.replace(temp.name, directory / f"{snapshot}.json")
+    return snapshot
+
+
+def _referenced_blobs(manifest: dict):
+    for entry in manifest["tables"].values():
+        for chunk in entry["chunks"]:
+            yield chunk["blob"]
+    for item in manifest["files"]:
+        yield item["blob"]
+
+
+def verify_backup(snapshot: str = None, workers: int = BACKUP_WORKERS) -> list:
+    """Проверяет наличие и хэши всех блобов снимка; возвращает список проблем."""
+    manifest = load_manifest(snapshot)
+    blobs = sorted(set(_referenced_blobs(manifest)))
+
+    def check(digest):
+        path = _blob_path(digest)
+        if not path.exists():
+            return f"нет блоба {digest}"
+        if _file_digest(path) != digest:
+            return f"повреждён блоб {digest}"
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [problem for problem in pool.map(check, blobs) if problem]
+
+
+# --- восстановление ---
+
+def _load_chunk(engine, table_name: str, digest: str):
+    with gzip.open(_blob_path(digest), "rt") as f:
+        rows = "[" + ",".join(line for line in f.read().splitlines() if line) + "]"
+    with engine.begin() as connection:
+        # Триггеры итогов, агрегатов и счётчиков пропускают загрузку: эти данные уже в снимке
+        connection.execute(text("SET LOCAL app.archiving = 'on'"))
+        connection.execute(
+            text(f"INSERT INTO {table_name} SELECT * FROM jsonb_populate_recordset(NULL::{table_name}, CAST(:rows AS jsonb))"),
+            {"rows": rows}
+        )
+
+
+def _restore_file(item: dict):
+    target = Path(item["path"])
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=target.parent, delete=False) as temp:
+        with open(_blob_path(item["blob"]), "rb") as src:
+            shutil.copyfileobj(src, temp, READ_BUFFER)
+    os.replace(temp.name, target)
+
+
+def restore_backup(engine, snapshot: str = None, clean: bool = False, workers: int = BACKUP_WORKERS) -> dict:
+    """Восстанавливает таблицы и файлы из снимка; куски одной таблицы и файлы грузятся параллельно."""
+    manifest = load_manifest(snapshot)
+    problems = verify_backup(manifest["snapshot"], workers)
+    if problems:
+        raise BackupError("Снимок не прошёл проверку: " + "; ".join(problems[:10]))
+
+    tables = [table for table in _tables() if table.name in manifest["tables"]]
+    with engine.begin() as connection:
+        if clean:
+            connection.execute(text("TRUNCATE " + ", ".join(table.name for table in tables) + " CASCADE"))
+        else:
+            for table in tables:
+                if connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {table.name})")).scalar():
+                    raise BackupError(f"Таблица {table.name} не пуста; используйте --clean")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        files = pool.map(_restore_file, manifest["files"])
+        # Таблицы — по порядку внешних ключей, куски внутри таблицы — параллельно
+        for table in tables:
+            list(pool.map(
+                lambda chunk, name=table.name: _load_chunk(engine, name, chunk["blob"]),
+                manifest["tables"][table.name]["chunks"]
+            ))
+        list(files)
+
+    with engine.begin() as connection:
+        # Последовательности продолжаются после восстановленных id
+        for table in tables:
+            if "id" in table.columns and table.columns["id"].primary_key:
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"COALESCE((SELECT max(id) FROM {table.name}), 0) + 1, false) "
+                    f"WHERE pg_get_serial_sequence('{table.name}', 'id') IS NOT NULL"
+                ))
+    return {
+        "snapshot": manifest["snapshot"],
+        "rows": sum(manifest["tables"][table.name]["rows"] for table in tables),
+        "files": len(manifest["files"]),
+    }
+
+
+def prune_backups(keep: int) -> dict:
+    """Оставляет keep последних снимков и удаляет блобы, на которые они не ссылаются."""
+    with _Lock():
+        snapshots = list_snapshots()
+        removed = snapshots[:-keep] if keep > 0 else []
+        return _prune(removed)
+
+
+def _prune(removed) -> dict:
+    for snapshot in removed:
+        (BACKUP_DIR / "snapshots" / f"{snapshot}.json").unlink()
+    referenced = set()
+    for snapshot in list_snapshots():
+        referenced.update(_referenced_blobs(load_manifest(snapshot)))
+    blobs_removed = 0
+    for path in (BACKUP_DIR / "blobs").glob("*/*"):
+        if path.name not in referenced:
+            path.unlink()
+            blobs_removed += 1
+    return {"snapshots": len(removed), "blobs": blobs_removed}
@@ -1,13 +1,15 @@
 #!/bin/bash
+set -e
 
 # Переходим в папку проекта
 cd /root/fastapi_app
 
-# Добавляем все изменения
-git add .
+# Инкрементальный снимок базы, uploads и receipts (см. backup.py)
+./venv/bin/python manage.py backup
+./venv/bin/python manage.py backup-verify
+./venv/bin/python manage.py backup-prune --keep "${BACKUP_KEEP:-14}"
 
-# Создаем коммит с текущей датой
-git commit -m "Automatic backup $(date)"
-
-# Отправляем изменения в GitHub
-git push origin master
+# Копия на другой сервер: передаются только новые блобы и манифесты
+if [ -n "$BACKUP_REMOTE" ]; then
+    rsync -a "${BACKUP_DIR:-backups}/" "$BACKUP_REMOTE"
+fi
@@ -0,0 +1,83 @@
+"""Параллельное создание заказов: очередь на строках счётчиков sales_daily и order_status_counts.
+
+Каждый заказ в триггерах прибавляет к строке своего дня и статуса. Скрипт создаёт
+заказы из нескольких потоков (у каждого свой товар, так что общими остаются только
+счётчики) и печатает пропускную способность и задержки. Чтобы увидеть эффект
+шардирования, сравните запуск после `ROLLUP_SHARDS=1 python manage.py migrate` и после
+миграции со значением по умолчанию.
+
+Нужна рабочая база (DATABASE_URL). Временные клиент, товары и заказы удаляются по окончании.
+
+    python -m benchmarks.bench_concurrent_orders
+"""
+import threading
+import time
+from datetime import date
+
+import crud
+import models
+import schemas
+from database import SessionLocal
+
+THREADS = 16
+ORDERS_PER_THREAD = 50
+
+
+def worker(client_id, product_id, timings, identifiers, start):
+    db = SessionLocal()
+    try:
+        start.wait()
+        for _ in range(ORDERS_PER_THREAD):
+            started = time.perf_counter()
+            order = crud.create_order(db, schemas.OrderCreate(
+                client_id=client_id, status="pending",
+                items=[schemas.OrderItemCreate(product_id=product_id, quantity=1)]
+            ))
+            timings.append(time.perf_counter() - started)
+            identifiers.append(order.identifier)
+    finally:
+        db.close()
+
+
+def main():
+    db = SessionLocal()
+    client = models.Client(first_name="Бенч", last_name="Бенчев", middle_name="Бенчевич",
+                           birth_date=date(1990, 1, 1), phone="0", address="-")
+    db.add(client)
+    products = [models.Product(name=f"bench-concurrent-{n}", image="", price=1.0, stock=10 ** 9)
+                for n in range(THREADS)]
+    db.add_all(products)
+    db.commit()
+
+    timings, identifiers = [], []
+    start = threading.Barrier(THREADS + 1)
+    threads = [
+        threading.Thread(target=worker, args=(client.id, product.id, timings, identifiers, start))
+        for product in products
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        timings.sort()
+        print(f"{len(timings)} заказов в {THREADS} потоков за {elapsed:.2f} с: {len(timings) / elapsed:.0f} заказов/с")
+        print(f"задержка p50 {timings[len(timings) // 2] * 1000:.1f} мс, "
+              f"p95 {timings[int(len(timings) * 0.95)] * 1000:.1f} мс, "
+              f"max {timings[-1] * 1000:.1f} мс")
+    finally:
+        for identifier in identifiers:
+            crud.delete_order_by_identifier(db, identifier)
+        for product in products:
+            db.delete(product)
+        db.delete(client)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
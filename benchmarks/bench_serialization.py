@@ -0,0 +1,79 @@
+"""Сравнение сериализации страницы из 1000 заказов.
+
+    python -m benchmarks.bench_serialization
+"""
+import json
+import timeit
+from datetime import date
+from types import SimpleNamespace
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+
+import dto
+import schemas
+from responses import ORDER_LIST, dump_list
+
+ORDERS = 1000
+ITEMS_PER_ORDER = 5
+REPEAT = 20
+
+
+def make_orders(count: int = ORDERS, items: int = ITEMS_PER_ORDER):
+    # Объекты с атрибутами, как у ORM-строк
+    client = SimpleNamespace(
+        first_name="Иван", last_name="Иванов", middle_name="Иванович",
+        birth_date=date(1990, 1, 1), phone="+79990000000", address="Москва, ул. Ленина, 1"
+    )
+    orders = []
+    for order_id in range(1, count + 1):
+        order_items = [
+            SimpleNamespace(
+                id=order_id * 100 + n, product_id=n, quantity=n + 1,
+                product=SimpleNamespace(name=f"Товар {n}", image=f"uploads/{n}.jpg", price=100.0 + n, stock=50)
+            )
+            for n in range(items)
+        ]
+        orders.append(SimpleNamespace(
+            id=order_id, status="pending", client_id=1, identifier=f"III{order_id:06d}",
+            client=client, items=order_items
+        ))
+    return orders
+
+
+def make_order_rows(count: int = ORDERS, items: int = ITEMS_PER_ORDER):
+    # То же содержимое в виде DTO из проекций crud.get_orders
+    client = ("Иван", "Иванов", "Иванович", date(1990, 1, 1), "+79990000000", "Москва, ул. Ленина, 1")
+    return [
+        dto.OrderRow(
+            order_id, SimpleNamespace(value="pending"), 1, f"III{order_id:06d}", client=client,
+            items=[dto.OrderItemRow(order_id * 100 + n, n, n + 1, 100.0 + n, (f"Товар {n}", f"uploads/{n}.jpg", 100.0 + n, 50)) for n in range(items)]
+        )
+        for order_id in range(1, count + 1)
+    ]
+
+
+def default_path(rows):
+    # То, что делает FastAPI для response_model: модели -> dict -> json.dumps
+    models = TypeAdapter(List[schemas.OrderResponse]).validate_python(rows, from_attributes=True)
+    return json.dumps(jsonable_encoder(models)).encode("utf-8")
+
+
+def main():
+    rows = make_orders()
+    order_rows = make_order_rows()
+    cases = (
+        ("jsonable_encoder + json.dumps", default_path, rows),
+        ("TypeAdapter.dump_json", lambda r: dump_list(ORDER_LIST, r), rows),
+        ("DTO + to_json", lambda r: to_json([order.as_dict() for order in r]), order_rows),
+        ("DTO + to_json, без client/items", lambda r: to_json([order.as_dict(("id", "status", "identifier")) for order in r]), order_rows),
+    )
+    for name, func, data in cases:
+        seconds = min(timeit.repeat(lambda: func(data), number=1, repeat=REPEAT))
+        print(f"{name:32s} {seconds * 1000:8.2f} мс на {ORDERS} заказов")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Правка большого заказа: удаление и вставка всех позиций против изменения по разнице.
+
+Нужна рабочая база (DATABASE_URL). Скрипт создаёт временные клиента, товары и заказ
+и удаляет их по окончании.
+
+    python -m benchmarks.bench_update_order
+"""
+import time
+from datetime import date
+
+import crud
+import models
+import schemas
+from database import SessionLocal
+
+ITEMS = 500
+CHANGED = 25  # сколько позиций меняется при каждой правке
+REPEAT = 5
+
+
+def delete_and_reinsert(db, identifier, items):
+    # Прежняя реализация update_order_by_identifier
+    db_order = db.query(models.Order).filter(models.Order.identifier == identifier).first()
+    db.query(models.OrderItem).filter(models.OrderItem.order_id == db_order.id).delete()
+    for item in items:
+        db.query(models.Product).filter(models.Product.id == item.product_id).first()
+        db.add(models.OrderItem(order_id=db_order.id, product_id=item.product_id, quantity=item.quantity))
+    db.commit()
+
+
+def main():
+    db = SessionLocal()
+    client = models.Client(first_name="Бенч", last_name="Бенчев", middle_name="Бенчевич",
+                           birth_date=date(1990, 1, 1), phone="0", address="-")
+    db.add(client)
+    products = [models.Product(name=f"bench-{n}", image="", price=1.0, stock=10 ** 9) for n in range(ITEMS)]
+    db.add_all(products)
+    db.commit()
+    order = crud.create_order(db, schemas.OrderCreate(
+        client_id=client.id, status="pending",
+        items=[schemas.OrderItemCreate(product_id=p.id, quantity=1) for p in products]
+    ))
+    identifier = order.identifier
+
+    try:
+        for name, func in (("delete + reinsert", delete_and_reinsert), ("diff", crud.update_order_by_identifier)):
+            timings = []
+            for run in range(REPEAT):
+                # Каждая правка меняет количество у CHANGED позиций
+                items = [
+                    schemas.OrderItemCreate(product_id=p.id, quantity=2 + run if n < CHANGED else 1)
+                    for n, p in enumerate(products)
+                ]
+                started = time.perf_counter()
+                func(db, identifier, items)
+                timings.append(time.perf_counter() - started)
+            print(f"{name:20s} {min(timings) * 1000:8.2f} мс на заказ из {ITEMS} позиций")
+    finally:
+        crud.delete_order_by_identifier(db, identifier)
+        for product in products:
+            db.delete(product)
+        db.delete(client)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
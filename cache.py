@@ -0,0 +1,184 @@
+"""Кэш готовых ответов для каталожных GET-запросов.
+
+Ключ — путь плюс отсортированные параметры запроса и текущая версия набора данных
+("products", "clients"). Запись в таблицы через ORM-сессию увеличивает версию после
+commit, поэтому старые записи просто перестают находиться и вытесняются по LRU.
+
+RESPONSE_CACHE_BACKEND=local — версии живут в памяти процесса. Годится только для
+одного процесса: запись в другом воркере здесь не видна, и его кэш остаётся устаревшим.
+RESPONSE_CACHE_BACKEND=db — версии хранятся в таблице cache_versions, и все воркеры
+видят инвалидацию не позже чем через RESPONSE_CACHE_VERSION_TTL секунд. "products"
+увеличивается при каждом заказе (меняется stock), поэтому у версии, как у счётчиков
+в migrations.py, несколько строк-шардов: запись увеличивает свой шард, версия — их сумма.
+
+По умолчанию db, если процессов больше одного (WEB_WORKERS выставляет launcher.py,
+иначе смотрим WEB_CONCURRENCY), и local для одиночного процесса.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert
+
+import models
+from database import engine, SessionLocal
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "db" if WEB_WORKERS > 1 else "local")
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+CACHE_VERSION_TTL = float(os.getenv("RESPONSE_CACHE_VERSION_TTL", "1.0"))
+
+# Какие таблицы влияют на какие наборы данных
+NAMESPACES = {
+    models.Product: "products",
+    models.Client: "clients",
+}
+
+# Каталог товаров (catalog.py) зависит только от этих полей, изменение stock его не трогает
+CATALOG_NAMESPACE = "catalog"
+CATALOG_ATTRIBUTES = ("name", "price", "image")
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def version(self, namespace: str) -> int:
+        return self.versions.get(namespace, 0)
+
+    def get(self, namespace: str, version: int, key: str):
+        full_key = (namespace, version, key)
+        with self.lock:
+            entry = self.entries.get(full_key)
+            if entry is not None:
+                self.entries.move_to_end(full_key)
+            return entry
+
+    def set(self, namespace: str, version: int, key: str, body: bytes):
+        # version берём до построения ответа: если данные поменялись во время запроса,
+        # запись уйдёт под устаревшую версию и никогда не будет прочитана
+        entry = (body, make_etag(body))
+        with self.lock:
+            self.entries[(namespace, version, key)] = entry
+            self.entries.move_to_end((namespace, version, key))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, namespace: str):
+        with self.lock:
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SharedResponseCache(ResponseCache):
+    """Версии в PostgreSQL: тела ответов по-прежнему в памяти воркера."""
+
+    def __init__(self, engine, max_entries: int = CACHE_MAX_ENTRIES, version_ttl: float = CACHE_VERSION_TTL):
+        super().__init__(max_entries)
+        self.engine = engine
+        self.version_ttl = version_ttl
+        self.checked_at = 0.0
+
+    def _refresh_versions(self):
+        now = time.monotonic()
+        if now - self.checked_at < self.version_ttl:
+            return
+        table = models.CacheVersion
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(table.namespace, func.sum(table.version)).group_by(table.namespace)
+            ).all()
+        with self.lock:
+            self.versions = {namespace: int(version) for namespace, version in rows}
+            self.checked_at = now
+
+    def version(self, namespace: str) -> int:
+        self._refresh_versions()
+        return self.versions.get(namespace, 0)
+
+    def invalidate(self, namespace: str):
+        table = models.CacheVersion
+        statement = insert(table).values(namespace=namespace, shard=func.rollup_shard(), version=1)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.namespace, table.shard],
+            set_={"version": table.version + 1},
+        )
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+            # Шарды только растут, поэтому сумма тоже монотонна
+            version = connection.execute(
+                select(func.sum(table.version)).where(table.namespace == namespace)
+            ).scalar_one()
+        with self.lock:
+            self.versions[namespace] = int(version)
+
+
+def _touched_namespaces(session):
+    namespaces = session.info.setdefault("cache_namespaces", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        namespace = NAMESPACES.get(type(obj))
+        if namespace:
+            namespaces.add(namespace)
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, models.Product):
+            namespaces.add(CATALOG_NAMESPACE)
+    for obj in session.dirty:
+        if isinstance(obj, models.Product):
+            state = inspect(obj)
+            if any(state.attrs[attr].history.has_changes() for attr in CATALOG_ATTRIBUTES):
+                namespaces.add(CATALOG_NAMESPACE)
+
+
+def mark_dirty(session, namespace: str):
+    # Для изменений мимо ORM (bulk UPDATE/INSERT): инвалидировать после commit этой сессии
+    session.info.setdefault("cache_namespaces", set()).add(namespace)
+
+
+def register(session_factory, cache: ResponseCache):
+    """Подписывает фабрику сессий: изменённые через ORM таблицы инвалидируются после commit."""
+
+    @event.listens_for(session_factory, "before_flush")
+    def _before_flush(session, flush_context, instances):
+        _touched_namespaces(session)
+
+    @event.listens_for(session_factory, "after_commit")
+    def _after_commit(session):
+        for namespace in session.info.pop("cache_namespaces", set()):
+            cache.invalidate(namespace)
+
+    @event.listens_for(session_factory, "after_rollback")
+    def _after_rollback(session):
+        session.info.pop("cache_namespaces", None)
+
+
+def create_cache(engine) -> ResponseCache:
+    if CACHE_BACKEND == "db":
+        return SharedResponseCache(engine)
+    return ResponseCache()
+
+
+# Общий для процесса экземпляр; инвалидируется после commit любой сессии SessionLocal
+response_cache = create_cache(engine)
+register(SessionLocal, response_cache)
@@ -0,0 +1,169 @@
+"""Кэш справочника товаров в памяти процесса: id и название -> (id, name, price, image).
+
+Остатки (stock) сюда не попадают и всегда читаются из базы. Справочник перечитывается
+целиком, когда меняется версия "catalog" в cache.response_cache: её увеличивают
+create_product / update_product* / delete_product* и любые другие изменения
+названия, цены или картинки через ORM-сессию.
+
+Для подсказок по мере ввода (suggest) при той же перезагрузке строится
+отсортированный префиксный индекс: ключи — название целиком и с каждого следующего
+слова, в исходной записи и в транслитерации (textsearch.transliterate), поэтому
+"мол", "mol" и "3.2" находят "Молоко 3.2%". Поиск — bisect и проход по диапазону.
+
+В отличие от get_by_id / get_by_name, у suggest нет запроса в базу при промахе,
+поэтому справочник дополнительно перечитывается не реже раза в CATALOG_MAX_AGE
+секунд: даже если версия из другого воркера не дошла, подсказки отстают не дольше.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+import textsearch
+from cache import CATALOG_NAMESPACE, response_cache
+
+CATALOG_MAX_AGE = float(os.getenv("CATALOG_MAX_AGE", "30"))
+
+
+class ProductInfo(NamedTuple):
+    id: int
+    name: str
+    price: float
+    image: str
+
+
+def normalize_name(name: str) -> str:
+    # Та же семантика, что и у lower(name) = lower(:x) в запросах
+    return name.lower() if name else ""
+
+
+def _prefix_keys(name: str):
+    """Ключи (название целиком, с середины) для префиксного индекса."""
+    full, inner = set(), set()
+    for form in (" ".join(normalize_name(name).split()), textsearch.transliterate(name)):
+        if not form:
+            continue
+        full.add(form)
+        words = form.split(" ")
+        for index in range(1, len(words)):
+            inner.add(" ".join(words[index:]))
+    return full, inner - full
+
+
+def _scan(keys, prefix: str, limit: int, found: dict):
+    # keys отсортированы по (ключ, id): все ключи с префиксом идут подряд
+    position = bisect_left(keys, (prefix,))
+    while position < len(keys) and len(found) < limit:
+        key, info = keys[position]
+        if not key.startswith(prefix):
+            break
+        found.setdefault(info.id, info)
+        position += 1
+
+
+class ProductCatalog:
+    def __init__(self, versions=response_cache):
+        self.versions = versions
+        self.by_id = {}
+        self.by_name = {}
+        # Отсортированные пары (ключ, ProductInfo): совпадение с начала названия и с начала слова
+        self.full_keys = []
+        self.inner_keys = []
+        self.loaded_version = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def _reload(self, db: Session, version):
+        rows = db.execute(
+            select(models.Product.id, models.Product.name, models.Product.price, models.Product.image)
+            .order_by(models.Product.id)
+        ).all()
+        by_id = {}
+        by_name = {}
+        full_keys = []
+        inner_keys = []
+        for row in rows:
+            info = ProductInfo(*row)
+            by_id[info.id] = info
+            # При одинаковых названиях побеждает товар с меньшим id
+            by_name.setdefault(normalize_name(info.name), info)
+            full, inner = _prefix_keys(info.name)
+            full_keys.extend((key, info) for key in full)
+            inner_keys.extend((key, info) for key in inner)
+        full_keys.sort(key=lambda entry: (entry[0], entry[1].id))
+        inner_keys.sort(key=lambda entry: (entry[0], entry[1].id))
+        # Ссылки подменяются по одной; suggest читает без блокировки
+        self.by_id, self.by_name = by_id, by_name
+        self.full_keys, self.inner_keys = full_keys, inner_keys
+        self.loaded_version = version
+        self.loaded_at = time.monotonic()
+
+    def _is_fresh(self, version) -> bool:
+        return version == self.loaded_version and time.monotonic() - self.loaded_at < CATALOG_MAX_AGE
+
+    def ensure(self, db: Session):
+        version = self.versions.version(CATALOG_NAMESPACE)
+        if self._is_fresh(version):
+            return
+        with self.lock:
+            if not self._is_fresh(version):
+                self._reload(db, version)
+
+    def invalidate(self):
+        self.loaded_version = None
+
+    def get_by_id(self, db: Session, product_id: int) -> Optional[ProductInfo]:
+        self.ensure(db)
+        info = self.by_id.get(product_id)
+        if info is not None:
+            return info
+        row = db.execute(
+            select(models.Product.id, models.Product.name, models.Product.price, models.Product.image)
+            .filter(models.Product.id == product_id)
+        ).first()
+        if row is None:
+            return None
+        self.invalidate()
+        return ProductInfo(*row)
+
+    def get_by_name(self, db: Session, name: str) -> Optional[ProductInfo]:
+        self.ensure(db)
+        info = self.by_name.get(normalize_name(name))
+        if info is not None:
+            return info
+        # Товар мог появиться в другом воркере, а версия ещё не дошла: проверяем базу
+        row = db.execute(
+            select(models.Product.id, models.Product.name, models.Product.price, models.Product.image)
+            .filter(func.lower(models.Product.name) == func.lower(name))
+            .order_by(models.Product.id)
+            .limit(1)
+        ).first()
+        if row is None:
+            return None
+        self.invalidate()
+        return ProductInfo(*row)
+
+    def suggest(self, db: Session, prefix: str, limit: int = 10) -> List[ProductInfo]:
+        """До limit товаров, чьё название или слово в нём начинается с prefix.
+
+        Сначала совпадения с начала названия, затем с начала слова; внутри — по алфавиту.
+        """
+        self.ensure(db)
+        forms = []
+        for form in (" ".join(normalize_name(prefix).split()), textsearch.transliterate(prefix)):
+            if form and form not in forms:
+                forms.append(form)
+        found = {}
+        full_keys, inner_keys = self.full_keys, self.inner_keys
+        for keys in (full_keys, inner_keys):
+            for form in forms:
+                _scan(keys, form, limit, found)
+        return list(found.values())
+
+
+product_catalog = ProductCatalog()
@@ -1,20 +1,27 @@
 from pathlib import Path
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session
 from models import User
 from schemas import UserCreate, OrderCreate
 from utils import hash_password
 import models
 import schemas
+import dto
+import cache
+import events
+import receipt_render
+import receipt_store
+import receipt_scheduler
+import textsearch
+from catalog import product_catalog
 
 from datetime import date
 
 import unidecode
 
-from sqlalchemy import func
+from sqlalchemy import func, select, insert, update, delete, case, text
 
 from typing import List, Optional, Dict, Any
 
-from datetime import date, datetime
 import json
 from fastapi import HTTPException
 
@@ -24,25 +31,9 @@ from schemas import (
     ProductUpdate, ClientUpdateRequest, OrderStatusEnum
 )
 
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-# Импорт для преобразования суммы в слова
-from num2words import num2words
+# Сколько однофамильцев показывать в ответе 409 при поиске клиента по имени
+NAMESAKE_CANDIDATES = 10
 
-# Импорт для локализации даты
-import locale
-
-# Устанавливаем локализацию для русского языка
-locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
-
-pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
-
-RECEIPTS_DIR = Path("receipts")
-RECEIPTS_DIR.mkdir(exist_ok=True)
 
 def create_user(db: Session, user: UserCreate):
     db_user = User(
@@ -58,9 +49,6 @@ def create_user(db: Session, user: UserCreate):
     return db_user
 
 
-def get_orders(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Order).offset(skip).limit(limit).all()
-
 
 def delete_user(db: Session, user_id: int):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -78,109 +66,24 @@ def delete_user_by_username(db: Session, username: str):
     db.commit()
     return db_user
 
-def generate_receipt(identifier: str, db: Session):
-    # Находим заказ
-    db_order = db.query(models.Order).options(
-        joinedload(models.Order.client),
-        joinedload(models.Order.items).joinedload(models.OrderItem.product)
-    ).filter(models.Order.identifier == identifier).first()
-    if not db_order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    # Формируем путь для PDF-файла
-    receipt_path = RECEIPTS_DIR / f"{identifier}_receipt.pdf"
-    
-    # Создаём PDF с уменьшенными отступами
-    doc = SimpleDocTemplate(
-        str(receipt_path),
-        pagesize=A4,
-        leftMargin=15,
-        rightMargin=15,
-        topMargin=30,
-        bottomMargin=30
-    )
-    elements = []
-
-    # Параметры таблицы
-    padding = 5
-    table_width = A4[0] - 15 - 15
-    col_widths = [30, 60, 220, 80, 80, 80]
-    row_height = 30
-    styles = getSampleStyleSheet()
-    style_normal = styles['Normal']
-    style_normal.fontName = 'DejaVuSans'
-    style_normal.fontSize = 12
-    style_normal.leading = 20
-    style_normal.alignment = 0
-
-    # Заголовок
-    date_str = datetime.now().strftime("%d %B %Y г.").encode('utf-8').decode('utf-8')
-    elements.append(Paragraph(f"Товарный чек № {identifier} от {date_str}", style_normal))
-    elements.append(Paragraph("Поставщик: ИП Иванов И.И.", style_normal))
-
-    # Информация о покупателе
-    client_name = f"{db_order.client.last_name} {db_order.client.first_name}" if db_order.client else "Неизвестный клиент"
-    elements.append(Paragraph(f"Покупатель: {client_name}", style_normal))
-
-    # Пустая строка для отступа
-    elements.append(Paragraph("", style_normal))
-
-    # Данные для таблицы
-    table_data = [["№", "Артикул", "Товар", "Количество", "Цена", "Сумма"]]
-    total_amount = 0
-    for idx, item in enumerate(db_order.items, 1):
-        product = item.product
-        quantity = item.quantity
-        price = product.price
-        amount = quantity * price
-        total_amount += amount
-        table_data.append([
-            str(idx),
-            str(product.id),
-            product.name,
-            str(quantity),
-            f"{price:.1f}",
-            f"{amount:.1f}"
-        ])
-
-    # Создаём таблицу
-    table = Table(table_data, colWidths=col_widths, rowHeights=[row_height] * len(table_data))
-    table.setStyle(TableStyle([
-        ('FONT', (0, 0), (-1, -1), 'DejaVuSans'),
-        ('FONTSIZE', (0, 0), (-1, -1), 12),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-        ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-        ('LEFTPADDING', (0, 0), (-1, -1), padding),
-        ('RIGHTPADDING', (0, 0), (-1, -1), padding),
-        ('TOPPADDING', (0, 0), (-1, -1), 2),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
-    ]))
-    elements.append(table)
-
-    # Итоговая сумма
-    elements.append(Paragraph(f"Итого: {total_amount:.2f} руб.", style_normal))
-
-    # Сумма прописью
-    rubles = int(total_amount)
-    kopecks = int((total_amount - rubles) * 100)
-    amount_in_words = num2words(rubles, lang='ru').replace(' и ', ' ').capitalize() + " рублей"
-    if kopecks > 0:
-        amount_in_words += f" {kopecks:02d} копеек"
-    else:
-        amount_in_words += " 00 копеек"
-    elements.append(Paragraph(f"Всего наименований {len(db_order.items)}, на сумму {total_amount:.2f} руб.", style_normal))
-    elements.append(Paragraph(amount_in_words, style_normal))
-
-    # Подписи
-    elements.append(Paragraph("Отпустил _______________  Получил _______________", style_normal))
-
-    # Создаём PDF
-    doc.build(elements)
+def generate_receipt(identifier: str, db: Session, fmt: str = receipt_render.DEFAULT_FORMAT):
+    # Рендеры одного чека во всех воркерах идут по очереди, поэтому последним
+    # записывается чек по самым свежим данным заказа
+    with receipt_store.render_lock(identifier):
+        # Отметки, запись файла и индекс — через соединение блокировки, без новых из пула
+        started = receipt_scheduler.now(identifier)
+        stale = receipt_scheduler.is_dirty(identifier)
+        data = receipt_render.build_receipt_data(db, identifier)
+        receipt_store.save(identifier, receipt_render.FORMATS[fmt].render(data), fmt)
+        if stale:
+            # Остальные форматы собраны по старым данным — перегенерируются при запросе
+            receipt_store.delete_receipt(identifier, keep=fmt)
+        # Правки, отмеченные после начала рендера, в этот чек могли не попасть
+        receipt_scheduler.clear(identifier, started)
 
     return {"message": f"Чек для заказа {identifier} успешно создан"}
 
+
 def generate_identifier(client: models.Client, order_id: int) -> str:
     # Транслитерация первых букв
     last_initial = unidecode.unidecode(client.last_name[0]).upper() if client.last_name else 'X'
@@ -201,13 +104,10 @@ def create_order(db: Session, order: schemas.OrderCreate):
     temp_identifier = generate_identifier(db_client, 0)
     db_order = models.Order(status=order.status, client_id=order.client_id, identifier=temp_identifier)
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-    
-    identifier = generate_identifier(db_client, db_order.id)
-    db_order.identifier = identifier
-    db.commit()
-    db.refresh(db_order)
+    # id нужен для идентификатора; commit один на весь заказ, и событие order_created
+    # уходит уже с окончательным идентификатором
+    db.flush()
+    db_order.identifier = generate_identifier(db_client, db_order.id)
 
     for item in order.items:
         db_product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
@@ -227,6 +127,90 @@ def create_order(db: Session, order: schemas.OrderCreate):
     db.refresh(db_order)
     return db_order
 
+def create_orders_bulk(db: Session, orders: List[schemas.OrderCreate]):
+    """Создаёт пачку заказов несколькими запросами на всю пачку.
+
+    Заказ с ошибкой (нет клиента/товара, не хватает остатка) пропускается, остальные
+    создаются. Возвращает список schemas.BulkOrderResult в порядке входных заказов.
+    """
+    results = [None] * len(orders)
+
+    # Клиенты и товары всей пачки — по одному запросу
+    client_ids = {order.client_id for order in orders}
+    product_ids = {item.product_id for order in orders for item in order.items}
+    clients = {c.id: c for c in db.query(models.Client).filter(models.Client.id.in_(client_ids)).all()} if client_ids else {}
+    products = {
+        p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(product_ids)).with_for_update().all()
+    } if product_ids else {}
+
+    # Резервируем остатки в памяти, заказ за заказом
+    stock = {product_id: product.stock for product_id, product in products.items()}
+    accepted = []
+    for index, order in enumerate(orders):
+        error = None
+        if order.client_id not in clients:
+            error = "Client not found"
+        requested = {}
+        for item in order.items:
+            if error:
+                break
+            if item.product_id not in products:
+                error = f"Product with id {item.product_id} not found"
+            elif item.quantity <= 0:
+                error = "Quantity must be positive"
+            else:
+                requested[item.product_id] = requested.get(item.product_id, 0) + item.quantity
+        if not error:
+            for product_id, quantity in requested.items():
+                if stock[product_id] < quantity:
+                    error = f"Not enough stock for product {products[product_id].name}"
+                    break
+        if error:
+            results[index] = schemas.BulkOrderResult(index=index, success=False, error=error)
+            continue
+        for product_id, quantity in requested.items():
+            stock[product_id] -= quantity
+        accepted.append((index, order, requested))
+
+    if accepted:
+        # id заранее берём из последовательности, чтобы сразу посчитать identifier
+        order_ids = db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('orders', 'id')) FROM generate_series(1, :count)"),
+            {"count": len(accepted)}
+        ).scalars().all()
+
+        order_rows = []
+        item_rows = []
+        for (index, order, requested), order_id in zip(accepted, order_ids):
+            identifier = generate_identifier(clients[order.client_id], order_id)
+            order_rows.append({
+                "id": order_id,
+                "status": models.OrderStatus(order.status.value),
+                "client_id": order.client_id,
+                "identifier": identifier,
+            })
+            # Одна строка на товар: повторы товара в заказе уже сложены в requested
+            item_rows.extend(
+                {"order_id": order_id, "product_id": product_id, "quantity": quantity}
+                for product_id, quantity in requested.items()
+            )
+            results[index] = schemas.BulkOrderResult(index=index, success=True, id=order_id, identifier=identifier)
+            events.record(db, "order_created", order_id, identifier)
+
+        db.execute(insert(models.Order), order_rows)
+        if item_rows:
+            db.execute(insert(models.OrderItem), item_rows)
+        changed = [
+            {"id": product_id, "stock": stock[product_id]}
+            for product_id, product in products.items() if stock[product_id] != product.stock
+        ]
+        if changed:
+            db.execute(update(models.Product), changed)
+        cache.mark_dirty(db, "products")
+        db.commit()
+
+    return results
+
 def update_existing_orders(db: Session):
     orders = db.query(models.Order).all()
     for order in orders:
@@ -272,12 +256,32 @@ def delete_product(db: Session, product_id: int):
     db.commit()
     return db_product
 
-def get_products(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Product).offset(skip).limit(limit).all()
+def get_products(db: Session, skip: int = 0, limit: int = 10, fields=dto.PRODUCT_FIELDS):
+    # Только нужные колонки, строки — кортежи в порядке fields
+    columns = [getattr(models.Product, field) for field in fields]
+    return db.execute(select(*columns).order_by(models.Product.id).offset(skip).limit(limit)).all()
+
+def get_products_by_ids(db: Session, ids: List[int], fields=dto.PRODUCT_FIELDS) -> Dict[int, tuple]:
+    # Один запрос IN (...) на всю пачку; порядок ответа восстанавливает вызывающий
+    columns = [models.Product.id] + [getattr(models.Product, field) for field in fields]
+    rows = db.execute(select(*columns).where(models.Product.id.in_(set(ids)))).all()
+    return {row[0]: tuple(row[1:]) for row in rows}
 
 def get_product_by_id(db: Session, product_id: int):
     return db.query(models.Product).filter(models.Product.id == product_id).first()
 
+def get_product_by_name(db: Session, name: str):
+    # id берём из справочника в памяти, строку (ради актуального stock) — по первичному ключу
+    info = product_catalog.get_by_name(db, name)
+    if not info:
+        return None
+    return db.get(models.Product, info.id)
+
+def get_clients_by_ids(db: Session, ids: List[int], fields=dto.CLIENT_FIELDS) -> Dict[int, tuple]:
+    columns = [models.Client.id] + [getattr(models.Client, field) for field in fields]
+    rows = db.execute(select(*columns).where(models.Client.id.in_(set(ids)))).all()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
 def get_client_by_id(db: Session, client_id: int):
     return db.query(models.Client).filter(models.Client.id == client_id).first()
 
@@ -357,11 +361,110 @@ def delete_client(db: Session, client_id: int):
     
     return db_client
 
-def get_clients(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Client).offset(skip).limit(limit).all()
+def get_clients(db: Session, skip: int = 0, limit: int = 10, fields=dto.CLIENT_FIELDS):
+    columns = [getattr(models.Client, field) for field in fields]
+    return db.execute(select(*columns).order_by(models.Client.id).offset(skip).limit(limit)).all()
+
+ORDER_SORT_FIELDS = ("id", "total_amount", "item_count")
 
-def get_orders(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Order).offset(skip).limit(limit).all()
+def get_orders(
+    db: Session,
+    skip: int = 0,
+    limit: int = 10,
+    fields=dto.ORDER_FIELDS,
+    sort: Optional[str] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    min_items: Optional[int] = None,
+    max_items: Optional[int] = None,
+    status: Optional[OrderStatusEnum] = None,
+    client_id: Optional[int] = None,
+    identifiers: Optional[List[str]] = None,
+):
+    columns = [
+        models.Order.id, models.Order.status, models.Order.client_id, models.Order.identifier,
+        models.Order.total_amount, models.Order.item_count
+    ]
+    with_client = "client" in fields
+    if with_client:
+        columns += [getattr(models.Client, field) for field in dto.ORDER_CLIENT_FIELDS]
+    query = select(*columns)
+
+    # Для pending/ready используются частичные индексы по незавершённым заказам
+    if status is not None:
+        query = query.where(models.Order.status == models.OrderStatus(status.value))
+    if client_id is not None:
+        query = query.where(models.Order.client_id == client_id)
+    if identifiers is not None:
+        query = query.where(models.Order.identifier.in_(set(identifiers)))
+    # Итоги хранятся в самой таблице orders, фильтры и сортировка без join
+    if min_total is not None:
+        query = query.where(models.Order.total_amount >= min_total)
+    if max_total is not None:
+        query = query.where(models.Order.total_amount <= max_total)
+    if min_items is not None:
+        query = query.where(models.Order.item_count >= min_items)
+    if max_items is not None:
+        query = query.where(models.Order.item_count <= max_items)
+    if sort:
+        column = getattr(models.Order, sort.lstrip("-"))
+        query = query.order_by(column.desc() if sort.startswith("-") else column.asc(), models.Order.id)
+    else:
+        query = query.order_by(models.Order.id)
+    query = query.offset(skip).limit(limit)
+    if with_client:
+        query = query.outerjoin(models.Client, models.Client.id == models.Order.client_id)
+
+    orders = []
+    for row in db.execute(query):
+        client = tuple(row[6:]) if with_client and row[6] is not None else None
+        orders.append(dto.OrderRow(*row[:6], client=client))
+
+    if "items" in fields and orders:
+        # Все позиции страницы одним запросом вместо ленивой загрузки на каждый заказ
+        by_id = {order.id: order for order in orders}
+        for order in orders:
+            order.items = []
+        item_query = (
+            select(
+                models.OrderItem.order_id, models.OrderItem.id, models.OrderItem.product_id, models.OrderItem.quantity,
+                models.OrderItem.price, *[getattr(models.Product, field) for field in dto.ORDER_PRODUCT_FIELDS]
+            )
+            .join(models.Product, models.Product.id == models.OrderItem.product_id)
+            .where(models.OrderItem.order_id.in_(list(by_id)))
+            .order_by(models.OrderItem.id)
+        )
+        for row in db.execute(item_query):
+            by_id[row[0]].items.append(dto.OrderItemRow(row[1], row[2], row[3], row[4], tuple(row[5:])))
+    return orders
+
+def get_orders_by_identifiers(db: Session, identifiers: List[str], fields=dto.ORDER_FIELDS) -> Dict[str, dto.OrderRow]:
+    # Заказы, клиенты и позиции — тем же путём, что и список: один запрос на заказы, один на позиции
+    unique = set(identifiers)
+    orders = get_orders(db, 0, len(unique), fields, identifiers=list(unique))
+    return {order.identifier: order for order in orders}
+
+def get_order_status_counts(db: Session):
+    # Счётчики ведёт триггер на orders, COUNT(*) по заказам не выполняется. Архивные
+    # заказы не учитываются: archive.py вычитает их при переносе
+    counts = {status.value: 0 for status in models.OrderStatus}
+    rows = db.execute(
+        select(models.OrderStatusCount.status, func.sum(models.OrderStatusCount.count))
+        .group_by(models.OrderStatusCount.status)
+    )
+    for status, count in rows:
+        counts[status] = int(count)
+    counts["total"] = sum(counts.values())
+    return counts
+
+def update_order_status(db: Session, identifier: str, status: OrderStatusEnum):
+    db_order = db.query(models.Order).filter(models.Order.identifier == identifier).first()
+    if not db_order:
+        return None
+    db_order.status = models.OrderStatus(status.value)
+    db.commit()
+    db.refresh(db_order)
+    return db_order
 
 def get_order(db: Session, order_id: int):
     return db.query(models.Order).filter(models.Order.id == order_id).first()
@@ -376,6 +479,40 @@ def search_clients_by_name(db: Session, first_name: str = None, last_name: str =
         query = query.filter(func.lower(models.Client.last_name) == func.lower(last_name))
     return query.all()
 
+def search_clients(db: Session, query: str, limit: int = 20):
+    """Нечёткий поиск клиентов по ФИО (в любой раскладке и с опечатками) и телефону.
+
+    Возвращает клиентов по убыванию совпадения; однофамильцы не схлопываются.
+    """
+    name, phone = textsearch.split_query(query)
+    if not name and not phone:
+        return []
+    score = []
+    conditions = []
+    if name:
+        # word_similarity: запрос сравнивается с самым похожим фрагментом ФИО
+        db.execute(
+            text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+            {"threshold": str(textsearch.CLIENT_SEARCH_THRESHOLD)}
+        )
+        conditions.append(models.Client.search_name.op("%>")(name))
+        score.append(func.word_similarity(name, models.Client.search_name))
+    if phone:
+        conditions.append(models.Client.phone_normalized.contains(phone, autoescape=True))
+        score.append(case(
+            (models.Client.phone_normalized == phone, 1.0),
+            (models.Client.phone_normalized.endswith(phone, autoescape=True), 0.8),
+            else_=0.6
+        ))
+    rank = score[0] if len(score) == 1 else score[0] + score[1]
+    return (
+        db.query(models.Client)
+        .filter(*conditions)
+        .order_by(rank.desc(), models.Client.id)
+        .limit(limit)
+        .all()
+    )
+
 def search_products_by_name(db: Session, name: str):
     return db.query(models.Product).filter(func.lower(models.Product.name).like(f"%{name.lower()}%")).all()
 
@@ -383,6 +520,30 @@ def get_order_by_identifier(db: Session, identifier: str):
     return db.query(models.Order).filter(models.Order.identifier == identifier).first()
 
 
+def find_client_by_name(db: Session, first_name: str = None, last_name: str = None, hint: str = "use the client id"):
+    """Клиент по имени/фамилии или None; среди однофамильцев не выбираем наугад — 409 со списком."""
+    query = db.query(models.Client)
+    if first_name:
+        query = query.filter(func.lower(models.Client.first_name) == func.lower(first_name))
+    if last_name:
+        query = query.filter(func.lower(models.Client.last_name) == func.lower(last_name))
+    matches = query.order_by(models.Client.id).limit(NAMESAKE_CANDIDATES + 1).all()
+    if len(matches) > 1:
+        raise HTTPException(status_code=409, detail={
+            "message": f"Several clients match this name, {hint}",
+            "candidates": [
+                {
+                    "id": client.id,
+                    "first_name": client.first_name,
+                    "last_name": client.last_name,
+                    "middle_name": client.middle_name,
+                    "phone": client.phone,
+                }
+                for client in matches[:NAMESAKE_CANDIDATES]
+            ],
+        })
+    return matches[0] if matches else None
+
 def update_client_by_name(
     db: Session,
     first_name: str = None,
@@ -394,12 +555,7 @@ def update_client_by_name(
     new_phone: str = None,
     new_address: str = None
 ):
-    query = db.query(models.Client)
-    if first_name:
-        query = query.filter(func.lower(models.Client.first_name) == func.lower(first_name))
-    if last_name:
-        query = query.filter(func.lower(models.Client.last_name) == func.lower(last_name))
-    db_client = query.first()
+    db_client = find_client_by_name(db, first_name, last_name, "use PUT /clients/{client_id}")
     if not db_client:
         return None
     if new_first_name is not None:
@@ -441,26 +597,91 @@ def update_product_by_name(
     db.refresh(db_product)
     return db_product
 
+def diff_order_items(current: List[tuple], requested: Dict[int, int]):
+    """Сравнивает текущие позиции заказа с желаемыми.
+
+    current — кортежи (item_id, product_id, quantity), requested — product_id -> quantity.
+    Возвращает (inserts, updates, deletes, deltas): новые product_id -> quantity,
+    item_id -> quantity, item_id на удаление и изменение количества по товарам.
+    """
+    rows_by_product = {}
+    for item_id, product_id, quantity in current:
+        rows_by_product.setdefault(product_id, []).append((item_id, quantity))
+
+    inserts, updates, deletes, deltas = {}, {}, [], {}
+    for product_id, rows in rows_by_product.items():
+        old_quantity = sum(quantity for _, quantity in rows)
+        new_quantity = requested.get(product_id, 0)
+        if new_quantity != old_quantity:
+            deltas[product_id] = new_quantity - old_quantity
+        if new_quantity == 0:
+            deletes.extend(item_id for item_id, _ in rows)
+            continue
+        # Оставляем одну строку на товар, дубликаты удаляем
+        (keep_id, keep_quantity), extra = rows[0], rows[1:]
+        if keep_quantity != new_quantity:
+            updates[keep_id] = new_quantity
+        deletes.extend(item_id for item_id, _ in extra)
+    for product_id, quantity in requested.items():
+        if product_id not in rows_by_product and quantity > 0:
+            inserts[product_id] = quantity
+            deltas[product_id] = quantity
+    return inserts, updates, deletes, deltas
+
 def update_order_by_identifier(db: Session, identifier: str, items: List[schemas.OrderItemCreate]):
     db_order = db.query(models.Order).filter(models.Order.identifier == identifier).first()
     if not db_order:
         return None
-    
-    # Удаляем старые элементы заказа
-    db.query(models.OrderItem).filter(models.OrderItem.order_id == db_order.id).delete()
-    
-    # Добавляем новые элементы
+
+    requested = {}
     for item in items:
-        db_product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not db_product:
-            raise HTTPException(status_code=404, detail=f"Product with id {item.product_id} not found")
-        db_item = models.OrderItem(
-            order_id=db_order.id,
-            product_id=item.product_id,
-            quantity=item.quantity
+        if item.quantity < 0:
+            raise HTTPException(status_code=400, detail="Quantity must be non-negative")
+        requested[item.product_id] = requested.get(item.product_id, 0) + item.quantity
+
+    current = db.execute(
+        select(models.OrderItem.id, models.OrderItem.product_id, models.OrderItem.quantity)
+        .where(models.OrderItem.order_id == db_order.id)
+        .order_by(models.OrderItem.id)
+    ).all()
+    inserts, updates, deletes, deltas = diff_order_items(current, requested)
+    if not (inserts or updates or deletes):
+        return db_order
+
+    # Проверяем существование и остатки всех затронутых товаров одним запросом
+    stocks = dict(db.execute(
+        select(models.Product.id, models.Product.stock)
+        .where(models.Product.id.in_(set(inserts) | set(deltas)))
+        .with_for_update()
+    ).all())
+    for product_id in inserts:
+        if product_id not in stocks:
+            raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
+    for product_id, delta in deltas.items():
+        if delta > 0 and stocks.get(product_id, 0) < delta:
+            raise HTTPException(status_code=400, detail=f"Not enough stock for product {product_id}")
+
+    if deletes:
+        db.execute(delete(models.OrderItem).where(models.OrderItem.id.in_(deletes)))
+    if updates:
+        db.execute(update(models.OrderItem), [{"id": item_id, "quantity": quantity} for item_id, quantity in updates.items()])
+    if inserts:
+        db.execute(insert(models.OrderItem), [
+            {"order_id": db_order.id, "product_id": product_id, "quantity": quantity}
+            for product_id, quantity in inserts.items()
+        ])
+    # Итоговые изменения остатков — одним UPDATE с CASE по id
+    deltas = {product_id: delta for product_id, delta in deltas.items() if product_id in stocks}
+    if deltas:
+        db.execute(
+            update(models.Product)
+            .where(models.Product.id.in_(deltas))
+            .values(stock=models.Product.stock - case(deltas, value=models.Product.id))
+            .execution_options(synchronize_session=False)
         )
-        db.add(db_item)
-    
+        cache.mark_dirty(db, "products")
+    events.record(db, "order_items_changed", db_order.id, db_order.identifier)
+
     db.commit()
     db.refresh(db_order)
     return db_order
@@ -499,21 +720,34 @@ def update_item_quantity(db: Session, identifier: str, product_id: int, quantity
     db.refresh(db_order)
     return db_order
 
-def create_order_by_form(db: Session, client_first_name: str, client_last_name: str, status: OrderStatusEnum, items: List[OrderItemCreateByName]):
-    # Находим клиента по имени/фамилии
-    query = db.query(models.Client)
-    if client_first_name:
-        query = query.filter(func.lower(models.Client.first_name) == func.lower(client_first_name))
-    if client_last_name:
-        query = query.filter(func.lower(models.Client.last_name) == func.lower(client_last_name))
-    db_client = query.first()
-    if not db_client:
-        raise HTTPException(status_code=404, detail="Client not found")
+def create_order_by_form(db: Session, client_first_name: str, client_last_name: str, status: OrderStatusEnum, items: List[OrderItemCreateByName], client_id: Optional[int] = None):
+    if client_id is not None:
+        db_client = db.query(models.Client).filter(models.Client.id == client_id).first()
+        if not db_client:
+            raise HTTPException(status_code=404, detail="Client not found")
+    else:
+        db_client = find_client_by_name(db, client_first_name, client_last_name, "pass client_id")
+        if not db_client:
+            raise HTTPException(status_code=404, detail="Client not found")
     
+    # Названия разрешаем через справочник в памяти, без запроса на каждую позицию
+    resolved = []
+    for item in items:
+        info = product_catalog.get_by_name(db, item.product_name)
+        if not info:
+            raise HTTPException(status_code=404, detail=f"Product with name {item.product_name} not found")
+        resolved.append((info.id, item))
+
+    # Остатки берём из базы одним запросом
+    products = {}
+    if resolved:
+        product_ids = {product_id for product_id, _ in resolved}
+        products = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(product_ids)).with_for_update().all()}
+
     # Создаём список товаров по их названиям
     items_with_ids = []
-    for item in items:
-        db_product = db.query(models.Product).filter(func.lower(models.Product.name) == func.lower(item.product_name)).first()
+    for product_id, item in resolved:
+        db_product = products.get(product_id)
         if not db_product:
             raise HTTPException(status_code=404, detail=f"Product with name {item.product_name} not found")
         if db_product.stock < item.quantity:
@@ -525,13 +759,9 @@ def create_order_by_form(db: Session, client_first_name: str, client_last_name:
     temp_identifier = generate_identifier(db_client, 0)
     db_order = models.Order(status=status, client_id=db_client.id, identifier=temp_identifier)
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-    
-    identifier = generate_identifier(db_client, db_order.id)
-    db_order.identifier = identifier
-    db.commit()
-    db.refresh(db_order)
+    # Как в create_order: один commit, событие уходит с окончательным идентификатором
+    db.flush()
+    db_order.identifier = generate_identifier(db_client, db_order.id)
 
     for item in items_with_ids:
         db_item = models.OrderItem(
@@ -544,12 +774,11 @@ def create_order_by_form(db: Session, client_first_name: str, client_last_name:
     db.commit()
     db.refresh(db_order)
 
-    # Генерируем чек для нового заказа
+    # Чек для нового заказа сгенерирует планировщик или первый запрос чека
     try:
-        generate_receipt(db_order.identifier, db)
-        print(f"Чек для заказа {db_order.identifier} сгенерирован при создании заказа")
+        receipt_scheduler.mark_dirty([db_order.identifier])
     except Exception as e:
-        print(f"Не удалось сгенерировать чек для заказа {db_order.identifier} при создании: {str(e)}")
+        print(f"Не удалось поставить в очередь чек для заказа {db_order.identifier} при создании: {str(e)}")
 
     return db_order
 
@@ -558,7 +787,7 @@ def add_item_to_order_by_name(db: Session, identifier: str, item: schemas.OrderI
     if not db_order:
         return None
 
-    db_product = db.query(models.Product).filter(func.lower(models.Product.name) == func.lower(item.product_name)).first()
+    db_product = get_product_by_name(db, item.product_name)
     if not db_product:
         raise HTTPException(status_code=404, detail=f"Product with name {item.product_name} not found")
 
@@ -597,7 +826,7 @@ def update_item_quantity_by_name(db: Session, identifier: str, product_name: str
     if not db_order:
         return None
     
-    db_product = db.query(models.Product).filter(func.lower(models.Product.name) == func.lower(product_name)).first()
+    db_product = get_product_by_name(db, product_name)
     if not db_product:
         raise HTTPException(status_code=404, detail=f"Product with name {product_name} not found")
     
@@ -631,6 +860,82 @@ def update_item_quantity_by_name(db: Session, identifier: str, product_name: str
     db.refresh(db_order)
     return db_order
 
+def apply_item_operations(db: Session, identifier: str, operations: List[schemas.OrderItemOperation]):
+    """Применяет список правок позиций заказа одной транзакцией.
+
+    Остатки меняются на итоговую разницу по каждому товару; при любой ошибке
+    ничего не сохраняется.
+    """
+    db_order = db.query(models.Order).filter(models.Order.identifier == identifier).first()
+    if not db_order:
+        return None
+
+    items = db.query(models.OrderItem).filter(models.OrderItem.order_id == db_order.id).order_by(models.OrderItem.id).all()
+    items_by_id = {item.id: item for item in items}
+    # В заказе может быть несколько строк одного товара: считаем их суммарное количество
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    for operation in operations:
+        if operation.product_id is not None:
+            info = product_catalog.get_by_id(db, operation.product_id)
+            label = operation.product_id
+        elif operation.product_name:
+            info = product_catalog.get_by_name(db, operation.product_name)
+            label = operation.product_name
+        else:
+            raise HTTPException(status_code=400, detail="Each operation needs product_name or product_id")
+        if operation.op != "remove" and not info and label not in quantities:
+            raise HTTPException(status_code=404, detail=f"Product {label} not found")
+        product_id = info.id if info else label
+
+        current = quantities.get(product_id, 0)
+        if operation.op == "add":
+            if operation.quantity <= 0:
+                raise HTTPException(status_code=400, detail="Quantity must be positive")
+            quantities[product_id] = current + operation.quantity
+        elif operation.op == "set":
+            if operation.quantity < 0:
+                raise HTTPException(status_code=400, detail="Quantity must be non-negative")
+            if product_id not in quantities:
+                raise HTTPException(status_code=404, detail="Item not found in order")
+            quantities[product_id] = operation.quantity
+        else:
+            if product_id not in quantities:
+                raise HTTPException(status_code=404, detail="Item not found in order")
+            quantities[product_id] = 0
+
+    # Дубликаты строк схлопываются в одну, как в update_order_by_identifier
+    inserts, updates, deletes, deltas = diff_order_items(
+        [(item.id, item.product_id, item.quantity) for item in items], quantities
+    )
+    if not (inserts or updates or deletes):
+        return db_order
+
+    # Все затронутые товары одним запросом с блокировкой
+    products = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(deltas)).with_for_update().all()}
+    for product_id, delta in deltas.items():
+        product = products.get(product_id)
+        if product is None:
+            if delta > 0:
+                raise HTTPException(status_code=404, detail=f"Product with id {product_id} not found")
+            continue
+        if delta > 0 and product.stock < delta:
+            raise HTTPException(status_code=400, detail=f"Not enough stock for product {product.name}")
+        product.stock -= delta
+
+    for item_id in deletes:
+        db.delete(items_by_id[item_id])
+    for item_id, quantity in updates.items():
+        items_by_id[item_id].quantity = quantity
+    for product_id, quantity in inserts.items():
+        db.add(models.OrderItem(order_id=db_order.id, product_id=product_id, quantity=quantity))
+
+    db.commit()
+    db.refresh(db_order)
+    return db_order
+
 def delete_product_by_name(db: Session, name: str):
     db_product = db.query(models.Product).filter(func.lower(models.Product.name) == func.lower(name)).first()
     if not db_product:
@@ -657,17 +962,8 @@ def delete_product_by_name(db: Session, name: str):
 def delete_client_by_name(db: Session, first_name: str = None, last_name: str = None):
     print(f"Searching for client with first_name='{first_name}', last_name='{last_name}'")
     
-    query = db.query(models.Client)
-    if first_name:
-        query = query.filter(func.lower(models.Client.first_name) == func.lower(first_name))
-    if last_name:
-        query = query.filter(func.lower(models.Client.last_name) == func.lower(last_name))
-    
-    # Выводим всех клиентов, соответствующих запросу
-    matching_clients = query.all()
-    print(f"Found {len(matching_clients)} matching clients: {[f'{c.first_name} {c.last_name}' for c in matching_clients]}")
-    
-    db_client = query.first()
+    # Каскадное удаление только однозначно найденного клиента, иначе 409 со списком однофамильцев
+    db_client = find_client_by_name(db, first_name, last_name, "use DELETE /clients/{client_id}")
     if not db_client:
         print("Client not found in database")
         return None
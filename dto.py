@@ -0,0 +1,72 @@
+"""Компактные объекты для списков: только колонки, без ORM-сущностей и identity map.
+
+Форма вывода совпадает с schemas.OrderResponse / ClientResponse / ProductResponse,
+но в ответ попадают лишь поля, перечисленные в ?fields=.
+"""
+
+CLIENT_FIELDS = ("id", "first_name", "last_name", "middle_name", "birth_date", "phone", "address")
+PRODUCT_FIELDS = ("id", "name", "image", "price", "stock")
+ORDER_FIELDS = ("id", "status", "client_id", "identifier", "total_amount", "item_count", "client", "items")
+
+# Вложенные объекты заказа (как ClientCreate и ProductCreate в OrderResponse)
+ORDER_CLIENT_FIELDS = ("first_name", "last_name", "middle_name", "birth_date", "phone", "address")
+ORDER_PRODUCT_FIELDS = ("name", "image", "price", "stock")
+
+
+class OrderItemRow:
+    __slots__ = ("id", "product_id", "quantity", "price", "product")
+
+    def __init__(self, id, product_id, quantity, price, product):
+        self.id = id
+        self.product_id = product_id
+        self.quantity = quantity
+        self.price = price
+        self.product = product  # кортеж в порядке ORDER_PRODUCT_FIELDS
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "product_id": self.product_id,
+            "quantity": self.quantity,
+            "price": self.price,
+            "product": dict(zip(ORDER_PRODUCT_FIELDS, self.product)),
+        }
+
+
+class OrderRow:
+    __slots__ = ORDER_FIELDS
+
+    def __init__(self, id, status, client_id, identifier, total_amount=0, item_count=0, client=None, items=None):
+        self.id = id
+        self.status = status
+        self.client_id = client_id
+        self.identifier = identifier
+        self.total_amount = total_amount
+        self.item_count = item_count
+        self.client = client  # кортеж в порядке ORDER_CLIENT_FIELDS или None
+        self.items = items
+
+    def as_dict(self, fields=ORDER_FIELDS):
+        result = {}
+        for field in fields:
+            if field == "status":
+                result["status"] = self.status.value if self.status is not None else None
+            elif field == "client":
+                result["client"] = dict(zip(ORDER_CLIENT_FIELDS, self.client)) if self.client else None
+            elif field == "items":
+                result["items"] = [item.as_dict() for item in self.items or ()]
+            else:
+                result[field] = getattr(self, field)
+        return result
+
+
+def parse_fields(fields, allowed):
+    """Разбирает ?fields=a,b,c; без параметра возвращает все поля."""
+    if not fields:
+        return allowed
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    # Порядок полей как в схеме, без дублей
+    return tuple(field for field in allowed if field in requested)
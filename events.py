@@ -0,0 +1,219 @@
+"""Поток изменений заказов для /events/orders (SSE) и /ws/orders.
+
+События собираются из ORM-сессий (создание, правка, смена статуса, удаление заказа
+и изменения позиций) и публикуются после commit. При ORDER_EVENTS_BACKEND=postgres
+(по умолчанию) событие уходит через NOTIFY, и каждый воркер, слушающий канал через
+LISTEN, раздаёт его своим подписчикам; при local — только подписчикам своего процесса.
+
+У каждого подписчика ограниченная очередь. Если клиент не успевает читать, очередь
+сбрасывается и ему отправляется событие "resync": нужно перечитать список заказов.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import select as select_module
+import threading
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm.util import identity_key
+
+import models
+from database import engine, SessionLocal
+
+logger = logging.getLogger("uvicorn.error")
+
+EVENTS_BACKEND = os.getenv("ORDER_EVENTS_BACKEND", "postgres")
+EVENTS_CHANNEL = "order_events"
+EVENTS_QUEUE_SIZE = int(os.getenv("ORDER_EVENTS_QUEUE_SIZE", "256"))
+HEARTBEAT_INTERVAL = 15
+
+
+class Subscriber:
+    def __init__(self, loop, maxsize: int = EVENTS_QUEUE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def deliver(self, item):
+        # Вызывается в цикле событий подписчика
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "dropped": self.dropped})
+
+
+class OrderEventBroker:
+    def __init__(self, backend: str = EVENTS_BACKEND):
+        self.backend = backend
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.outbox = queue.Queue()
+        self.started = False
+
+    # --- подписчики ---
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def dispatch(self, items):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            for item in items:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, item)
+
+    # --- публикация ---
+
+    def publish(self, items):
+        if not items:
+            return
+        if self.backend == "postgres" and self.started:
+            self.outbox.put(items)
+        else:
+            self.dispatch(items)
+
+    def _publisher(self):
+        # Отправляем NOTIFY из отдельного потока, чтобы не задерживать ответы
+        connection = None
+        while True:
+            items = self.outbox.get()
+            # Забираем всё накопившееся и отправляем одной транзакцией
+            batch = list(items)
+            while not self.outbox.empty():
+                batch.extend(self.outbox.get_nowait())
+            try:
+                if connection is None:
+                    connection = engine.connect()
+                for item in batch:
+                    connection.execute(
+                        text("SELECT pg_notify(:channel, :payload)"),
+                        {"channel": EVENTS_CHANNEL, "payload": json.dumps(item)}
+                    )
+                connection.commit()
+            except Exception as e:
+                logger.error(f"Не удалось отправить события заказов: {e}")
+                if connection is not None:
+                    connection.invalidate()
+                    connection.close()
+                    connection = None
+                self.dispatch(batch)
+
+    def _listener(self):
+        while True:
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                connection = raw.driver_connection
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+                while True:
+                    if select_module.select([connection], [], [], HEARTBEAT_INTERVAL) == ([], [], []):
+                        continue
+                    connection.poll()
+                    items = []
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        items.append(json.loads(notify.payload))
+                    if items:
+                        self.dispatch(items)
+            except Exception as e:
+                logger.error(f"Соединение LISTEN {EVENTS_CHANNEL} потеряно: {e}")
+                # Пропущенные события восполнит перечитывание списка
+                self.dispatch([{"type": "resync"}])
+                threading.Event().wait(1)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.invalidate()
+                    except Exception:
+                        pass
+
+    def start(self):
+        if self.started or self.backend != "postgres":
+            return
+        self.started = True
+        threading.Thread(target=self._listener, name="order-events-listen", daemon=True).start()
+        threading.Thread(target=self._publisher, name="order-events-notify", daemon=True).start()
+
+
+broker = OrderEventBroker()
+
+
+# --- сбор событий из ORM-сессий ---
+
+def record(session, event_type: str, order_id: int, identifier: str = None):
+    """Добавляет событие вручную (для изменений мимо ORM, например bulk INSERT/UPDATE)."""
+    session.info.setdefault("order_events", {})[(event_type, order_id)] = {
+        "type": event_type, "order_id": order_id, "identifier": identifier
+    }
+
+
+def _order_identifier(session, order_id):
+    order = session.identity_map.get(identity_key(models.Order, order_id))
+    return order.identifier if order is not None else None
+
+
+def _collect(session, flush_context):
+    pending = session.info.get("order_events", {})
+    for obj in session.new:
+        if isinstance(obj, models.Order):
+            record(session, "order_created", obj.id, obj.identifier)
+        elif isinstance(obj, models.OrderItem):
+            record(session, "order_items_changed", obj.order_id, _order_identifier(session, obj.order_id))
+    for obj in session.deleted:
+        if isinstance(obj, models.Order):
+            record(session, "order_deleted", obj.id, obj.identifier)
+        elif isinstance(obj, models.OrderItem):
+            record(session, "order_items_changed", obj.order_id, _order_identifier(session, obj.order_id))
+    for obj in session.dirty:
+        if isinstance(obj, models.Order):
+            state = inspect(obj)
+            if state.attrs.status.history.has_changes():
+                record(session, "order_status_changed", obj.id, obj.identifier)
+            elif state.attrs.identifier.history.has_changes():
+                created = pending.get(("order_created", obj.id))
+                if created is not None:
+                    # Идентификатор назначен в той же транзакции, что и создание: отдельного события не нужно
+                    created["identifier"] = obj.identifier
+                else:
+                    record(session, "order_updated", obj.id, obj.identifier)
+        elif isinstance(obj, models.OrderItem) and session.is_modified(obj):
+            record(session, "order_items_changed", obj.order_id, _order_identifier(session, obj.order_id))
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _after_flush(session, flush_context):
+    _collect(session, flush_context)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session):
+    items = session.info.pop("order_events", {})
+    deleted = {order_id for (event_type, order_id) in items if event_type == "order_deleted"}
+    # Для удалённых заказов остальные события той же транзакции не нужны
+    broker.publish([
+        item for (event_type, order_id), item in items.items()
+        if event_type == "order_deleted" or order_id not in deleted
+    ])
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("order_events", None)
+
+
+def format_sse(item) -> str:
+    return f"event: {item['type']}\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
@@ -0,0 +1,230 @@
+"""Поддержка заголовка Idempotency-Key для запросов, создающих заказы.
+
+Ключ действует в пределах пользователя (sub из JWT), отпечаток запроса — метод, путь
+и тело, поэтому повтор после обновления токена распознаётся как тот же запрос. Тело
+нормализуется: JSON — канонический, формы — поля по имени (у файлов имя и хэш
+содержимого), так что повтор формы с новой границей multipart совпадает с первым.
+
+Первый запрос с ключом короткой транзакцией вставляет в idempotency_keys строку
+"в работе" (status_code IS NULL) и выполняется как обычно; соединение при этом не
+удерживается. Успешный ответ сохраняется в ту же строку на IDEMPOTENCY_TTL секунд,
+после ошибки строка удаляется, и клиент может повторить запрос. Повтор с тем же ключом
+и тем же телом получает сохранённый ответ, не доходя до обработчика и crud; с другим
+телом — 422. Одновременный дубликат ждёт завершения первого, опрашивая таблицу, не
+дольше IDEMPOTENCY_WAIT секунд, потом получает 409. Строка "в работе" старше
+IDEMPOTENCY_IN_FLIGHT_TIMEOUT (воркер упал) считается брошенной и перехватывается.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from jose import JWTError, jwt
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+import models
+from auth import ALGORITHM, SECRET_KEY
+from database import engine
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "30"))
+IDEMPOTENCY_IN_FLIGHT_TIMEOUT = int(os.getenv("IDEMPOTENCY_IN_FLIGHT_TIMEOUT", "300"))
+IDEMPOTENCY_POLL = 0.2
+IDEMPOTENT_PATHS = {"/orders", "/orders/by-form", "/orders/bulk"}
+PURGE_INTERVAL = 60
+
+
+def request_fingerprint(method: str, path: str, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+FORM_MEDIA_TYPES = {"multipart/form-data", "application/x-www-form-urlencoded"}
+
+
+async def normalized_body(request, body: bytes) -> bytes:
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type == "application/json":
+        try:
+            return json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+        except ValueError:
+            return body
+    if media_type not in FORM_MEDIA_TYPES:
+        return body
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    try:
+        form = await Request(request.scope, receive).form()
+    except Exception:
+        # Битую форму отклонит обработчик; для отпечатка хватит сырого тела
+        return body
+    try:
+        fields = []
+        for name, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                value = f"{value.filename}:{hashlib.sha256(await value.read()).hexdigest()}"
+            fields.append((name, value))
+    finally:
+        await form.close()
+    # Сортировка устойчивая: порядок повторяющихся полей сохраняется
+    fields.sort(key=lambda field: field[0])
+    return json.dumps(fields, ensure_ascii=False).encode()
+
+
+def request_owner(authorization: str) -> str:
+    """sub из проверенного JWT; без валидного токена — пустая строка (обработчик ответит 401)."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return ""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub") or ""
+    except JWTError:
+        return ""
+
+
+def scoped_key(owner: str, key: str) -> str:
+    # В таблице ключ хранится вместе с владельцем, в виде хэша фиксированной длины
+    return hashlib.sha256(owner.encode() + b"\0" + key.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, engine, ttl: int = IDEMPOTENCY_TTL, in_flight_timeout: int = IDEMPOTENCY_IN_FLIGHT_TIMEOUT):
+        self.engine = engine
+        self.ttl = ttl
+        self.in_flight_timeout = in_flight_timeout
+        self.purged_at = 0.0
+
+    def claim(self, key: str, fingerprint: str):
+        """Возвращает ("owner", claimed_at), ("done", record) или ("busy", None)."""
+        table = models.IdempotencyKey
+        now = datetime.utcnow()
+        with self.engine.begin() as connection:
+            inserted = connection.execute(
+                insert(table)
+                .values(key=key, fingerprint=fingerprint, status_code=None, created_at=now)
+                .on_conflict_do_nothing(index_elements=[table.key])
+                .returning(table.key)
+            ).first()
+            if inserted is not None:
+                return "owner", now
+            record = connection.execute(
+                select(table.fingerprint, table.status_code, table.content_type, table.body, table.created_at)
+                .where(table.key == key)
+                .with_for_update()
+            ).first()
+            if record is None:
+                # Строку только что удалили — попробуем ещё раз
+                return "busy", None
+            if record.status_code is None:
+                abandoned = record.created_at < now - timedelta(seconds=self.in_flight_timeout)
+            else:
+                abandoned = record.created_at < now - timedelta(seconds=self.ttl)
+            if abandoned:
+                connection.execute(
+                    update(table).where(table.key == key)
+                    .values(fingerprint=fingerprint, status_code=None, content_type=None, body=None, created_at=now)
+                )
+                return "owner", now
+            if record.status_code is None:
+                return "busy", None
+            return "done", record
+
+    def save(self, key: str, claimed_at, status_code: int, content_type: str, body: bytes):
+        table = models.IdempotencyKey
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(table)
+                .where(table.key == key, table.status_code.is_(None), table.created_at == claimed_at)
+                .values(status_code=status_code, content_type=content_type, body=body, created_at=datetime.utcnow())
+            )
+            now = time.monotonic()
+            if now - self.purged_at > PURGE_INTERVAL:
+                self.purged_at = now
+                utcnow = datetime.utcnow()
+                connection.execute(delete(table).where(or_(
+                    table.created_at < utcnow - timedelta(seconds=self.ttl),
+                    table.status_code.is_(None) & (table.created_at < utcnow - timedelta(seconds=self.in_flight_timeout)),
+                )))
+
+    def release(self, key: str, claimed_at):
+        # Запрос не удался: снимаем отметку "в работе", только если она всё ещё наша
+        table = models.IdempotencyKey
+        with self.engine.begin() as connection:
+            connection.execute(
+                delete(table).where(table.key == key, table.status_code.is_(None), table.created_at == claimed_at)
+            )
+
+
+class IdempotencyMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, store: IdempotencyStore = None, paths=IDEMPOTENT_PATHS, wait: float = IDEMPOTENCY_WAIT):
+        super().__init__(app)
+        self.store = store or IdempotencyStore(engine)
+        self.paths = paths
+        self.wait = wait
+
+    async def dispatch(self, request, call_next):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if request.method != "POST" or not key or request.url.path not in self.paths:
+            return await call_next(request)
+        if len(key) > 255:
+            return JSONResponse(status_code=400, content={"detail": "Idempotency-Key is too long"})
+
+        body = await request.body()
+        fingerprint = request_fingerprint(request.method, request.url.path, await normalized_body(request, body))
+        key = scoped_key(request_owner(request.headers.get("authorization")), key)
+
+        deadline = time.monotonic() + self.wait
+        while True:
+            state, value = await run_in_threadpool(self.store.claim, key, fingerprint)
+            if state != "busy":
+                break
+            if time.monotonic() >= deadline:
+                return JSONResponse(status_code=409, content={"detail": "A request with this Idempotency-Key is still in progress"})
+            # Ждём без соединения из пула
+            await asyncio.sleep(IDEMPOTENCY_POLL)
+
+        if state == "done":
+            if value.fingerprint != fingerprint:
+                return JSONResponse(status_code=422, content={"detail": "Idempotency-Key was already used with a different request"})
+            return Response(
+                content=value.body,
+                status_code=value.status_code,
+                media_type=value.content_type,
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+        claimed_at = value
+        saved = False
+        try:
+            response = await call_next(request)
+            chunks = [chunk async for chunk in response.body_iterator]
+            content = b"".join(chunks)
+            # Сохраняем только успешные ответы: после ошибки клиент может повторить запрос
+            if response.status_code < 400:
+                await run_in_threadpool(
+                    self.store.save, key, claimed_at,
+                    response.status_code, response.headers.get("content-type"), content
+                )
+                saved = True
+            return Response(
+                content=content,
+                status_code=response.status_code,
+                headers=dict(response.headers),
+            )
+        finally:
+            if not saved:
+                await run_in_threadpool(self.store.release, key, claimed_at)
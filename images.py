@@ -0,0 +1,74 @@
+"""Изображения товаров.
+
+Загрузка сразу приводит основное изображение к 300x300 (оно отдаётся и тогда, когда
+воркер очереди не запущен) и сохраняет исходник в uploads/originals/. Варианты других
+размеров строит задача очереди image_variants (см. tasks.py), которую ставят после
+сохранения товара:
+
+    uploads/photo.jpg                  основное изображение 300x300
+    uploads/variants/photo_thumb.jpg   варианты из VARIANTS
+    uploads/originals/photo.jpg        исходник, из него перестраиваются все размеры
+"""
+import os
+from pathlib import Path
+
+from PIL import Image
+
+import jobs
+
+UPLOAD_DIR = Path("uploads")
+ORIGINALS_DIR = UPLOAD_DIR / "originals"
+VARIANTS_DIR = UPLOAD_DIR / "variants"
+MAIN_SIZE = (300, 300)
+VARIANTS = {"thumb": (100, 100), "large": (600, 600)}
+PROCESS_JOB = "image_variants"
+
+
+def resize_image(source: Path, target: Path, size: tuple = MAIN_SIZE):
+    # Вписываем в size на белом фоне; пишем во временный файл и подменяем целиком
+    with Image.open(source) as img:
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        new_img = Image.new("RGB", size, (255, 255, 255))
+        offset = ((size[0] - img.size[0]) // 2, (size[1] - img.size[1]) // 2)
+        new_img.paste(img, offset)
+        temp_path = target.with_name(f".{target.stem}.tmp{target.suffix}")
+        new_img.save(temp_path)
+    os.replace(temp_path, target)
+
+
+def variant_path(file_path: Path, name: str) -> Path:
+    return VARIANTS_DIR / f"{file_path.stem}_{name}{file_path.suffix}"
+
+
+def save_upload(file_path: Path, content: bytes):
+    """Сохраняет исходник и основное изображение 300x300. Блокирующая, из async-обработчиков — через пул потоков."""
+    ORIGINALS_DIR.mkdir(parents=True, exist_ok=True)
+    original = ORIGINALS_DIR / file_path.name
+    original.write_bytes(content)
+    resize_image(original, file_path, MAIN_SIZE)
+
+
+def queue_variants(file_path: Path):
+    """Ставит построение вариантов в очередь; вызывать после сохранения товара."""
+    jobs.enqueue(
+        PROCESS_JOB, {"filename": file_path.name},
+        dedupe_key=f"image:{file_path.name}", priority=jobs.PRIORITY_HIGH
+    )
+
+
+def process_image(filename: str):
+    original = ORIGINALS_DIR / filename
+    if not original.exists():
+        # Изображение уже заменили или удалили
+        return
+    target = UPLOAD_DIR / filename
+    VARIANTS_DIR.mkdir(parents=True, exist_ok=True)
+    for name, size in VARIANTS.items():
+        resize_image(original, variant_path(target, name), size)
+
+
+def delete_image(file_path: Path):
+    """Удаляет изображение вместе с исходником и вариантами."""
+    for path in [file_path, ORIGINALS_DIR / file_path.name] + [variant_path(file_path, name) for name in VARIANTS]:
+        if path.exists() and path.is_file():
+            path.unlink()
@@ -0,0 +1,265 @@
+"""Очередь фоновых задач в PostgreSQL.
+
+Задача — строка в таблице jobs: вид (kind), payload, приоритет и время запуска.
+Воркеры забирают готовые задачи через FOR UPDATE SKIP LOCKED, поэтому одну
+задачу выполняет ровно один поток, в каком бы процессе он ни работал. Задача,
+упавшая с ошибкой, повторяется с экспоненциальной задержкой до max_attempts раз,
+потом остаётся со статусом failed. Задачи, чей воркер умер, возвращаются в
+очередь через JOB_LEASE_SECONDS. Выполненные задачи удаляются.
+
+dedupe_key склеивает повторные постановки: пока задача с ключом ждёт, новая не
+создаётся. С max_delay повторная постановка отодвигает запуск (debounce), но не
+дальше max_delay от первой.
+
+Обработчики регистрируются декоратором @jobs.handler("kind") (см. tasks.py).
+Воркер запускается в каждом процессе приложения (JOB_WORKERS потоков) или
+отдельно:
+
+    python manage.py jobs-work --threads 4
+    python manage.py jobs
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+
+import models
+from database import engine
+
+logger = logging.getLogger("uvicorn.error")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_SECONDS = float(os.getenv("JOB_BACKOFF_SECONDS", "5"))
+JOB_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "600"))
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+HANDLERS = {}
+
+
+def handler(kind: str):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+# --- постановка ---
+
+def enqueue_many(
+    kind: str, items, priority: int = PRIORITY_NORMAL, delay: float = 0, max_delay: float = None,
+    max_attempts: int = JOB_MAX_ATTEMPTS, connection=None
+):
+    """Ставит задачи; items — пары (payload, dedupe_key). connection — чтобы задача
+    попала в очередь в той же транзакции, что и изменение данных."""
+    rows = {}
+    for payload, dedupe_key in items:
+        # В одном INSERT ... ON CONFLICT ключи не должны повторяться
+        rows[dedupe_key if dedupe_key is not None else object()] = {
+            "kind": kind, "payload": payload or {}, "dedupe_key": dedupe_key, "priority": priority,
+            "max_attempts": max_attempts, "status": "queued",
+            "run_at": func.now() + timedelta(seconds=delay),
+        }
+    if not rows:
+        return
+    statement = pg_insert(models.Job).values(list(rows.values()))
+    job = models.Job.__table__.c
+    if max_delay is None:
+        # Повторная постановка может только ускорить задачу
+        run_at = func.least(job.run_at, statement.excluded.run_at)
+    else:
+        run_at = func.least(
+            func.greatest(job.run_at, statement.excluded.run_at),
+            job.created_at + timedelta(seconds=max_delay)
+        )
+    statement = statement.on_conflict_do_update(
+        index_elements=[job.dedupe_key],
+        index_where=job.status == "queued",
+        set_={"run_at": run_at, "priority": func.greatest(job.priority, statement.excluded.priority),
+              "payload": statement.excluded.payload}
+    )
+    if connection is not None:
+        connection.execute(statement)
+    else:
+        with engine.begin() as own_connection:
+            own_connection.execute(statement)
+
+
+def enqueue(kind: str, payload: dict = None, dedupe_key: str = None, **options):
+    enqueue_many(kind, [(payload, dedupe_key)], **options)
+
+
+# --- выполнение ---
+
+CLAIM = text("""
+UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_at = now(), locked_by = :worker
+WHERE id = (
+    SELECT id FROM jobs
+    WHERE status = 'queued' AND run_at <= now()
+    ORDER BY priority DESC, run_at, id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, kind, payload, dedupe_key, attempts, max_attempts
+""")
+
+
+def _claim(worker: str):
+    with engine.begin() as connection:
+        return connection.execute(CLAIM, {"worker": worker}).first()
+
+
+def _complete(job_id: int):
+    with engine.begin() as connection:
+        connection.execute(delete(models.Job).where(models.Job.id == job_id))
+
+
+def backoff(attempts: int) -> float:
+    delay = min(JOB_BACKOFF_SECONDS * 2 ** (attempts - 1), JOB_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.75, 1.25)
+
+
+def _fail(job_id: int, attempts: int, max_attempts: int, error: str):
+    job = models.Job
+    if attempts >= max_attempts:
+        values = {"status": "failed", "locked_at": None, "locked_by": None, "last_error": error}
+    else:
+        values = {
+            "status": "queued", "locked_at": None, "locked_by": None, "last_error": error,
+            "run_at": func.now() + timedelta(seconds=backoff(attempts)),
+        }
+    try:
+        with engine.begin() as connection:
+            connection.execute(update(job).where(job.id == job_id).where(job.status == "running").values(**values))
+    except IntegrityError:
+        # С тем же dedupe_key уже ждёт новая задача — она и сделает работу
+        with engine.begin() as connection:
+            connection.execute(delete(job).where(job.id == job_id))
+
+
+def requeue_expired() -> int:
+    """Возвращает в очередь задачи, чей воркер не отчитался за JOB_LEASE_SECONDS."""
+    with engine.connect() as connection:
+        expired = connection.execute(
+            select(models.Job.id, models.Job.attempts, models.Job.max_attempts)
+            .where(models.Job.status == "running")
+            .where(models.Job.locked_at < func.now() - timedelta(seconds=JOB_LEASE_SECONDS))
+        ).all()
+    for job_id, attempts, max_attempts in expired:
+        _fail(job_id, attempts, max_attempts, "lease expired")
+    return len(expired)
+
+
+def run_job(job) -> bool:
+    job_handler = HANDLERS.get(job.kind)
+    try:
+        if job_handler is None:
+            raise RuntimeError(f"Нет обработчика для задач {job.kind}")
+        job_handler(job.payload)
+    except Exception as e:
+        logger.error(f"Задача {job.id} ({job.kind}) завершилась ошибкой, попытка {job.attempts}: {e}")
+        _fail(job.id, job.attempts, job.max_attempts, f"{type(e).__name__}: {e}")
+        return False
+    _complete(job.id)
+    return True
+
+
+class JobWorker:
+    def __init__(self, threads: int = JOB_WORKERS, name: str = None):
+        self.threads = threads
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+        self.workers = []
+
+    def _loop(self, index: int):
+        worker = f"{self.name}/{index}"
+        while not self.stopping.is_set():
+            try:
+                job = _claim(worker)
+                if job is None and index == 0:
+                    # Пока очередь пуста, первый поток подбирает задачи умерших воркеров
+                    requeue_expired()
+            except Exception as e:
+                logger.error(f"Очередь задач недоступна: {e}")
+                job = None
+            if job is None:
+                self.stopping.wait(JOB_POLL_SECONDS)
+                continue
+            run_job(job)
+
+    def start(self):
+        if self.workers or self.threads <= 0:
+            return
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._loop, args=(index,), name=f"jobs-{index}", daemon=True)
+            thread.start()
+            self.workers.append(thread)
+
+    def stop(self, timeout: float = JOB_DRAIN_SECONDS):
+        """Новые задачи не берём, текущие даём доделать не дольше timeout секунд."""
+        self.stopping.set()
+        # Общий срок на все потоки, а не timeout на каждый: остановка должна уложиться
+        # в срок, после которого launcher.py убивает процесс
+        deadline = time.monotonic() + timeout
+        for thread in self.workers:
+            thread.join(timeout=max(deadline - time.monotonic(), 0))
+        unfinished = [thread.name for thread in self.workers if thread.is_alive()]
+        if unfinished:
+            # Незавершённые задачи вернутся в очередь по истечении JOB_LEASE_SECONDS
+            logger.warning(f"Задачи в потоках {', '.join(unfinished)} не завершились до остановки")
+        self.workers = []
+
+    def run_forever(self):
+        self.start()
+        try:
+            while any(thread.is_alive() for thread in self.workers):
+                self.workers[0].join(timeout=1)
+        finally:
+            self.stop()
+
+
+# --- просмотр ---
+
+def stats():
+    """Глубина очереди по видам и статусам: число задач, готовых к запуску, и возраст старейшей."""
+    with engine.connect() as connection:
+        rows = connection.execute(text("""
+            SELECT kind, status, COUNT(*) AS total,
+                   COUNT(*) FILTER (WHERE status = 'queued' AND run_at <= now()) AS ready,
+                   EXTRACT(EPOCH FROM now() - MIN(created_at)) AS oldest_seconds
+            FROM jobs GROUP BY kind, status ORDER BY kind, status
+        """)).all()
+    return [
+        {"kind": row.kind, "status": row.status, "total": row.total, "ready": row.ready,
+         "oldest_seconds": round(float(row.oldest_seconds or 0), 1)}
+        for row in rows
+    ]
+
+
+RETRY_FAILED = text("""
+UPDATE jobs j SET status = 'queued', attempts = 0, run_at = now(), last_error = NULL
+WHERE j.status = 'failed' AND (CAST(:kind AS varchar) IS NULL OR j.kind = :kind)
+  AND (j.dedupe_key IS NULL OR (
+      -- по ключу возвращаем только последнюю упавшую задачу и только если новая не ждёт
+      NOT EXISTS (SELECT 1 FROM jobs q WHERE q.dedupe_key = j.dedupe_key AND q.status = 'queued')
+      AND j.id = (SELECT MAX(f.id) FROM jobs f WHERE f.dedupe_key = j.dedupe_key AND f.status = 'failed')
+  ))
+""")
+
+
+def retry_failed(kind: str = None) -> int:
+    with engine.begin() as connection:
+        return connection.execute(RETRY_FAILED, {"kind": kind}).rowcount
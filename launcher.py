@@ -0,0 +1,181 @@
+"""Запуск приложения в продакшене: несколько воркеров uvicorn на одном сокете.
+
+    python launcher.py --host 0.0.0.0 --port 8000 --workers 4
+
+SIGHUP  — поочерёдный перезапуск воркеров без простоя: новый воркер
+          поднимается и только после готовности старый получает SIGTERM
+          и дорабатывает начатые запросы.
+SIGTERM / SIGINT — плавная остановка всех воркеров.
+
+Схема базы обновляется один раз — python manage.py migrate в отдельном процессе
+(чтобы после деплоя применились новые миграции) перед запуском воркеров и перед
+каждым поочерёдным перезапуском. Сами воркеры миграции не выполняют.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import uvicorn
+
+logger = logging.getLogger("launcher")
+
+APP = "main:app"
+
+# Сколько ждём, пока новый воркер поднимется, и сколько даём старому на завершение запросов
+STARTUP_TIMEOUT = float(os.getenv("WORKER_STARTUP_TIMEOUT", "30"))
+GRACEFUL_TIMEOUT = int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+# После запросов воркер доделывает фоновые задачи (jobs.JOB_DRAIN_SECONDS). Значение
+# передаётся воркерам через окружение, и мастер ждёт обе фазы, прежде чем убить процесс:
+# иначе задачи обрывались бы SIGKILL и ждали истечения аренды
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "30"))
+STOP_TIMEOUT = GRACEFUL_TIMEOUT + JOB_DRAIN_SECONDS + 5
+
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+
+class _NotifyingServer(uvicorn.Server):
+    """Сервер, сообщающий мастеру, что он принял startup и готов обслуживать запросы."""
+
+    def __init__(self, config, ready_event):
+        super().__init__(config)
+        self.ready_event = ready_event
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            self.ready_event.set()
+
+
+def _run_worker(config: uvicorn.Config, sock, ready_event):
+    config.configure_logging()
+    server = _NotifyingServer(config, ready_event)
+    server.run(sockets=[sock])
+
+
+class Launcher:
+    def __init__(self, host: str, port: int, workers: int, log_level: str = "info"):
+        self.config = uvicorn.Config(
+            APP,
+            host=host,
+            port=port,
+            log_level=log_level,
+            timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        )
+        self.workers_count = workers
+        self.ctx = multiprocessing.get_context("spawn")
+        self.workers = []
+        self.should_exit = False
+        self.should_reload = False
+        self.sock = None
+
+    def _spawn(self):
+        ready = self.ctx.Event()
+        process = self.ctx.Process(target=_run_worker, args=(self.config, self.sock, ready))
+        process.start()
+        logger.info("Воркер %s запущен", process.pid)
+        return process, ready
+
+    def _stop(self, process):
+        if not process.is_alive():
+            process.join()
+            return
+        process.terminate()  # uvicorn дорабатывает начатые запросы по SIGTERM
+        process.join(STOP_TIMEOUT)
+        if process.is_alive():
+            logger.warning("Воркер %s не завершился вовремя, убиваем", process.pid)
+            process.kill()
+            process.join()
+        logger.info("Воркер %s остановлен", process.pid)
+
+    def _migrate(self) -> bool:
+        result = subprocess.run([sys.executable, "manage.py", "migrate"])
+        if result.returncode != 0:
+            logger.error("Миграции завершились с кодом %s", result.returncode)
+            return False
+        return True
+
+    def _rolling_restart(self):
+        if not self._migrate():
+            # Новый код без своей схемы не запускаем, старые воркеры продолжают работать
+            logger.error("Перезапуск отменён")
+            return
+        logger.info("Поочерёдный перезапуск %s воркеров", len(self.workers))
+        for index, old in enumerate(list(self.workers)):
+            if self.should_exit:
+                return
+            new, ready = self._spawn()
+            if not ready.wait(STARTUP_TIMEOUT):
+                # Новый воркер не поднялся — оставляем старый, чтобы не уронить сервис
+                logger.error("Воркер %s не стал готов за %s с, перезапуск прерван", new.pid, STARTUP_TIMEOUT)
+                self._stop(new)
+                return
+            self.workers[index] = new
+            self._stop(old)
+
+    def _replace_dead(self):
+        for index, process in enumerate(self.workers):
+            if not process.is_alive() and not self.should_exit:
+                logger.warning("Воркер %s завершился с кодом %s, запускаем новый", process.pid, process.exitcode)
+                process.join()
+                self.workers[index], _ = self._spawn()
+
+    def _on_exit(self, signum, frame):
+        self.should_exit = True
+
+    def _on_reload(self, signum, frame):
+        self.should_reload = True
+
+    def run(self):
+        if not self._migrate():
+            raise SystemExit(1)
+        self.sock = self.config.bind_socket()
+        signal.signal(signal.SIGTERM, self._on_exit)
+        signal.signal(signal.SIGINT, self._on_exit)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        logger.info("Мастер %s, воркеров: %s", os.getpid(), self.workers_count)
+        # Воркеры наследуют окружение: по нему cache.py выбирает общий для процессов бэкенд версий
+        os.environ["WEB_WORKERS"] = str(self.workers_count)
+        os.environ["SKIP_MIGRATIONS"] = "1"
+        os.environ["JOB_DRAIN_SECONDS"] = str(JOB_DRAIN_SECONDS)
+        for _ in range(self.workers_count):
+            process, _ = self._spawn()
+            self.workers.append(process)
+
+        while not self.should_exit:
+            if self.should_reload:
+                self.should_reload = False
+                self._rolling_restart()
+            self._replace_dead()
+            time.sleep(0.5)
+
+        logger.info("Останавливаем воркеры")
+        for process in self.workers:
+            if process.is_alive():
+                process.terminate()
+        for process in self.workers:
+            self._stop(process)
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск API с несколькими воркерами")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s")
+    Launcher(args.host, args.port, args.workers, args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
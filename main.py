@@ -1,12 +1,12 @@
 import os
 from pathlib import Path
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Body
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Body, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from typing import List, Optional
+from typing import List, Optional, Union
 import logging
 from fastapi.openapi.utils import get_openapi
 from sqlalchemy.orm import Session, joinedload
-from database import engine, SessionLocal, get_db
+from database import engine, read_engine, SessionLocal, get_db, get_read_db, DATABASE_URL, DATABASE_READ_URL
 from schemas import UserCreate, UserResponse, Token, LoginData, OrderItemCreate, OrderItemCreateByName
 from crud import (
     create_user, get_order_by_identifier, get_product_by_id, get_client_by_id,
@@ -16,15 +16,34 @@ from crud import (
     update_item_quantity_by_name, create_order_by_form, get_orders, wrap_text, generate_receipt  # Добавляем get_orders
 )
 import models
-from auth import create_access_token, verify_password, get_current_user
+from auth import create_access_token, verify_password, get_current_user, get_current_user_for_stream, get_user_by_token
 import schemas
 from datetime import date, datetime
 from fastapi.security import OAuth2PasswordRequestForm
-from PIL import Image
 import crud
 import json
-
-from fastapi.responses import FileResponse
+import migrations
+import reports
+import archive
+import receipt_render
+import receipt_store
+import receipt_scheduler
+import jobs
+import images
+import tasks  # noqa: F401 — регистрирует обработчики задач
+import events
+import responses
+import dto
+import cache
+from idempotency import IdempotencyMiddleware
+from admission import AdmissionMiddleware
+from catalog import product_catalog
+import admission
+
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+from sqlalchemy import text
 from fastapi.middleware.cors import CORSMiddleware
 
 logging.basicConfig(level=logging.DEBUG)
@@ -35,12 +54,19 @@ logger.setLevel(logging.DEBUG)
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# Папка для хранения чеков
-RECEIPTS_DIR = Path("receipts")
+# Папка для хранения чеков (раскладку по подкаталогам ведёт receipt_store)
+RECEIPTS_DIR = receipt_store.RECEIPTS_DIR
 RECEIPTS_DIR.mkdir(exist_ok=True)
 
 app = FastAPI()
 
+# Повторы POST /orders* с тем же Idempotency-Key получают сохранённый ответ
+app.add_middleware(IdempotencyMiddleware)
+
+# Лимиты одновременных запросов по классам маршрутов; добавлен последним — срабатывает первым
+app.add_middleware(AdmissionMiddleware)
+
+# CORS добавляется после остальных, чтобы оборачивать и их собственные ответы
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:8000", "http://127.0.0.1:5500"],
@@ -52,21 +78,106 @@ app.add_middleware(
 # Подключаем папку uploads как статическую
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
-models.Base.metadata.create_all(bind=engine)
+# Схему обновляет launcher.py (manage.py migrate) один раз перед запуском воркеров;
+# при одиночном запуске uvicorn main:app — сам процесс
+if os.getenv("SKIP_MIGRATIONS") != "1":
+    models.Base.metadata.create_all(bind=engine)
+    migrations.apply(engine)
+
+response_cache = cache.response_cache
+# Версия кэша читается с основной базы; реплика может отставать, и тело, построенное по ней
+# сразу после записи, легло бы в кэш под новой версией. Поэтому при отдельной реплике
+# промахи кэша строятся на основной базе
+CACHE_BUILD_ON_PRIMARY = DATABASE_READ_URL != DATABASE_URL
+
+def cached_response(request: Request, namespace: str, db: Session, build):
+    # Ключ — путь и отсортированные параметры; build(session) строит Response только при промахе
+    key = request.url.path + "?" + "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    version = response_cache.version(namespace)
+    entry = response_cache.get(namespace, version, key)
+    if entry is None:
+        if CACHE_BUILD_ON_PRIMARY:
+            with SessionLocal() as primary:
+                body = build(primary).body
+        else:
+            body = build(db).body
+        entry = response_cache.set(namespace, version, key, body)
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.on_event("startup")
+def start_order_events():
+    # LISTEN/NOTIFY-потоки для раздачи событий заказов между воркерами
+    events.broker.start()
+
+# Фоновые задачи (чеки, изображения); обработчики зарегистрированы в tasks.py
+job_worker = jobs.JobWorker()
+
+@app.on_event("startup")
+def start_job_worker():
+    job_worker.start()
+
+@app.on_event("shutdown")
+def stop_job_worker():
+    # Новые задачи не берём, текущие доделываем не дольше JOB_DRAIN_SECONDS
+    job_worker.stop()
+
+def parse_fields_or_400(fields: Optional[str], allowed):
+    try:
+        return dto.parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+BATCH_MAX_KEYS = 200
 
-# Функция для изменения размера изображения
-def resize_image(file_path: Path, size: tuple = (300, 300)):
-    with Image.open(file_path) as img:
-        img.thumbnail(size, Image.Resampling.LANCZOS)
-        new_img = Image.new("RGB", size, (255, 255, 255))
-        offset = ((size[0] - img.size[0]) // 2, (size[1] - img.size[1]) // 2)
-        new_img.paste(img, offset)
-        new_img.save(file_path)
+def parse_batch_keys_or_400(value: str, name: str, convert=str):
+    # ?ids=3,1,7 — порядок и повторы сохраняются, ответ строится в том же порядке
+    try:
+        keys = [convert(key.strip()) for key in value.split(",") if key.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid value in {name}")
+    if not keys:
+        raise HTTPException(status_code=400, detail=f"Parameter {name} is empty")
+    if len(keys) > BATCH_MAX_KEYS:
+        raise HTTPException(status_code=400, detail=f"Too many values in {name}, maximum is {BATCH_MAX_KEYS}")
+    return keys
 
 @app.get("/")
 def root():
     return {"message": "API работает!"}
 
+@app.get("/healthz")
+def healthz():
+    # Процесс жив и обрабатывает запросы; внешние зависимости не проверяем
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    checks = {}
+    for name, db_engine in (("database", engine), ("read_database", read_engine)):
+        try:
+            with db_engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            checks[name] = "ok"
+        except Exception as e:
+            checks[name] = f"error: {e}"
+
+    if os.access(RECEIPTS_DIR, os.W_OK):
+        checks["receipts_dir"] = "ok"
+    else:
+        checks["receipts_dir"] = "error: not writable"
+
+    ready = all(value == "ok" for value in checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"status": "ok" if ready else "unavailable", "checks": checks})
+
+@app.get("/metrics/admission")
+def admission_metrics():
+    # Занятость и глубина очередей по классам маршрутов в этом процессе
+    return {"pid": os.getpid(), "classes": admission.stats()}
+
 @app.post("/register", response_model=UserResponse)
 def register_user(
     user: UserCreate,
@@ -128,6 +239,12 @@ def delete_all_users(db: Session = Depends(get_db), current_user: models.User =
         raise HTTPException(status_code=500, detail="Failed to delete all users")
     return {"message": "All users deleted, ID sequence reset"}
 
+def mark_receipts_dirty(identifiers: List[str]):
+    try:
+        receipt_scheduler.mark_dirty(identifiers)
+    except Exception as e:
+        print(f"Не удалось поставить в очередь чеки для заказов {', '.join(identifiers)}: {str(e)}")
+
 @app.post("/orders", response_model=schemas.OrderResponse)
 def create_order(
     order: schemas.OrderCreate = Body(...),
@@ -136,18 +253,34 @@ def create_order(
 ):
     created_order = crud.create_order(db, order)
     
-    # Генерируем и сохраняем чек
-    identifier = created_order.identifier
-    generate_receipt(identifier, db)
+    # Чек сгенерирует планировщик или первый запрос чека
+    mark_receipts_dirty([created_order.identifier])
     
     return created_order
 
+@app.post("/orders/bulk", response_model=schemas.BulkOrderResponse)
+def create_orders_bulk(
+    orders: List[schemas.OrderCreate] = Body(...),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    results = crud.create_orders_bulk(db, orders)
+    identifiers = [result.identifier for result in results if result.success]
+    if identifiers:
+        mark_receipts_dirty(identifiers)
+    return schemas.BulkOrderResponse(
+        created=len(identifiers),
+        failed=len(results) - len(identifiers),
+        results=results
+    )
+
 @app.post("/orders/by-form", response_model=schemas.OrderResponse)
 async def create_order_by_form(
     client_first_name: str = Form(...),
     client_last_name: str = Form(...),
     status: schemas.OrderStatusEnum = Form(...),
     items: str = Form(...),  # Принимаем как строку
+    client_id: Optional[int] = Form(None),  # Обязателен, если имя и фамилия есть у нескольких клиентов
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -161,7 +294,7 @@ async def create_order_by_form(
         error_message = "Invalid items format: " + str(e) + ". Expected a JSON list of objects, e.g., [{\"product_name\": \"Product\", \"quantity\": 1}]"
         raise HTTPException(status_code=400, detail=error_message)
     
-    return crud.create_order_by_form(db, client_first_name, client_last_name, status, items_objects)
+    return crud.create_order_by_form(db, client_first_name, client_last_name, status, items_objects, client_id=client_id)
 
 @app.post("/products", response_model=schemas.ProductResponse)
 async def create_product(
@@ -173,12 +306,12 @@ async def create_product(
     current_user: models.User = Depends(get_current_user)
 ):
     file_path = UPLOAD_DIR / image.filename
-    with file_path.open("wb") as f:
-        content = await image.read()
-        f.write(content)
-    resize_image(file_path, size=(300, 300))
+    content = await image.read()
+    # 300x300 готово сразу, варианты размеров строятся в очереди задач после сохранения товара
+    await run_in_threadpool(images.save_upload, file_path, content)
     
     db_product = crud.create_product(db, name=name, image_path=str(file_path), price=price, stock=stock)
+    await run_in_threadpool(images.queue_variants, file_path)
     return db_product
 
 @app.put("/products/by-name", response_model=schemas.ProductResponse)
@@ -254,23 +387,21 @@ async def update_product_image_by_name(
     
     # Сохраняем новое изображение
     file_path = UPLOAD_DIR / image.filename
-    with file_path.open("wb") as f:
-        content = await image.read()
-        f.write(content)
-    resize_image(file_path, size=(300, 300))
+    content = await image.read()
+    # 300x300 готово сразу, варианты размеров строятся в очереди задач после сохранения товара
+    await run_in_threadpool(images.save_upload, file_path, content)
     new_image_path = str(file_path)
     
     # Обновляем путь к изображению в базе данных
     db_product.image = new_image_path
     db.commit()
     db.refresh(db_product)
+    await run_in_threadpool(images.queue_variants, file_path)
     
-    # Удаляем старое изображение с сервера, если оно существует
-    if old_image_path:
+    # Удаляем старое изображение с сервера, если оно существует (и не совпадает с новым)
+    if old_image_path and old_image_path != new_image_path:
         try:
-            old_file_path = Path(old_image_path)
-            if old_file_path.exists() and old_file_path.is_file():
-                old_file_path.unlink()  # Удаляем старый файл
+            images.delete_image(Path(old_image_path))  # Удаляем старый файл, исходник и варианты
         except Exception as e:
             # Логируем ошибку, но не прерываем выполнение
             print(f"Failed to delete old image {old_image_path}: {str(e)}")
@@ -290,10 +421,9 @@ async def update_product(
     image_path = None
     if image is not None:
         file_path = UPLOAD_DIR / image.filename
-        with file_path.open("wb") as f:
-            content = await image.read()
-            f.write(content)
-        resize_image(file_path, size=(300, 300))
+        content = await image.read()
+        # 300x300 готово сразу, варианты размеров строятся в очереди задач после сохранения товара
+        await run_in_threadpool(images.save_upload, file_path, content)
         image_path = str(file_path)
     
     db_product = crud.update_product(
@@ -306,6 +436,8 @@ async def update_product(
     )
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
+    if image_path is not None:
+        await run_in_threadpool(images.queue_variants, file_path)
     return db_product
 
 @app.delete("/products/{product_id}", response_model=schemas.ProductResponse)
@@ -315,9 +447,20 @@ def delete_product(product_id: int, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=404, detail="Product not found")
     return db_product
 
-@app.get("/products", response_model=List[schemas.ProductResponse])
-def get_products(skip: int = 0, limit: int = 10, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return crud.get_products(db, skip, limit)
+@app.get("/products", response_model=Union[List[schemas.ProductResponse], List[schemas.ProductBatchItem]])
+def get_products(request: Request, skip: int = 0, limit: int = 10, fields: Optional[str] = None, ids: Optional[str] = None, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    selected = parse_fields_or_400(fields, dto.PRODUCT_FIELDS)
+    if ids is not None:
+        # Пачка товаров одним запросом вместо GET /products/{id} на каждую строку
+        keys = parse_batch_keys_or_400(ids, "ids", int)
+
+        def build(session):
+            rows = crud.get_products_by_ids(session, keys, selected)
+            found = {product_id: dict(zip(selected, row)) for product_id, row in rows.items()}
+            return responses.batch_response("id", keys, found)
+
+        return cached_response(request, "products", db, build)
+    return cached_response(request, "products", db, lambda session: responses.rows_response(selected, crud.get_products(session, skip, limit, selected)))
 
 @app.post("/clients", response_model=schemas.ClientResponse)
 async def create_client(
@@ -418,17 +561,66 @@ def delete_client(client_id: int, db: Session = Depends(get_db), current_user: m
         raise HTTPException(status_code=404, detail="Client not found")
     return db_client
 
-@app.get("/clients", response_model=List[schemas.ClientResponse])
-def get_clients(skip: int = 0, limit: int = 10, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return crud.get_clients(db, skip, limit)
+@app.get("/clients", response_model=Union[List[schemas.ClientResponse], List[schemas.ClientBatchItem]])
+def get_clients(request: Request, skip: int = 0, limit: int = 10, fields: Optional[str] = None, ids: Optional[str] = None, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    selected = parse_fields_or_400(fields, dto.CLIENT_FIELDS)
+    if ids is not None:
+        keys = parse_batch_keys_or_400(ids, "ids", int)
+
+        def build(session):
+            rows = crud.get_clients_by_ids(session, keys, selected)
+            found = {client_id: dict(zip(selected, row)) for client_id, row in rows.items()}
+            return responses.batch_response("id", keys, found)
+
+        return cached_response(request, "clients", db, build)
+    return cached_response(request, "clients", db, lambda session: responses.rows_response(selected, crud.get_clients(session, skip, limit, selected)))
+
+@app.get("/orders", response_model=Union[List[schemas.OrderResponse], List[schemas.OrderBatchItem]])
+def get_orders(
+    skip: int = 0,
+    limit: int = 10,
+    fields: Optional[str] = None,
+    sort: Optional[str] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    min_items: Optional[int] = None,
+    max_items: Optional[int] = None,
+    status: Optional[schemas.OrderStatusEnum] = None,
+    client_id: Optional[int] = None,
+    identifiers: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # ?fields=id,identifier,status — без вложенных client/items заказы читаются одним узким запросом
+    selected = parse_fields_or_400(fields, dto.ORDER_FIELDS)
+    if identifiers is not None:
+        # Пачка заказов: один запрос на заказы (с клиентами), один на позиции, один в архив за недостающими
+        keys = parse_batch_keys_or_400(identifiers, "identifiers")
+        found = {
+            identifier: order.as_dict(selected)
+            for identifier, order in crud.get_orders_by_identifiers(db, keys, selected).items()
+        }
+        missing = [identifier for identifier in keys if identifier not in found]
+        for identifier, order in archive.get_archived_orders(db, missing).items():
+            found[identifier] = {field: order[field] for field in selected}
+        return responses.batch_response("identifier", keys, found)
+    if sort and sort.lstrip("-") not in crud.ORDER_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort field. Allowed: {', '.join(crud.ORDER_SORT_FIELDS)}")
+    orders = crud.get_orders(
+        db, skip, limit, selected, sort=sort,
+        min_total=min_total, max_total=max_total, min_items=min_items, max_items=max_items,
+        status=status, client_id=client_id
+    )
+    return responses.orders_response(selected, orders)
 
-@app.get("/orders", response_model=List[schemas.OrderResponse])
-def get_orders(skip: int = 0, limit: int = 10, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return crud.get_orders(db, skip, limit)
+@app.get("/orders/counts")
+def get_order_counts(db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    return crud.get_order_status_counts(db)
 
-@app.get("/orders/{order_id}", response_model=schemas.OrderResponse)
-def get_order(order_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    db_order = crud.get_order(db, order_id)
+# Живой заказ или архивный; у архивного client может быть null
+@app.get("/orders/{order_id}", response_model=schemas.ArchivedOrderResponse)
+def get_order(order_id: int, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    db_order = crud.get_order(db, order_id) or archive.get_archived_order_by_id(db, order_id)
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found")
     return db_order
@@ -450,46 +642,58 @@ async def add_item_to_order(
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Удаляем старый чек и генерируем новый
-    receipt_path = RECEIPTS_DIR / f"{identifier}_receipt.pdf"
-    if receipt_path.exists():
-        try:
-            receipt_path.unlink()
-            print(f"Старый чек для заказа {identifier} удалён")
-        except Exception as e:
-            print(f"Не удалось удалить старый чек для заказа {identifier}: {str(e)}")
-    try:
-        generate_receipt(identifier, db)
-    except Exception as e:
-        print(f"Не удалось сгенерировать новый чек для заказа {identifier} после добавления товара: {str(e)}")
+    # Чек перегенерирует планировщик после паузы в правках или GET чека
+    mark_receipts_dirty([identifier])
 
     return db_order
 
-@app.get("/search/orders/{identifier}", response_model=schemas.OrderResponse)
-def search_order_by_identifier(identifier: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    order = crud.get_order_by_identifier(db, identifier)
+@app.get("/search/orders/{identifier}", response_model=schemas.ArchivedOrderResponse)
+def search_order_by_identifier(identifier: str, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    order = crud.get_order_by_identifier(db, identifier) or archive.get_archived_order(db, identifier)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return order
 
 @app.get("/search/clients", response_model=List[schemas.ClientResponse])
-def search_clients(first_name: str = None, last_name: str = None, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    if not first_name and not last_name:
-        raise HTTPException(status_code=400, detail="At least one search parameter (first_name or last_name) is required")
-    clients = crud.search_clients_by_name(db, first_name, last_name)
+def search_clients(
+    q: Optional[str] = None,
+    first_name: str = None,
+    last_name: str = None,
+    limit: int = 20,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    if q:
+        # Ранжированный нечёткий поиск по ФИО и телефону
+        clients = crud.search_clients(db, q, limit=min(max(limit, 1), 100))
+    elif first_name or last_name:
+        clients = crud.search_clients_by_name(db, first_name, last_name)
+    else:
+        raise HTTPException(status_code=400, detail="At least one search parameter (q, first_name or last_name) is required")
     if not clients:
         raise HTTPException(status_code=404, detail="Clients not found")
-    return clients
+    return responses.json_list_response(responses.CLIENT_LIST, clients)
 
 @app.get("/search/products", response_model=List[schemas.ProductResponse])
-def search_products(name: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def search_products(request: Request, name: str, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if not name:
         raise HTTPException(status_code=400, detail="Search parameter (name) is required")
-    products = search_products_by_name(db, name)
-    if not products:
-        raise HTTPException(status_code=404, detail="Products not found")
-    return products
 
+    def build(session):
+        products = search_products_by_name(session, name)
+        if not products:
+            raise HTTPException(status_code=404, detail="Products not found")
+        return responses.json_list_response(responses.PRODUCT_LIST, products)
+
+    return cached_response(request, "products", db, build)
+
+@app.get("/autocomplete/products")
+def autocomplete_products(prefix: str, limit: int = 10, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    if not prefix.strip():
+        raise HTTPException(status_code=400, detail="Search parameter (prefix) is required")
+    # Подсказки из префиксного индекса справочника в памяти; пустой список — не ошибка
+    suggestions = product_catalog.suggest(db, prefix, limit=min(max(limit, 1), 50))
+    return responses.rows_response(("id", "name"), [(info.id, info.name) for info in suggestions])
 
 @app.delete("/orders/{identifier}", response_model=dict)
 async def delete_order_by_identifier(
@@ -502,13 +706,11 @@ async def delete_order_by_identifier(
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Удаляем чек, если он существует
-    receipt_path = RECEIPTS_DIR / f"{identifier}_receipt.pdf"
-    if receipt_path.exists():
-        try:
-            receipt_path.unlink()
+    try:
+        if receipt_store.delete_receipt(identifier):
             print(f"Чек для заказа {identifier} удалён")
-        except Exception as e:
-            print(f"Не удалось удалить чек для заказа {identifier}: {str(e)}")
+    except Exception as e:
+        print(f"Не удалось удалить чек для заказа {identifier}: {str(e)}")
 
     return {"message": "Заказ удалён"}
 
@@ -518,39 +720,61 @@ async def create_receipt(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # Удаляем старый чек, если он существует
-    receipt_path = RECEIPTS_DIR / f"{identifier}_receipt.pdf"
-    if receipt_path.exists():
-        try:
-            receipt_path.unlink()
-            print(f"Старый чек для заказа {identifier} удалён")
-        except Exception as e:
-            print(f"Не удалось удалить старый чек для заказа {identifier}: {str(e)}")
-
-    # Генерируем новый чек
-    return generate_receipt(identifier, db)
+    # Генерируем новый чек; старый файл заменяется атомарно
+    return await run_in_threadpool(generate_receipt, identifier, db)
 
 @app.get("/orders/{identifier}/receipt")
 async def get_receipt(
+    request: Request,
     identifier: str,
+    format: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    # Формат: ?format=pdf|html|txt|escpos или заголовок Accept, по умолчанию PDF
+    try:
+        fmt = receipt_render.negotiate(format, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    receipt_format = receipt_render.FORMATS[fmt]
+    filename = receipt_store.file_name(identifier, fmt)
+
     # Проверяем, существует ли заказ
     db_order = db.query(models.Order).filter(models.Order.identifier == identifier).first()
     if not db_order:
-        raise HTTPException(status_code=404, detail="Order not found")
+        # Старые отгруженные заказы и их чеки лежат в архиве (только PDF)
+        if not archive.is_archived(db, identifier):
+            raise HTTPException(status_code=404, detail="Order not found")
+        if fmt != receipt_render.DEFAULT_FORMAT:
+            # Явный ?format= — ошибка; формат из Accept (браузер просит text/html) — отдаём PDF
+            if format:
+                raise HTTPException(status_code=404, detail="Archived receipts are available as PDF only")
+            filename = receipt_store.file_name(identifier, receipt_render.DEFAULT_FORMAT)
+        content = archive.read_archived_receipt(db, identifier)
+        if content is None:
+            raise HTTPException(status_code=404, detail="Receipt not found")
+        return Response(
+            content=content,
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept"}
+        )
 
-    # Формируем путь к PDF-файлу
-    receipt_path = RECEIPTS_DIR / f"{identifier}_receipt.pdf"
-    if not receipt_path.exists():
+    # Находим файл в хранилище чеков; если его нет или после правок он устарел,
+    # генерируем (один рендер на все одновременные запросы). Каждый формат хранится отдельно
+    receipt_path = await run_in_threadpool(
+        receipt_store.ensure, identifier, lambda: generate_receipt(identifier, db, fmt),
+        receipt_scheduler.is_dirty, fmt
+    )
+    if receipt_path is None:
         raise HTTPException(status_code=404, detail="Receipt not found")
 
-    # Возвращаем PDF-файл
+    # FileResponse отдаёт файл потоком и поддерживает Range
     return FileResponse(
         path=receipt_path,
-        filename=f"{identifier}_receipt.pdf",
-        media_type="application/pdf"
+        filename=filename,
+        media_type=receipt_format.media_type,
+        content_disposition_type=receipt_format.disposition,
+        headers={"Vary": "Accept"}
     )
 
 @app.patch("/orders/by-identifier/{identifier}/items/by-name", response_model=schemas.OrderResponse)
@@ -569,18 +793,24 @@ async def update_item_quantity_by_name(
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Удаляем старый чек и генерируем новый
-    receipt_path = RECEIPTS_DIR / f"{identifier}_receipt.pdf"
-    if receipt_path.exists():
-        try:
-            receipt_path.unlink()
-            print(f"Старый чек для заказа {identifier} удалён")
-        except Exception as e:
-            print(f"Не удалось удалить старый чек для заказа {identifier}: {str(e)}")
-    try:
-        generate_receipt(identifier, db)
-    except Exception as e:
-        print(f"Не удалось сгенерировать новый чек для заказа {identifier} после обновления количества: {str(e)}")
+    # Чек перегенерирует планировщик после паузы в правках или GET чека
+    mark_receipts_dirty([identifier])
+
+    return db_order
+
+@app.patch("/orders/by-identifier/{identifier}/items", response_model=schemas.OrderResponse)
+def update_order_items(
+    identifier: str,
+    operations: List[schemas.OrderItemOperation] = Body(...),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    db_order = crud.apply_item_operations(db, identifier, operations)
+    if not db_order:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    # Чек перегенерирует планировщик после паузы в правках или GET чека
+    mark_receipts_dirty([identifier])
 
     return db_order
 
@@ -591,30 +821,115 @@ async def update_order_status(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # Находим заказ
-    db_order = db.query(models.Order).filter(models.Order.identifier == identifier).first()
+    # Обновляем статус (счётчики по статусам пересчитывает триггер)
+    db_order = crud.update_order_status(db, identifier, status)
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    # Обновляем статус
-    db_order.status = status
-    db.commit()
-    db.refresh(db_order)
+    # Чек перегенерирует планировщик после паузы в правках или GET чека
+    mark_receipts_dirty([identifier])
+
+    return db_order
 
-    # Обновляем чек, так как статус изменился
-    receipt_path = RECEIPTS_DIR / f"{identifier}_receipt.pdf"
-    if receipt_path.exists():
+@app.get("/events/orders")
+async def order_events_stream(request: Request, current_user: models.User = Depends(get_current_user_for_stream)):
+    subscriber = events.broker.subscribe()
+
+    async def stream():
         try:
-            receipt_path.unlink()
-            print(f"Старый чек для заказа {identifier} удалён")
-        except Exception as e:
-            print(f"Не удалось удалить старый чек для заказа {identifier}: {str(e)}")
-    try:
-        crud.generate_receipt(identifier, db)
-    except Exception as e:
-        print(f"Не удалось сгенерировать новый чек для заказа {identifier} после изменения статуса: {str(e)}")
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    item = await asyncio.wait_for(subscriber.queue.get(), timeout=events.HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield events.format_sse(item)
+        finally:
+            events.broker.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    return db_order
+@app.websocket("/ws/orders")
+async def order_events_websocket(websocket: WebSocket, access_token: Optional[str] = None):
+    try:
+        await run_in_threadpool(get_user_by_token, access_token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscriber = events.broker.subscribe()
+
+    async def send_events():
+        while True:
+            item = await subscriber.queue.get()
+            await websocket.send_json(item)
+
+    async def wait_disconnect():
+        # Клиент ничего не шлёт, но без receive() закрытие заметили бы только при следующем событии
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    workers = [asyncio.create_task(send_events()), asyncio.create_task(wait_disconnect())]
+    try:
+        done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                print(f"Order events websocket failed: {error}")
+    finally:
+        for task in workers:
+            task.cancel()
+        events.broker.unsubscribe(subscriber)
+
+@app.get("/reports/sales/daily")
+def report_sales_daily(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return reports.sales_by_day(db, date_from, date_to)
+
+@app.get("/reports/sales/products")
+def report_sales_products(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    limit: int = 100,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return reports.sales_by_product(db, date_from, date_to, limit)
+
+@app.get("/reports/sales/clients")
+def report_sales_clients(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    limit: int = 100,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return reports.sales_by_client(db, date_from, date_to, limit)
+
+@app.get("/reports/inventory/turnover")
+def report_stock_turnover(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    limit: int = 100,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    return reports.stock_turnover(db, date_from, date_to, limit)
 
 def custom_openapi():
     if app.openapi_schema:
@@ -943,6 +1258,14 @@ def custom_openapi():
                     "type": "string",
                     "format": "binary"
                 }
+            },
+            "text/html": {"schema": {"type": "string"}},
+            "text/plain": {"schema": {"type": "string"}},
+            "application/vnd.escpos": {
+                "schema": {
+                    "type": "string",
+                    "format": "binary"
+                }
             }
         }
     app.openapi_schema = openapi_schema
@@ -0,0 +1,168 @@
+"""Служебные команды.
+
+    python manage.py migrate
+    python manage.py backfill-totals
+    python manage.py backfill-client-search
+    python manage.py rebuild-rollups
+    python manage.py archive-orders --older-than-days 90
+    python manage.py backup | backup-verify | backup-restore | backup-prune
+    python manage.py receipts-migrate
+    python manage.py jobs | jobs-retry-failed | jobs-work --threads 4
+"""
+import argparse
+import signal
+
+import archive
+import backup
+import jobs
+import migrations
+import receipt_store
+import models
+from database import engine
+
+
+def cmd_migrate(args):
+    models.Base.metadata.create_all(bind=engine)
+    migrations.apply(engine)
+    print("Схема обновлена")
+
+
+def cmd_backfill_totals(args):
+    migrations.apply(engine)
+    updated = migrations.backfill_order_totals(engine, batch_size=args.batch_size)
+    print(f"Пересчитаны итоги для {updated} заказов")
+
+
+def cmd_backfill_client_search(args):
+    migrations.apply(engine)
+    updated = migrations.backfill_client_search(engine, batch_size=args.batch_size)
+    print(f"Поисковые ключи заполнены для {updated} клиентов")
+
+
+def cmd_rebuild_rollups(args):
+    migrations.apply(engine)
+    migrations.rebuild_rollups(engine)
+    print("Агрегаты продаж пересобраны")
+
+
+def cmd_archive_orders(args):
+    migrations.apply(engine)
+    moved, packed = archive.run(engine, older_than_days=args.older_than_days, batch_size=args.batch_size)
+    print(f"В архив перенесено заказов: {moved}, упаковано чеков: {packed}")
+
+
+def cmd_backup(args):
+    snapshot = backup.create_backup(engine)
+    print(f"Снимок {snapshot} создан")
+
+
+def cmd_backup_verify(args):
+    problems = backup.verify_backup(args.snapshot)
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print("Снимок цел")
+
+
+def cmd_backup_restore(args):
+    models.Base.metadata.create_all(bind=engine)
+    migrations.apply(engine)
+    result = backup.restore_backup(engine, args.snapshot, clean=args.clean, workers=args.workers)
+    print(f"Снимок {result['snapshot']} восстановлен: строк {result['rows']}, файлов {result['files']}")
+
+
+def cmd_backup_prune(args):
+    result = backup.prune_backups(args.keep)
+    print(f"Удалено снимков: {result['snapshots']}, блобов: {result['blobs']}")
+
+
+def cmd_receipts_migrate(args):
+    models.Base.metadata.create_all(bind=engine)
+    result = receipt_store.migrate_flat_layout()
+    print(f"Чеков перенесено в подкаталоги: {result['moved']}, добавлено в индекс: {result['indexed']}")
+
+
+def cmd_jobs(args):
+    rows = jobs.stats()
+    if not rows:
+        print("Очередь пуста")
+    for row in rows:
+        print(f"{row['kind']:<20} {row['status']:<8} всего {row['total']:>6}  готово {row['ready']:>6}  старейшей {row['oldest_seconds']} с")
+
+
+def cmd_jobs_retry_failed(args):
+    retried = jobs.retry_failed(args.kind)
+    print(f"Возвращено в очередь задач: {retried}")
+
+
+def cmd_jobs_work(args):
+    import tasks  # noqa: F401 — регистрирует обработчики задач
+
+    models.Base.metadata.create_all(bind=engine)
+    migrations.apply(engine)
+    worker = jobs.JobWorker(threads=args.threads)
+    # По SIGTERM/SIGINT новые задачи не берём и доделываем текущие
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stopping.set())
+    print(f"Воркер {worker.name} запущен, потоков: {args.threads}")
+    worker.run_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды приложения")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("migrate", help="Создать таблицы и применить миграции").set_defaults(func=cmd_migrate)
+
+    backfill = subparsers.add_parser("backfill-totals", help="Заполнить total_amount, item_count и цены позиций")
+    backfill.add_argument("--batch-size", type=int, default=5000)
+    backfill.set_defaults(func=cmd_backfill_totals)
+
+    client_search = subparsers.add_parser("backfill-client-search", help="Заполнить ключи поиска клиентов")
+    client_search.add_argument("--batch-size", type=int, default=5000)
+    client_search.set_defaults(func=cmd_backfill_client_search)
+
+    subparsers.add_parser("rebuild-rollups", help="Пересобрать агрегаты продаж для /reports").set_defaults(func=cmd_rebuild_rollups)
+
+    archive_parser = subparsers.add_parser("archive-orders", help="Перенести старые отгруженные заказы и их чеки в архив")
+    archive_parser.add_argument("--older-than-days", type=int, default=archive.ARCHIVE_AFTER_DAYS)
+    archive_parser.add_argument("--batch-size", type=int, default=500)
+    archive_parser.set_defaults(func=cmd_archive_orders)
+
+    subparsers.add_parser("backup", help="Сделать резервную копию базы, uploads и receipts").set_defaults(func=cmd_backup)
+
+    verify = subparsers.add_parser("backup-verify", help="Проверить целостность снимка")
+    verify.add_argument("--snapshot", help="Имя снимка, по умолчанию последний")
+    verify.set_defaults(func=cmd_backup_verify)
+
+    restore = subparsers.add_parser("backup-restore", help="Восстановить базу и файлы из снимка")
+    restore.add_argument("--snapshot", help="Имя снимка, по умолчанию последний")
+    restore.add_argument("--clean", action="store_true", help="Очистить таблицы перед загрузкой")
+    restore.add_argument("--workers", type=int, default=backup.BACKUP_WORKERS)
+    restore.set_defaults(func=cmd_backup_restore)
+
+    prune = subparsers.add_parser("backup-prune", help="Удалить старые снимки и ненужные блобы")
+    prune.add_argument("--keep", type=int, default=14)
+    prune.set_defaults(func=cmd_backup_prune)
+
+    subparsers.add_parser(
+        "receipts-migrate", help="Разложить чеки из плоского receipts/ по подкаталогам и заполнить индекс"
+    ).set_defaults(func=cmd_receipts_migrate)
+
+    subparsers.add_parser("jobs", help="Показать глубину очереди фоновых задач").set_defaults(func=cmd_jobs)
+
+    retry = subparsers.add_parser("jobs-retry-failed", help="Вернуть упавшие задачи в очередь")
+    retry.add_argument("--kind", help="Только задачи этого вида")
+    retry.set_defaults(func=cmd_jobs_retry_failed)
+
+    work = subparsers.add_parser("jobs-work", help="Запустить отдельный воркер фоновых задач")
+    work.add_argument("--threads", type=int, default=jobs.JOB_WORKERS)
+    work.set_defaults(func=cmd_jobs_work)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""Изменения схемы, которые create_all не умеет применять к существующим таблицам.
+
+Все операторы идемпотентны; apply() вызывается при старте приложения и из manage.py.
+Воркеры выполняют их по очереди под advisory-блокировкой.
+"""
+import os
+
+from sqlalchemy import text
+
+import textsearch
+
+MIGRATIONS_LOCK_ID = 7_301_001
+# Горячие счётчики (строка дня в sales_daily, строка статуса в order_status_counts)
+# обновляет каждый заказ, и параллельные транзакции ждали бы друг друга на блокировке
+# одной строки до commit. Поэтому у них ROLLUP_SHARDS строк на ключ: транзакция пишет
+# в шард своего backend, читатели суммируют шарды. Замер — benchmarks/bench_concurrent_orders.py.
+ROLLUP_SHARDS = int(os.getenv("ROLLUP_SHARDS", "16"))
+
+STATEMENTS = [
+    # Итоги заказа и цена позиции на момент заказа
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS total_amount DOUBLE PRECISION NOT NULL DEFAULT 0",
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS item_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE order_items ADD COLUMN IF NOT EXISTS price DOUBLE PRECISION",
+    "CREATE INDEX IF NOT EXISTS ix_orders_total_amount ON orders (total_amount)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_item_count ON orders (item_count)",
+    """
+    CREATE OR REPLACE FUNCTION order_items_price_snapshot() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.price IS NULL THEN
+            SELECT price INTO NEW.price FROM products WHERE id = NEW.product_id;
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION order_items_totals() RETURNS trigger AS $$
+    BEGIN
+        -- Перенос в архив (archive.py) не меняет итоги, агрегаты и счётчики
+        IF current_setting('app.archiving', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP = 'UPDATE' AND NEW.order_id IS NOT DISTINCT FROM OLD.order_id THEN
+            UPDATE orders
+            SET total_amount = total_amount
+                + COALESCE(NEW.quantity, 0) * COALESCE(NEW.price, 0)
+                - COALESCE(OLD.quantity, 0) * COALESCE(OLD.price, 0)
+            WHERE id = NEW.order_id;
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE orders
+            SET total_amount = total_amount - COALESCE(OLD.quantity, 0) * COALESCE(OLD.price, 0),
+                item_count = item_count - 1
+            WHERE id = OLD.order_id;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'INSERT') THEN
+            UPDATE orders
+            SET total_amount = total_amount + COALESCE(NEW.quantity, 0) * COALESCE(NEW.price, 0),
+                item_count = item_count + 1
+            WHERE id = NEW.order_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS order_items_price_snapshot ON order_items",
+    """
+    CREATE TRIGGER order_items_price_snapshot BEFORE INSERT ON order_items
+    FOR EACH ROW EXECUTE FUNCTION order_items_price_snapshot()
+    """,
+    "DROP TRIGGER IF EXISTS order_items_totals ON order_items",
+    """
+    CREATE TRIGGER order_items_totals AFTER INSERT OR UPDATE OR DELETE ON order_items
+    FOR EACH ROW EXECUTE FUNCTION order_items_totals()
+    """,
+    # Дата создания заказа; существующие заказы получают время применения миграции
+    "ALTER TABLE orders ADD COLUMN IF NOT EXISTS created_at TIMESTAMP NOT NULL DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)",
+    # Агрегаты продаж для отчётов
+    f"""
+    CREATE OR REPLACE FUNCTION rollup_shard() RETURNS smallint AS $$
+        SELECT (pg_backend_pid() % {ROLLUP_SHARDS})::smallint
+    $$ LANGUAGE sql STABLE
+    """,
+    "ALTER TABLE sales_daily ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+    """
+    DO $$
+    BEGIN
+        IF (SELECT array_length(indkey::int2[], 1) FROM pg_index
+            WHERE indrelid = 'sales_daily'::regclass AND indisprimary) = 1 THEN
+            ALTER TABLE sales_daily DROP CONSTRAINT sales_daily_pkey;
+            ALTER TABLE sales_daily ADD PRIMARY KEY (day, shard);
+        END IF;
+    END
+    $$
+    """,
+    # Строки популярного товара или постоянного клиента за день тоже горячие — шардируем так же
+    "ALTER TABLE sales_product_daily ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+    "ALTER TABLE sales_client_daily ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+    """
+    DO $$
+    BEGIN
+        IF (SELECT array_length(indkey::int2[], 1) FROM pg_index
+            WHERE indrelid = 'sales_product_daily'::regclass AND indisprimary) = 2 THEN
+            ALTER TABLE sales_product_daily DROP CONSTRAINT sales_product_daily_pkey;
+            ALTER TABLE sales_product_daily ADD PRIMARY KEY (day, product_id, shard);
+        END IF;
+        IF (SELECT array_length(indkey::int2[], 1) FROM pg_index
+            WHERE indrelid = 'sales_client_daily'::regclass AND indisprimary) = 2 THEN
+            ALTER TABLE sales_client_daily DROP CONSTRAINT sales_client_daily_pkey;
+            ALTER TABLE sales_client_daily ADD PRIMARY KEY (day, client_id, shard);
+        END IF;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION sales_rollup_add(
+        p_day date, p_product_id integer, p_client_id integer, p_quantity integer, p_revenue double precision
+    ) RETURNS void AS $$
+    BEGIN
+        INSERT INTO sales_daily AS t (day, shard, orders_count, quantity, revenue)
+        VALUES (p_day, rollup_shard(), 0, p_quantity, p_revenue)
+        ON CONFLICT (day, shard) DO UPDATE
+        SET quantity = t.quantity + EXCLUDED.quantity, revenue = t.revenue + EXCLUDED.revenue;
+        IF p_product_id IS NOT NULL THEN
+            INSERT INTO sales_product_daily AS t (day, product_id, shard, quantity, revenue)
+            VALUES (p_day, p_product_id, rollup_shard(), p_quantity, p_revenue)
+            ON CONFLICT (day, product_id, shard) DO UPDATE
+            SET quantity = t.quantity + EXCLUDED.quantity, revenue = t.revenue + EXCLUDED.revenue;
+        END IF;
+        IF p_client_id IS NOT NULL THEN
+            INSERT INTO sales_client_daily AS t (day, client_id, shard, quantity, revenue)
+            VALUES (p_day, p_client_id, rollup_shard(), p_quantity, p_revenue)
+            ON CONFLICT (day, client_id, shard) DO UPDATE
+            SET quantity = t.quantity + EXCLUDED.quantity, revenue = t.revenue + EXCLUDED.revenue;
+        END IF;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION order_items_rollups() RETURNS trigger AS $$
+    DECLARE
+        order_day date;
+        order_client integer;
+    BEGIN
+        -- Перенос в архив (archive.py) не меняет итоги, агрегаты и счётчики
+        IF current_setting('app.archiving', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            SELECT created_at::date, client_id INTO order_day, order_client FROM orders WHERE id = OLD.order_id;
+            IF FOUND THEN
+                PERFORM sales_rollup_add(
+                    order_day, OLD.product_id, order_client,
+                    -COALESCE(OLD.quantity, 0), -COALESCE(OLD.quantity, 0) * COALESCE(OLD.price, 0)
+                );
+            END IF;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'INSERT') THEN
+            SELECT created_at::date, client_id INTO order_day, order_client FROM orders WHERE id = NEW.order_id;
+            IF FOUND THEN
+                PERFORM sales_rollup_add(
+                    order_day, NEW.product_id, order_client,
+                    COALESCE(NEW.quantity, 0), COALESCE(NEW.quantity, 0) * COALESCE(NEW.price, 0)
+                );
+            END IF;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION orders_rollups() RETURNS trigger AS $$
+    BEGIN
+        -- Перенос в архив (archive.py) не меняет итоги, агрегаты и счётчики
+        IF current_setting('app.archiving', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        -- Удаление тоже пишет -1 в свой шард: по отдельности шард может уйти в минус, сумма верна
+        INSERT INTO sales_daily AS t (day, shard, orders_count, quantity, revenue)
+        VALUES (
+            CASE WHEN TG_OP = 'INSERT' THEN NEW.created_at::date ELSE OLD.created_at::date END,
+            rollup_shard(), CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END, 0, 0
+        )
+        ON CONFLICT (day, shard) DO UPDATE SET orders_count = t.orders_count + EXCLUDED.orders_count;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS order_items_rollups ON order_items",
+    """
+    CREATE TRIGGER order_items_rollups AFTER INSERT OR UPDATE OR DELETE ON order_items
+    FOR EACH ROW EXECUTE FUNCTION order_items_rollups()
+    """,
+    "DROP TRIGGER IF EXISTS orders_rollups ON orders",
+    """
+    CREATE TRIGGER orders_rollups AFTER INSERT OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_rollups()
+    """,
+    # Частичные индексы по незавершённым заказам: рабочий набор склада остаётся маленьким
+    "CREATE INDEX IF NOT EXISTS ix_orders_open_status ON orders (status, id) WHERE status IN ('pending', 'ready')",
+    "CREATE INDEX IF NOT EXISTS ix_orders_open_client ON orders (client_id, id) WHERE status IN ('pending', 'ready')",
+    # Счётчики заказов по статусам, по ROLLUP_SHARDS строк на статус
+    "ALTER TABLE order_status_counts ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+    """
+    DO $$
+    BEGIN
+        IF (SELECT array_length(indkey::int2[], 1) FROM pg_index
+            WHERE indrelid = 'order_status_counts'::regclass AND indisprimary) = 1 THEN
+            ALTER TABLE order_status_counts DROP CONSTRAINT order_status_counts_pkey;
+            ALTER TABLE order_status_counts ADD PRIMARY KEY (status, shard);
+        END IF;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION order_status_count_add(p_status text, p_delta integer) RETURNS void AS $$
+    BEGIN
+        IF p_status IS NULL THEN
+            RETURN;
+        END IF;
+        INSERT INTO order_status_counts AS t (status, shard, count) VALUES (p_status, rollup_shard(), p_delta)
+        ON CONFLICT (status, shard) DO UPDATE SET count = t.count + EXCLUDED.count;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION orders_status_counts() RETURNS trigger AS $$
+    BEGIN
+        -- Перенос в архив (archive.py) не меняет итоги, агрегаты и счётчики
+        IF current_setting('app.archiving', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP = 'UPDATE' AND NEW.status IS NOT DISTINCT FROM OLD.status THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM order_status_count_add(OLD.status::text, -1);
+        END IF;
+        IF TG_OP IN ('UPDATE', 'INSERT') THEN
+            PERFORM order_status_count_add(NEW.status::text, 1);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS orders_status_counts ON orders",
+    """
+    CREATE TRIGGER orders_status_counts AFTER INSERT OR DELETE OR UPDATE OF status ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_status_counts()
+    """,
+    # Первичное заполнение счётчиков (только если их ещё нет)
+    """
+    INSERT INTO order_status_counts (status, count)
+    SELECT status::text, COUNT(*) FROM orders o
+    WHERE status IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM order_status_counts c WHERE c.status = o.status::text)
+    GROUP BY status
+    ON CONFLICT DO NOTHING
+    """,
+    # Индекс чеков хранит строку на каждый формат (pdf, html, txt, escpos)
+    "ALTER TABLE receipt_files ADD COLUMN IF NOT EXISTS format VARCHAR(10) NOT NULL DEFAULT 'pdf'",
+    """
+    DO $$
+    BEGIN
+        IF (SELECT array_length(indkey::int2[], 1) FROM pg_index
+            WHERE indrelid = 'receipt_files'::regclass AND indisprimary) = 1 THEN
+            ALTER TABLE receipt_files DROP CONSTRAINT receipt_files_pkey;
+            ALTER TABLE receipt_files ADD PRIMARY KEY (identifier, format);
+        END IF;
+    END
+    $$
+    """,
+    # Отложенный рендер чеков перешёл в очередь задач (jobs.py), колонка больше не используется
+    "ALTER TABLE receipt_dirty DROP COLUMN IF EXISTS first_marked_at",
+    # Строка с ключом создаётся до ответа и помечает запрос как выполняющийся
+    "ALTER TABLE idempotency_keys ALTER COLUMN status_code DROP NOT NULL",
+    # Версии кэша ответов (cache.py), по ROLLUP_SHARDS строк на набор данных
+    "ALTER TABLE cache_versions ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+    """
+    DO $$
+    BEGIN
+        IF (SELECT array_length(indkey::int2[], 1) FROM pg_index
+            WHERE indrelid = 'cache_versions'::regclass AND indisprimary) = 1 THEN
+            ALTER TABLE cache_versions DROP CONSTRAINT cache_versions_pkey;
+            ALTER TABLE cache_versions ADD PRIMARY KEY (namespace, shard);
+        END IF;
+    END
+    $$
+    """,
+    # Поиск клиентов: нормализованный телефон и транслитерированное ФИО (см. textsearch.py)
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    textsearch.sql_translit_function(),
+    textsearch.sql_phone_function(),
+    "ALTER TABLE clients ADD COLUMN IF NOT EXISTS phone_normalized VARCHAR",
+    "ALTER TABLE clients ADD COLUMN IF NOT EXISTS search_name VARCHAR",
+    """
+    CREATE OR REPLACE FUNCTION clients_search_fields() RETURNS trigger AS $$
+    BEGIN
+        NEW.phone_normalized := phone_e164(NEW.phone);
+        NEW.search_name := translit_ru(concat_ws(' ', NEW.last_name, NEW.first_name, NEW.middle_name));
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS clients_search_fields ON clients",
+    """
+    CREATE TRIGGER clients_search_fields BEFORE INSERT OR UPDATE ON clients
+    FOR EACH ROW EXECUTE FUNCTION clients_search_fields()
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_clients_search_name_trgm ON clients USING gin (search_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_clients_phone_normalized ON clients (phone_normalized)",
+    "CREATE INDEX IF NOT EXISTS ix_clients_phone_normalized_trgm ON clients USING gin (phone_normalized gin_trgm_ops)",
+]
+
+# Живые и архивные заказы в одном виде для пересборки агрегатов
+_ALL_ORDERS = """
+    SELECT id, created_at, client_id, status::text AS status FROM orders
+    UNION ALL
+    SELECT id, created_at, client_id, status FROM archived_orders
+"""
+_ALL_ITEMS = """
+    SELECT o.created_at::date AS day, o.client_id, oi.product_id, oi.quantity, oi.price
+    FROM order_items oi JOIN orders o ON o.id = oi.order_id
+    UNION ALL
+    SELECT a.created_at::date, a.client_id, (item->>'product_id')::integer,
+           (item->>'quantity')::integer, (item->>'price')::double precision
+    FROM archived_orders a, jsonb_array_elements(a.payload->'items') AS item
+"""
+
+REBUILD_ROLLUPS = [
+    # Блокируем запись в заказы на время пересборки, чтобы триггеры не разошлись с пересчётом
+    "LOCK TABLE orders, order_items, archived_orders IN SHARE MODE",
+    "TRUNCATE sales_daily, sales_product_daily, sales_client_daily, order_status_counts",
+    f"""
+    INSERT INTO order_status_counts (status, count)
+    SELECT status::text, COUNT(*) FROM orders WHERE status IS NOT NULL GROUP BY status
+    """,
+    f"""
+    INSERT INTO sales_daily (day, orders_count, quantity, revenue)
+    SELECT o.day, o.orders_count, COALESCE(i.quantity, 0), COALESCE(i.revenue, 0)
+    FROM (SELECT created_at::date AS day, COUNT(*) AS orders_count FROM ({_ALL_ORDERS}) o GROUP BY 1) o
+    LEFT JOIN (
+        SELECT day,
+               SUM(COALESCE(quantity, 0)) AS quantity,
+               SUM(COALESCE(quantity, 0) * COALESCE(price, 0)) AS revenue
+        FROM ({_ALL_ITEMS}) i
+        GROUP BY 1
+    ) i ON i.day = o.day
+    """,
+    f"""
+    INSERT INTO sales_product_daily (day, product_id, quantity, revenue)
+    SELECT day, product_id, SUM(COALESCE(quantity, 0)), SUM(COALESCE(quantity, 0) * COALESCE(price, 0))
+    FROM ({_ALL_ITEMS}) i
+    WHERE product_id IS NOT NULL
+    GROUP BY 1, 2
+    """,
+    f"""
+    INSERT INTO sales_client_daily (day, client_id, quantity, revenue)
+    SELECT day, client_id, SUM(COALESCE(quantity, 0)), SUM(COALESCE(quantity, 0) * COALESCE(price, 0))
+    FROM ({_ALL_ITEMS}) i
+    WHERE client_id IS NOT NULL
+    GROUP BY 1, 2
+    """,
+]
+
+
+def apply(engine):
+    with engine.begin() as connection:
+        # DB_STATEMENT_TIMEOUT рассчитан на запросы API; ожидание блокировки и DDL на больших
+        # таблицах не должны обрываться на середине
+        connection.execute(text("SET LOCAL statement_timeout = 0"))
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+        for statement in STATEMENTS:
+            connection.execute(text(statement))
+
+
+def backfill_order_totals(engine, batch_size: int = 5000):
+    """Заполняет цены позиций и итоги заказов для данных, созданных до триггеров."""
+    with engine.begin() as connection:
+        max_item_id = connection.execute(text("SELECT COALESCE(MAX(id), 0) FROM order_items")).scalar_one()
+        max_id = connection.execute(text("SELECT COALESCE(MAX(id), 0) FROM orders")).scalar_one()
+
+    # Цены позиций — тоже пачками по диапазону id, а не одним UPDATE на всю таблицу
+    for start in range(0, max_item_id + 1, batch_size):
+        with engine.begin() as connection:
+            connection.execute(text("""
+                UPDATE order_items oi SET price = p.price FROM products p
+                WHERE oi.product_id = p.id AND oi.price IS NULL
+                  AND oi.id >= :start AND oi.id < :end
+            """), {"start": start, "end": start + batch_size})
+
+    updated = 0
+    for start in range(0, max_id + 1, batch_size):
+        # Пересчёт пачками по диапазону id, чтобы не держать долгую транзакцию
+        with engine.begin() as connection:
+            result = connection.execute(text("""
+                UPDATE orders o
+                SET total_amount = COALESCE(s.total_amount, 0),
+                    item_count = COALESCE(s.item_count, 0)
+                FROM orders o2
+                LEFT JOIN (
+                    SELECT order_id,
+                           SUM(COALESCE(quantity, 0) * COALESCE(price, 0)) AS total_amount,
+                           COUNT(*) AS item_count
+                    FROM order_items
+                    WHERE order_id >= :start AND order_id < :end
+                    GROUP BY order_id
+                ) s ON s.order_id = o2.id
+                WHERE o.id = o2.id AND o2.id >= :start AND o2.id < :end
+            """), {"start": start, "end": start + batch_size})
+            updated += result.rowcount
+    return updated
+
+
+def backfill_client_search(engine, batch_size: int = 5000):
+    """Заполняет phone_normalized и search_name для клиентов, созданных до триггера."""
+    with engine.begin() as connection:
+        max_id = connection.execute(text("SELECT COALESCE(MAX(id), 0) FROM clients")).scalar_one()
+
+    updated = 0
+    for start in range(0, max_id + 1, batch_size):
+        # Пустое UPDATE запускает триггер clients_search_fields
+        with engine.begin() as connection:
+            result = connection.execute(text("""
+                UPDATE clients SET phone = phone
+                WHERE id >= :start AND id < :end AND search_name IS NULL
+            """), {"start": start, "end": start + batch_size})
+            updated += result.rowcount
+    return updated
+
+
+def rebuild_rollups(engine):
+    """Пересчитывает агрегаты продаж с нуля по таблицам заказов."""
+    with engine.begin() as connection:
+        connection.execute(text("SET LOCAL statement_timeout = 0"))
+        for statement in REBUILD_ROLLUPS:
+            connection.execute(text(statement))
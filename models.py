@@ -1,7 +1,9 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Enum, Float
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, String, Text, Date, DateTime, ForeignKey, Enum, Float, LargeBinary, FetchedValue, Index, func, text
 from sqlalchemy.orm import relationship
 from database import Base
+from sqlalchemy.dialects.postgresql import JSONB
 import enum
+from datetime import datetime
 
 class User(Base):
     __tablename__ = "users"
@@ -22,6 +24,9 @@ class Client(Base):
     birth_date = Column(Date)
     phone = Column(String)
     address = Column(String)
+    # Заполняет триггер clients_search_fields (см. migrations.py, textsearch.py)
+    phone_normalized = Column(String, server_default=FetchedValue(), server_onupdate=FetchedValue())
+    search_name = Column(String, server_default=FetchedValue(), server_onupdate=FetchedValue())
     orders = relationship("Order", back_populates="client")
 
 class OrderStatus(enum.Enum):
@@ -37,6 +42,10 @@ class Order(Base):
     client = relationship("Client", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
     identifier = Column(String(10), unique=True)
+    # Поддерживаются триггерами на order_items (см. migrations.py)
+    total_amount = Column(Float, nullable=False, default=0, server_default="0", index=True)
+    item_count = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now(), index=True)
 
 class Product(Base):
     __tablename__ = "products"
@@ -53,5 +62,115 @@ class OrderItem(Base):
     order_id = Column(Integer, ForeignKey("orders.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer)
+    # Цена товара на момент добавления в заказ; если не задана, триггер берёт products.price
+    price = Column(Float, server_default=FetchedValue())
     order = relationship("Order", back_populates="items")
     product = relationship("Product", back_populates="order_items")
+
+class CacheVersion(Base):
+    # Версии кэшируемых наборов данных, общие для всех воркеров (см. cache.py)
+    __tablename__ = "cache_versions"
+    namespace = Column(String, primary_key=True)
+    # Несколько строк на набор, версия — их сумма (см. migrations.ROLLUP_SHARDS)
+    shard = Column(SmallInteger, primary_key=True, default=0, server_default="0")
+    version = Column(Integer, nullable=False, default=0)
+
+class IdempotencyKey(Base):
+    # Сохранённые ответы на запросы с заголовком Idempotency-Key (см. idempotency.py)
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer)  # NULL — запрос ещё выполняется
+    content_type = Column(String)
+    body = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+# Агрегаты продаж по дням для /reports/*; обновляются триггерами (см. migrations.py),
+# пересобираются командой python manage.py rebuild-rollups
+class SalesDaily(Base):
+    __tablename__ = "sales_daily"
+    day = Column(Date, primary_key=True)
+    # Несколько строк на день, чтобы параллельные заказы не ждали одну строку (см. migrations.ROLLUP_SHARDS)
+    shard = Column(SmallInteger, primary_key=True, default=0, server_default="0")
+    orders_count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+class ProductSalesDaily(Base):
+    __tablename__ = "sales_product_daily"
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True, index=True)
+    shard = Column(SmallInteger, primary_key=True, default=0, server_default="0")
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+class ClientSalesDaily(Base):
+    __tablename__ = "sales_client_daily"
+    day = Column(Date, primary_key=True)
+    client_id = Column(Integer, primary_key=True, index=True)
+    shard = Column(SmallInteger, primary_key=True, default=0, server_default="0")
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+class OrderStatusCount(Base):
+    # Число заказов по статусам для /orders/counts; обновляется триггером на orders
+    __tablename__ = "order_status_counts"
+    status = Column(String, primary_key=True)
+    # Несколько строк на статус, см. migrations.ROLLUP_SHARDS
+    shard = Column(SmallInteger, primary_key=True, default=0, server_default="0")
+    count = Column(Integer, nullable=False, default=0)
+
+class ArchivedOrder(Base):
+    # Отгруженные заказы, перенесённые из orders/order_items (см. archive.py).
+    # payload хранит снимок клиента и позиций в форме OrderResponse
+    __tablename__ = "archived_orders"
+    id = Column(Integer, primary_key=True)
+    identifier = Column(String(10), unique=True, index=True)
+    status = Column(String, nullable=False)
+    client_id = Column(Integer, index=True)
+    total_amount = Column(Float, nullable=False, default=0)
+    item_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, nullable=False, server_default=func.now())
+    payload = Column(JSONB, nullable=False)
+    receipt_archive = Column(String)  # имя zip-архива с чеком, если чек был упакован
+
+class ReceiptFile(Base):
+    # Индекс файлов чеков в receipts/ (см. receipt_store.py)
+    __tablename__ = "receipt_files"
+    identifier = Column(String(10), primary_key=True)
+    format = Column(String(10), primary_key=True, default="pdf")
+    path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    generated_at = Column(DateTime, nullable=False)
+
+class ReceiptDirty(Base):
+    # Чеки, которые нужно перегенерировать после правок заказа (см. receipt_scheduler.py)
+    __tablename__ = "receipt_dirty"
+    identifier = Column(String(10), primary_key=True)
+    marked_at = Column(DateTime(timezone=True), nullable=False, server_default=func.clock_timestamp())
+
+class Job(Base):
+    # Фоновые задачи (см. jobs.py): чеки, варианты изображений
+    __tablename__ = "jobs"
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    payload = Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    dedupe_key = Column(String(255))
+    priority = Column(Integer, nullable=False, default=0)
+    status = Column(String(10), nullable=False, default="queued")  # queued, running, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_at = Column(DateTime(timezone=True))
+    locked_by = Column(String(100))
+    last_error = Column(Text)
+
+    __table_args__ = (
+        # Одна ожидающая задача на ключ; выполняющаяся не мешает поставить следующую
+        Index("ux_jobs_dedupe_queued", "dedupe_key", unique=True, postgresql_where=text("status = 'queued'")),
+        Index("ix_jobs_claim", "priority", "run_at", postgresql_where=text("status = 'queued'")),
+        Index("ix_jobs_running", "locked_at", postgresql_where=text("status = 'running'")),
+    )
@@ -0,0 +1,309 @@
+"""Данные чека и их представления.
+
+build_receipt_data собирает из заказа строки, итоги и сумму прописью, а
+рендеры превращают их в байты нужного формата:
+
+    pdf     — ReportLab с DejaVuSans, как раньше
+    html    — простая страница для предпросмотра в браузере
+    txt     — текст фиксированной ширины RECEIPT_TEXT_WIDTH
+    escpos  — тот же текст в CP866 с командами ESC/POS для термопринтера
+
+Формат выбирается параметром ?format= или заголовком Accept (см. negotiate).
+"""
+import html
+import io
+import locale
+import os
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from fastapi import HTTPException
+from num2words import num2words
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+from sqlalchemy.orm import Session, joinedload
+
+import models
+
+# Устанавливаем локализацию для русского языка (название месяца в дате чека)
+locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
+
+pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
+
+SUPPLIER = "ИП Иванов И.И."
+RECEIPT_TEXT_WIDTH = int(os.getenv("RECEIPT_TEXT_WIDTH", "42"))
+# Кодовая страница CP866 в большинстве ESC/POS-принтеров (ESC t 17)
+ESCPOS_CODEPAGE = int(os.getenv("RECEIPT_ESCPOS_CODEPAGE", "17"))
+
+
+class ReceiptRow(NamedTuple):
+    index: int
+    product_id: int
+    name: str
+    quantity: int
+    price: float
+    amount: float
+
+
+class ReceiptData(NamedTuple):
+    identifier: str
+    date: str
+    supplier: str
+    client_name: str
+    rows: List[ReceiptRow]
+    total_amount: float
+    amount_in_words: str
+
+
+def amount_in_words(total_amount: float) -> str:
+    rubles = int(total_amount)
+    kopecks = int((total_amount - rubles) * 100)
+    words = num2words(rubles, lang='ru').replace(' и ', ' ').capitalize() + " рублей"
+    if kopecks > 0:
+        words += f" {kopecks:02d} копеек"
+    else:
+        words += " 00 копеек"
+    return words
+
+
+def build_receipt_data(db: Session, identifier: str) -> ReceiptData:
+    db_order = db.query(models.Order).options(
+        joinedload(models.Order.client),
+        joinedload(models.Order.items).joinedload(models.OrderItem.product)
+    ).filter(models.Order.identifier == identifier).first()
+    if not db_order:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    rows = []
+    total_amount = 0
+    for idx, item in enumerate(db_order.items, 1):
+        product = item.product
+        # Цена на момент заказа; для старых позиций без снимка — текущая цена товара
+        price = item.price if item.price is not None else product.price
+        amount = item.quantity * price
+        total_amount += amount
+        rows.append(ReceiptRow(idx, product.id, product.name, item.quantity, price, amount))
+
+    client_name = f"{db_order.client.last_name} {db_order.client.first_name}" if db_order.client else "Неизвестный клиент"
+    return ReceiptData(
+        identifier=identifier,
+        date=datetime.now().strftime("%d %B %Y г."),
+        supplier=SUPPLIER,
+        client_name=client_name,
+        rows=rows,
+        total_amount=total_amount,
+        amount_in_words=amount_in_words(total_amount),
+    )
+
+
+# --- рендеры ---
+
+def render_pdf(data: ReceiptData) -> bytes:
+    buffer = io.BytesIO()
+
+    # Создаём PDF с уменьшенными отступами
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        leftMargin=15,
+        rightMargin=15,
+        topMargin=30,
+        bottomMargin=30
+    )
+    elements = []
+
+    # Параметры таблицы
+    padding = 5
+    col_widths = [30, 60, 220, 80, 80, 80]
+    row_height = 30
+    styles = getSampleStyleSheet()
+    style_normal = styles['Normal']
+    style_normal.fontName = 'DejaVuSans'
+    style_normal.fontSize = 12
+    style_normal.leading = 20
+    style_normal.alignment = 0
+
+    # Заголовок и покупатель
+    elements.append(Paragraph(f"Товарный чек № {data.identifier} от {data.date}", style_normal))
+    elements.append(Paragraph(f"Поставщик: {data.supplier}", style_normal))
+    elements.append(Paragraph(f"Покупатель: {data.client_name}", style_normal))
+    elements.append(Paragraph("", style_normal))
+
+    table_data = [["№", "Артикул", "Товар", "Количество", "Цена", "Сумма"]]
+    for row in data.rows:
+        table_data.append([
+            str(row.index),
+            str(row.product_id),
+            row.name,
+            str(row.quantity),
+            f"{row.price:.1f}",
+            f"{row.amount:.1f}"
+        ])
+
+    table = Table(table_data, colWidths=col_widths, rowHeights=[row_height] * len(table_data))
+    table.setStyle(TableStyle([
+        ('FONT', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('FONTSIZE', (0, 0), (-1, -1), 12),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+        ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+        ('LEFTPADDING', (0, 0), (-1, -1), padding),
+        ('RIGHTPADDING', (0, 0), (-1, -1), padding),
+        ('TOPPADDING', (0, 0), (-1, -1), 2),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+    ]))
+    elements.append(table)
+
+    # Итоги, сумма прописью и подписи
+    elements.append(Paragraph(f"Итого: {data.total_amount:.2f} руб.", style_normal))
+    elements.append(Paragraph(f"Всего наименований {len(data.rows)}, на сумму {data.total_amount:.2f} руб.", style_normal))
+    elements.append(Paragraph(data.amount_in_words, style_normal))
+    elements.append(Paragraph("Отпустил _______________  Получил _______________", style_normal))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<title>Товарный чек № {identifier}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #000; padding: 4px 8px; text-align: left; }}
+td.num {{ text-align: right; }}
+</style>
+</head>
+<body>
+<p>Товарный чек № {identifier} от {date}</p>
+<p>Поставщик: {supplier}</p>
+<p>Покупатель: {client_name}</p>
+<table>
+<tr><th>№</th><th>Артикул</th><th>Товар</th><th>Количество</th><th>Цена</th><th>Сумма</th></tr>
+{rows}
+</table>
+<p>Итого: {total:.2f} руб.</p>
+<p>Всего наименований {count}, на сумму {total:.2f} руб.</p>
+<p>{amount_in_words}</p>
+<p>Отпустил _______________  Получил _______________</p>
+</body>
+</html>
+"""
+
+
+def render_html(data: ReceiptData) -> bytes:
+    rows = "\n".join(
+        f"<tr><td>{row.index}</td><td>{row.product_id}</td><td>{html.escape(row.name)}</td>"
+        f"<td class=\"num\">{row.quantity}</td><td class=\"num\">{row.price:.1f}</td><td class=\"num\">{row.amount:.1f}</td></tr>"
+        for row in data.rows
+    )
+    return HTML_TEMPLATE.format(
+        identifier=html.escape(data.identifier),
+        date=html.escape(data.date),
+        supplier=html.escape(data.supplier),
+        client_name=html.escape(data.client_name),
+        rows=rows,
+        total=data.total_amount,
+        count=len(data.rows),
+        amount_in_words=html.escape(data.amount_in_words),
+    ).encode("utf-8")
+
+
+def _text_lines(data: ReceiptData, width: int) -> List[str]:
+    def columns(left: str, right: str) -> str:
+        # Правая часть прижата к краю, левая обрезается, если не помещается
+        left = left[:max(width - len(right) - 1, 0)]
+        return left + " " * (width - len(left) - len(right)) + right
+
+    lines = [
+        f"Товарный чек № {data.identifier}",
+        f"от {data.date}",
+        f"Поставщик: {data.supplier}",
+        f"Покупатель: {data.client_name}",
+        "-" * width,
+    ]
+    for row in data.rows:
+        lines.append(f"{row.index}. {row.name}"[:width])
+        lines.append(columns(f"   арт. {row.product_id}  {row.quantity} x {row.price:.1f}", f"{row.amount:.1f}"))
+    lines.append("-" * width)
+    lines.append(columns("ИТОГО", f"{data.total_amount:.2f} руб."))
+    lines.append(f"Всего наименований {len(data.rows)}")
+    # Сумму прописью переносим по словам
+    line = ""
+    for word in data.amount_in_words.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    lines.append(line)
+    lines.append("")
+    lines.append("Отпустил ________  Получил ________"[:width])
+    return lines
+
+
+def render_text(data: ReceiptData) -> bytes:
+    return ("\n".join(_text_lines(data, RECEIPT_TEXT_WIDTH)) + "\n").encode("utf-8")
+
+
+def render_escpos(data: ReceiptData) -> bytes:
+    text = "\n".join(_text_lines(data, RECEIPT_TEXT_WIDTH)) + "\n"
+    return (
+        b"\x1b@"                                    # инициализация принтера
+        + bytes([0x1b, 0x74, ESCPOS_CODEPAGE])      # кодовая страница
+        + text.encode("cp866", errors="replace")
+        + b"\n\n\n\x1dV\x42\x00"                    # прогон и отрезка
+    )
+
+
+class ReceiptFormat(NamedTuple):
+    media_type: str
+    render: Callable[[ReceiptData], bytes]
+    # inline — показывать в браузере, attachment — скачивать
+    disposition: str
+
+
+# Имя формата служит и расширением файла в receipt_store
+FORMATS = {
+    "pdf": ReceiptFormat("application/pdf", render_pdf, "attachment"),
+    "html": ReceiptFormat("text/html; charset=utf-8", render_html, "inline"),
+    "txt": ReceiptFormat("text/plain; charset=utf-8", render_text, "inline"),
+    "escpos": ReceiptFormat("application/vnd.escpos", render_escpos, "attachment"),
+}
+DEFAULT_FORMAT = "pdf"
+_MEDIA_TYPES = {
+    "application/pdf": "pdf",
+    "text/html": "html",
+    "text/plain": "txt",
+    "application/vnd.escpos": "escpos",
+}
+
+
+def negotiate(format_param: str = None, accept: str = None) -> str:
+    """Имя формата по ?format= или Accept; ValueError для неизвестного ?format=."""
+    if format_param:
+        if format_param not in FORMATS:
+            raise ValueError(f"Unknown receipt format. Allowed: {', '.join(FORMATS)}")
+        return format_param
+    best, best_q = DEFAULT_FORMAT, 0.0
+    for part in (accept or "").split(","):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        name = _MEDIA_TYPES.get(media_type.lower())
+        # При равном q выигрывает тип, указанный раньше
+        if name and q > best_q:
+            best, best_q = name, q
+    return best
@@ -0,0 +1,72 @@
+"""Отложенная перегенерация чеков.
+
+Изменения заказа не рендерят PDF сразу, а отмечают чек устаревшим (таблица
+receipt_dirty) и в той же транзакции ставят задачу render_receipt в очередь
+(jobs.py) с ключом по идентификатору. Каждая новая отметка отодвигает задачу на
+RECEIPT_QUIET_SECONDS, но не дальше RECEIPT_MAX_DELAY_SECONDS от первой. Если чек
+запросили раньше, GET /orders/{identifier}/receipt рендерит его сразу. Так пять
+правок подряд дают один рендер.
+
+Отметка снимается в generate_receipt только если после начала рендера новых
+правок не было. is_dirty, now и clear под render_lock идут через соединение
+блокировки (receipt_store.connection_for).
+"""
+import os
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import jobs
+import models
+import receipt_store
+from database import engine
+
+QUIET_SECONDS = float(os.getenv("RECEIPT_QUIET_SECONDS", "5"))
+MAX_DELAY_SECONDS = float(os.getenv("RECEIPT_MAX_DELAY_SECONDS", "60"))
+RENDER_JOB = "render_receipt"
+
+
+def mark_dirty(identifiers):
+    """Отмечает чеки заказов устаревшими и ставит их перегенерацию в очередь."""
+    identifiers = list(dict.fromkeys(identifiers))
+    if not identifiers:
+        return
+    statement = pg_insert(models.ReceiptDirty).values([
+        {"identifier": identifier} for identifier in identifiers
+    ])
+    with engine.begin() as connection:
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[models.ReceiptDirty.identifier],
+            set_={"marked_at": func.clock_timestamp()}
+        ))
+        jobs.enqueue_many(
+            RENDER_JOB,
+            [({"identifier": identifier}, f"receipt:{identifier}") for identifier in identifiers],
+            priority=jobs.PRIORITY_LOW, delay=QUIET_SECONDS, max_delay=MAX_DELAY_SECONDS,
+            connection=connection
+        )
+
+
+def is_dirty(identifier: str) -> bool:
+    with receipt_store.connection_for(identifier) as connection:
+        return connection.execute(
+            select(models.ReceiptDirty.identifier).where(models.ReceiptDirty.identifier == identifier)
+        ).first() is not None
+
+
+def now(identifier: str = None):
+    if identifier is not None:
+        with receipt_store.connection_for(identifier) as connection:
+            return connection.execute(select(func.clock_timestamp())).scalar()
+    with engine.connect() as connection:
+        return connection.execute(select(func.clock_timestamp())).scalar()
+
+
+def clear(identifier: str, rendered_from):
+    """Снимает отметку, если чек не менялся после rendered_from (начала рендера)."""
+    with receipt_store.connection_for(identifier) as connection:
+        connection.execute(
+            delete(models.ReceiptDirty)
+            .where(models.ReceiptDirty.identifier == identifier)
+            .where(models.ReceiptDirty.marked_at <= rendered_from)
+        )
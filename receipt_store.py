@@ -0,0 +1,281 @@
+"""Хранилище PDF-чеков.
+
+Файлы раскладываются по подкаталогам из первых символов sha1 идентификатора:
+
+    receipts/3f/a2/IVA000123_receipt.pdf
+    receipts/3f/a2/IVA000123_receipt.html    (другие форматы, см. receipt_render.py)
+
+так что в одном каталоге не собираются сотни тысяч файлов. Запись идёт во
+временный файл рядом и заменяется через os.replace, поэтому читатель видит либо
+старый, либо новый чек целиком. Размер, sha256 и время генерации хранятся в
+таблице receipt_files (по строке на формат).
+
+Рендер одного чека во всех воркерах идёт под render_lock (advisory lock), а
+ensure() склеивает одновременные запросы отсутствующего или устаревшего чека
+внутри процесса в один рендер. Пока поток держит render_lock, save, delete_receipt
+и отметки receipt_scheduler работают через соединение этой блокировки
+(connection_for), а не берут из пула ещё по одному.
+
+Старые чеки из плоского receipts/ переносятся командой
+
+    python manage.py receipts-migrate
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import models
+from database import engine
+
+RECEIPTS_DIR = Path(os.getenv("RECEIPTS_DIR", "receipts"))
+SUFFIX = "_receipt."
+DEFAULT_FORMAT = "pdf"
+
+
+def file_name(identifier: str, fmt: str = DEFAULT_FORMAT) -> str:
+    return f"{identifier}{SUFFIX}{fmt}"
+
+
+def _shard_dir(identifier: str) -> Path:
+    digest = hashlib.sha1(identifier.encode()).hexdigest()
+    return RECEIPTS_DIR / digest[:2] / digest[2:4]
+
+
+def receipt_path(identifier: str, fmt: str = DEFAULT_FORMAT) -> Path:
+    return _shard_dir(identifier) / file_name(identifier, fmt)
+
+
+def _legacy_path(identifier: str) -> Path:
+    return RECEIPTS_DIR / file_name(identifier)
+
+
+def _parse_name(name: str):
+    identifier, _, fmt = name.rpartition(SUFFIX)
+    return identifier, fmt
+
+
+def locate(identifier: str, fmt: str = DEFAULT_FORMAT):
+    """Путь к существующему чеку или None; PDF до миграции ищем и в плоском каталоге."""
+    path = receipt_path(identifier, fmt)
+    if path.exists():
+        return path
+    if fmt == DEFAULT_FORMAT:
+        legacy = _legacy_path(identifier)
+        if legacy.exists():
+            return legacy
+    return None
+
+
+def exists(identifier: str, fmt: str = DEFAULT_FORMAT) -> bool:
+    return locate(identifier, fmt) is not None
+
+
+def _lock(connection, identifier: str):
+    # Запись файла и строки индекса одного чека идут по очереди во всех воркерах
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"receipt:{identifier}"})
+
+
+def _upsert(connection, identifier: str, fmt: str, path: Path, size: int, sha256: str, generated_at: datetime):
+    statement = pg_insert(models.ReceiptFile).values(
+        identifier=identifier, format=fmt, path=path.relative_to(RECEIPTS_DIR).as_posix(),
+        size=size, sha256=sha256, generated_at=generated_at
+    )
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[models.ReceiptFile.identifier, models.ReceiptFile.format],
+        set_={
+            "path": statement.excluded.path,
+            "size": statement.excluded.size,
+            "sha256": statement.excluded.sha256,
+            "generated_at": statement.excluded.generated_at,
+        }
+    ))
+
+
+def save(identifier: str, content: bytes, fmt: str = DEFAULT_FORMAT) -> Path:
+    """Атомарно записывает чек в формате fmt и обновляет индекс."""
+    path = receipt_path(identifier, fmt)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=".", suffix=".tmp", delete=False) as temp:
+        temp.write(content)
+        temp.flush()
+        os.fsync(temp.fileno())
+    try:
+        with connection_for(identifier) as connection:
+            _lock(connection, identifier)
+            os.replace(temp.name, path)
+            _upsert(connection, identifier, fmt, path, len(content), hashlib.sha256(content).hexdigest(), datetime.utcnow())
+            if fmt == DEFAULT_FORMAT:
+                # Чек уже в новом месте — копия в плоском каталоге больше не нужна
+                _legacy_path(identifier).unlink(missing_ok=True)
+    finally:
+        if os.path.exists(temp.name):
+            os.unlink(temp.name)
+    return path
+
+
+def delete_receipt(identifier: str, keep: str = None) -> bool:
+    """Удаляет файлы чека во всех форматах, кроме keep, и их строки в индексе;
+    возвращает True, если что-то было удалено."""
+    removed = False
+    with connection_for(identifier) as connection:
+        _lock(connection, identifier)
+        paths = list(_shard_dir(identifier).glob(f"{identifier}{SUFFIX}*"))
+        if keep != DEFAULT_FORMAT:
+            paths.append(_legacy_path(identifier))
+        for path in paths:
+            if _parse_name(path.name) == (identifier, keep) or not path.exists():
+                continue
+            path.unlink()
+            removed = True
+        statement = delete(models.ReceiptFile).where(models.ReceiptFile.identifier == identifier)
+        if keep is not None:
+            statement = statement.where(models.ReceiptFile.format != keep)
+        connection.execute(statement)
+    return removed
+
+
+_held = threading.local()
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+@contextmanager
+def connection_for(identifier: str):
+    """Транзакция для работы с чеком: на соединении render_lock, если поток его держит,
+    иначе на отдельном соединении из пула."""
+    held = _held.__dict__.get("connections", {}).get(identifier)
+    if held is None:
+        with engine.begin() as connection:
+            yield connection
+        return
+    try:
+        yield held
+        held.commit()
+    except BaseException:
+        # Сессионная advisory-блокировка откатом не снимается
+        held.rollback()
+        raise
+
+
+@contextmanager
+def render_lock(identifier: str, wait: bool = True):
+    """Блокировка рендера чека на всех воркерах; повторный вход из того же потока не ждёт.
+
+    С wait=False не ждёт чужую блокировку и отдаёт False, если она занята.
+    """
+    held = _held.__dict__.setdefault("connections", {})
+    if identifier in held:
+        yield True
+        return
+    key = f"receipt-render:{identifier}"
+    with engine.connect() as connection:
+        if wait:
+            connection.execute(text("SELECT pg_advisory_lock(hashtext(:key))"), {"key": key})
+        elif not connection.execute(text("SELECT pg_try_advisory_lock(hashtext(:key))"), {"key": key}).scalar():
+            connection.commit()
+            yield False
+            return
+        # Блокировка сессионная: транзакцию закрываем, чтобы соединение не висело idle in transaction
+        connection.commit()
+        held[identifier] = connection
+        try:
+            yield True
+        finally:
+            held.pop(identifier, None)
+            connection.rollback()
+            connection.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {"key": key})
+            connection.commit()
+
+
+def ensure(identifier: str, render, is_stale=None, fmt: str = DEFAULT_FORMAT):
+    """Путь к чеку в формате fmt; если файла нет или is_stale(identifier) истинно,
+    вызывает render() — один раз на все одновременные запросы."""
+    path = locate(identifier, fmt)
+    if path is not None and not (is_stale and is_stale(identifier)):
+        return path
+    key = (identifier, fmt)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        return future.result()
+    try:
+        with render_lock(identifier):
+            # Пока ждали блокировку, чек мог сгенерировать другой воркер
+            path = locate(identifier, fmt)
+            if path is None or (is_stale and is_stale(identifier)):
+                render()
+                path = locate(identifier, fmt)
+        future.set_result(path)
+        return path
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def get_metadata(identifier: str, fmt: str = DEFAULT_FORMAT):
+    with engine.connect() as connection:
+        return connection.execute(
+            select(
+                models.ReceiptFile.identifier, models.ReceiptFile.format, models.ReceiptFile.path,
+                models.ReceiptFile.size, models.ReceiptFile.sha256, models.ReceiptFile.generated_at
+            )
+            .where(models.ReceiptFile.identifier == identifier)
+            .where(models.ReceiptFile.format == fmt)
+        ).first()
+
+
+def _file_sha256(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def migrate_flat_layout() -> dict:
+    """Переносит чеки из плоского receipts/ в подкаталоги и индексирует файлы без строки в индексе."""
+    moved = 0
+    for legacy in sorted(RECEIPTS_DIR.glob(f"*{SUFFIX}{DEFAULT_FORMAT}")):
+        identifier, _ = _parse_name(legacy.name)
+        path = receipt_path(identifier)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with engine.begin() as connection:
+            _lock(connection, identifier)
+            if not legacy.exists():
+                continue
+            if path.exists():
+                # Новый чек уже записан в подкаталог, плоская копия устарела
+                legacy.unlink()
+            else:
+                os.replace(legacy, path)
+                moved += 1
+
+    with engine.connect() as connection:
+        indexed = set(connection.execute(select(models.ReceiptFile.identifier, models.ReceiptFile.format)).tuples())
+    added = 0
+    for path in RECEIPTS_DIR.glob(f"*/*/*{SUFFIX}*"):
+        identifier, fmt = _parse_name(path.name)
+        if not identifier or (identifier, fmt) in indexed:
+            continue
+        with engine.begin() as connection:
+            _lock(connection, identifier)
+            if not path.exists():
+                continue
+            stat = path.stat()
+            _upsert(connection, identifier, fmt, path, stat.st_size, _file_sha256(path), datetime.utcfromtimestamp(stat.st_mtime))
+        added += 1
+    return {"moved": moved, "indexed": added}
@@ -0,0 +1,114 @@
+"""Запросы для /reports/*: читают только агрегаты sales_* и справочники."""
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+
+
+def _period(query, column, date_from: Optional[date], date_to: Optional[date]):
+    if date_from is not None:
+        query = query.where(column >= date_from)
+    if date_to is not None:
+        query = query.where(column <= date_to)
+    return query
+
+
+def sales_by_day(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None):
+    # Строки дня разбиты на шарды — складываем
+    query = select(
+        models.SalesDaily.day,
+        func.sum(models.SalesDaily.orders_count).label("orders_count"),
+        func.sum(models.SalesDaily.quantity).label("quantity"),
+        func.sum(models.SalesDaily.revenue).label("revenue"),
+    )
+    query = _period(query, models.SalesDaily.day, date_from, date_to)
+    query = query.group_by(models.SalesDaily.day).order_by(models.SalesDaily.day)
+    return [
+        {"day": row.day, "orders_count": row.orders_count, "quantity": row.quantity, "revenue": row.revenue}
+        for row in db.execute(query)
+    ]
+
+
+def sales_by_product(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None, limit: int = 100):
+    totals = _period(
+        select(
+            models.ProductSalesDaily.product_id,
+            func.sum(models.ProductSalesDaily.quantity).label("quantity"),
+            func.sum(models.ProductSalesDaily.revenue).label("revenue"),
+        ),
+        models.ProductSalesDaily.day, date_from, date_to
+    ).group_by(models.ProductSalesDaily.product_id).subquery()
+    query = (
+        select(totals.c.product_id, models.Product.name, totals.c.quantity, totals.c.revenue)
+        .outerjoin(models.Product, models.Product.id == totals.c.product_id)
+        .order_by(totals.c.revenue.desc())
+        .limit(limit)
+    )
+    return [
+        {"product_id": row.product_id, "name": row.name, "quantity": row.quantity, "revenue": row.revenue}
+        for row in db.execute(query)
+    ]
+
+
+def sales_by_client(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None, limit: int = 100):
+    totals = _period(
+        select(
+            models.ClientSalesDaily.client_id,
+            func.sum(models.ClientSalesDaily.quantity).label("quantity"),
+            func.sum(models.ClientSalesDaily.revenue).label("revenue"),
+        ),
+        models.ClientSalesDaily.day, date_from, date_to
+    ).group_by(models.ClientSalesDaily.client_id).subquery()
+    query = (
+        select(totals.c.client_id, models.Client.last_name, models.Client.first_name, totals.c.quantity, totals.c.revenue)
+        .outerjoin(models.Client, models.Client.id == totals.c.client_id)
+        .order_by(totals.c.revenue.desc())
+        .limit(limit)
+    )
+    return [
+        {
+            "client_id": row.client_id,
+            "name": f"{row.last_name or ''} {row.first_name or ''}".strip() or None,
+            "quantity": row.quantity,
+            "revenue": row.revenue,
+        }
+        for row in db.execute(query)
+    ]
+
+
+def stock_turnover(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None, limit: int = 100):
+    """Оборачиваемость: продано за период к текущему остатку и запас в днях продаж."""
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=29)
+    days = (date_to - date_from).days + 1
+
+    sold = _period(
+        select(
+            models.ProductSalesDaily.product_id,
+            func.sum(models.ProductSalesDaily.quantity).label("sold"),
+        ),
+        models.ProductSalesDaily.day, date_from, date_to
+    ).group_by(models.ProductSalesDaily.product_id).subquery()
+    query = (
+        select(models.Product.id, models.Product.name, models.Product.stock, func.coalesce(sold.c.sold, 0).label("sold"))
+        .outerjoin(sold, sold.c.product_id == models.Product.id)
+        .order_by(func.coalesce(sold.c.sold, 0).desc(), models.Product.id)
+        .limit(limit)
+    )
+    result = []
+    for row in db.execute(query):
+        stock = row.stock or 0
+        sold_quantity = int(row.sold or 0)
+        daily = sold_quantity / days if days > 0 else 0
+        result.append({
+            "product_id": row.id,
+            "name": row.name,
+            "stock": stock,
+            "sold": sold_quantity,
+            "turnover": round(sold_quantity / stock, 4) if stock > 0 else None,
+            "days_of_cover": round(stock / daily, 1) if daily > 0 else None,
+        })
+    return {"date_from": date_from, "date_to": date_to, "products": result}
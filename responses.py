@@ -0,0 +1,37 @@
+from typing import Any, List
+
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+
+import schemas
+
+# Адаптеры строятся один раз при импорте, а не на каждый запрос
+ORDER_LIST = TypeAdapter(List[schemas.OrderResponse])
+PRODUCT_LIST = TypeAdapter(List[schemas.ProductResponse])
+CLIENT_LIST = TypeAdapter(List[schemas.ClientResponse])
+
+
+def dump_list(adapter: TypeAdapter, rows: List[Any]) -> bytes:
+    # Валидируем ORM-объекты сразу в модели и сериализуем в байты в pydantic-core,
+    # минуя jsonable_encoder и промежуточные словари
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+
+def json_list_response(adapter: TypeAdapter, rows: List[Any]) -> Response:
+    return Response(content=dump_list(adapter, rows), media_type="application/json")
+
+
+def rows_response(fields, rows) -> Response:
+    # Строки-кортежи из проекций crud: собираем словари только из запрошенных колонок
+    return Response(content=to_json([dict(zip(fields, row)) for row in rows]), media_type="application/json")
+
+
+def batch_response(key_field: str, keys, found) -> Response:
+    # Ответ в порядке запроса; у каждой строки отметка found (см. schemas.*BatchItem)
+    items = [{**found[key], "found": True} if key in found else {key_field: key, "found": False} for key in keys]
+    return Response(content=to_json(items), media_type="application/json")
+
+
+def orders_response(fields, orders) -> Response:
+    return Response(content=to_json([order.as_dict(fields) for order in orders]), media_type="application/json")
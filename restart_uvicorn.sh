@@ -3,32 +3,39 @@
 # Путь к проекту
 PROJECT_DIR="/root/fastapi_app"
 LOG_FILE="/root/fastapi_app/uvicorn.log"
+PYTHON="/root/fastapi_app/venv/bin/python"
 
-# Проверка, запущен ли uvicorn
-if ! pgrep -f "uvicorn main:app" > /dev/null; then
-    echo "Uvicorn не запущен. Запускаем..."
+start_launcher() {
     cd $PROJECT_DIR
-    # Очищаем кэш Python
-    find . -name "__pycache__" -exec rm -rf {} +
-    # Запускаем uvicorn с reload и перенаправляем логи в файл
-    /root/fastapi_app/venv/bin/uvicorn main:app --host 0.0.0.0 --port 8000 --reload >> $LOG_FILE 2>&1 &
-    echo "Uvicorn запущен с PID $!"
+    # Запускаем мастер-процесс с несколькими воркерами (по числу ядер, см. WEB_CONCURRENCY)
+    $PYTHON launcher.py --host 0.0.0.0 --port 8000 >> $LOG_FILE 2>&1 &
+    echo "Launcher запущен с PID $!"
+}
+
+# Проверка, запущен ли мастер-процесс
+if ! pgrep -f "launcher.py" > /dev/null; then
+    echo "Launcher не запущен. Запускаем..."
+    start_launcher
+elif [ "$1" == "reload" ]; then
+    # Поочерёдный перезапуск воркеров без потери запросов
+    echo "Перезапускаем воркеры..."
+    pkill -HUP -f "launcher.py"
 else
-    echo "Uvicorn уже запущен. Проверка на зависание..."
-    # Проверяем, отвечает ли сервер (например, через curl)
-    if ! curl -s -m 5 http://localhost:8000/ > /dev/null; then
-        echo "Uvicorn не отвечает. Перезапускаем..."
-        # Убиваем существующий процесс
-        pkill -f "uvicorn main:app"
-        # Даем время на завершение
-        sleep 2
-        # Очищаем кэш Python
-        cd $PROJECT_DIR
-        find . -name "__pycache__" -exec rm -rf {} +
-        # Перезапускаем uvicorn с перенаправлением логов
-        /root/fastapi_app/venv/bin/uvicorn main:app --host 0.0.0.0 --port 8000 --reload >> $LOG_FILE 2>&1 &
-        echo "Uvicorn перезапущен с PID $!"
+    echo "Launcher уже запущен. Проверка на зависание..."
+    # Проверяем, отвечает ли сервер
+    if ! curl -s -f -m 5 http://localhost:8000/healthz > /dev/null; then
+        echo "Сервер не отвечает. Перезапускаем..."
+        # Плавно останавливаем мастер: он дождётся завершения запросов в воркерах
+        pkill -TERM -f "launcher.py"
+        for i in $(seq 1 40); do
+            pgrep -f "launcher.py" > /dev/null || break
+            sleep 1
+        done
+        pkill -KILL -f "launcher.py"
+        start_launcher
+    elif ! curl -s -f -m 5 http://localhost:8000/readyz > /dev/null; then
+        echo "Сервер жив, но не готов (база данных или папка чеков недоступны)"
     else
-        echo "Uvicorn работает нормально."
+        echo "Сервер работает нормально."
     fi
 fi
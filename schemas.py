@@ -1,7 +1,7 @@
 from pydantic import BaseModel, Field
 from datetime import date
 from enum import Enum
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 class UserCreate(BaseModel):
     username: str
@@ -76,10 +76,18 @@ class OrderItemCreateByName(BaseModel):  # Новая схема для доба
     product_name: str
     quantity: int
 
+class OrderItemOperation(BaseModel):
+    # add — прибавить quantity, set — установить quantity (0 удаляет позицию), remove — удалить позицию
+    op: Literal["add", "set", "remove"]
+    product_name: Optional[str] = None
+    product_id: Optional[int] = None
+    quantity: int = 0
+
 class OrderItemResponse(BaseModel):
     id: int
     product_id: int
     quantity: int
+    price: Optional[float] = None
     product: ProductCreate
 
     class Config:
@@ -95,12 +103,62 @@ class OrderResponse(BaseModel):
     status: OrderStatusEnum
     client_id: int
     identifier: str
+    total_amount: float = 0
+    item_count: int = 0
     client: ClientCreate
     items: List[OrderItemResponse]
 
     class Config:
         from_attributes = True
 
+class ArchivedOrderResponse(OrderResponse):
+    # Заказ мог попасть в архив, когда клиента уже не было (см. archive.py)
+    client_id: Optional[int] = None
+    client: Optional[ClientCreate] = None
+
+# Элементы пакетных ответов (?ids=, ?identifiers=): найденные строки содержат поля из fields=
+# и found: true, для отсутствующих ключей — только ключ и found: false
+class ProductBatchItem(BaseModel):
+    found: bool
+    id: Optional[int] = None
+    name: Optional[str] = None
+    image: Optional[str] = None
+    price: Optional[float] = None
+    stock: Optional[int] = None
+
+class ClientBatchItem(BaseModel):
+    found: bool
+    id: Optional[int] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    middle_name: Optional[str] = None
+    birth_date: Optional[date] = None
+    phone: Optional[str] = None
+    address: Optional[str] = None
+
+class OrderBatchItem(BaseModel):
+    found: bool
+    identifier: Optional[str] = None
+    id: Optional[int] = None
+    status: Optional[OrderStatusEnum] = None
+    client_id: Optional[int] = None
+    total_amount: Optional[float] = None
+    item_count: Optional[int] = None
+    client: Optional[ClientCreate] = None
+    items: Optional[List[OrderItemResponse]] = None
+
+class BulkOrderResult(BaseModel):
+    index: int
+    success: bool
+    id: Optional[int] = None
+    identifier: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkOrderResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkOrderResult]
+
 class UserResponse(BaseModel):
     id: int
     username: str
@@ -0,0 +1,36 @@
+"""Обработчики фоновых задач (см. jobs.py).
+
+Модуль импортируют и приложение, и python manage.py jobs-work, чтобы воркер в
+любом процессе знал все виды задач.
+"""
+from fastapi import HTTPException
+
+import images
+import jobs
+import receipt_scheduler
+import receipt_store
+from crud import generate_receipt
+from database import SessionLocal
+
+
+@jobs.handler(receipt_scheduler.RENDER_JOB)
+def render_receipt(payload):
+    identifier = payload["identifier"]
+    db = SessionLocal()
+    try:
+        with receipt_store.render_lock(identifier):
+            # Чек мог уже отрендерить GET — тогда отметки нет
+            if receipt_scheduler.is_dirty(identifier):
+                generate_receipt(identifier, db)
+    except HTTPException as e:
+        if e.status_code != 404:
+            raise
+        # Заказ удалён или перенесён в архив — рендерить нечего
+        receipt_scheduler.clear(identifier, receipt_scheduler.now())
+    finally:
+        db.close()
+
+
+@jobs.handler(images.PROCESS_JOB)
+def process_image(payload):
+    images.process_image(payload["filename"])
@@ -0,0 +1,84 @@
+"""Нормализация строк для поиска клиентов и товаров.
+
+Имена приводятся к нижнему регистру и латинице (упрощённая транслитерация), чтобы
+"Иванов", "иванов" и "Ivanov" давали один ключ. Телефоны — к цифрам в духе E.164:
+российские 8XXXXXXXXXX и 10-значные номера получают код страны 7.
+
+Для клиентов те же правила действуют в базе: функции translit_ru и phone_e164
+(см. migrations.py) собираются из TRANSLIT и PHONE_COUNTRY_CODE этого модуля,
+поэтому ключи в таблице и в запросе совпадают.
+"""
+import os
+import re
+
+PHONE_COUNTRY_CODE = "7"
+# Порог pg_trgm.word_similarity_threshold для поиска клиентов по имени
+CLIENT_SEARCH_THRESHOLD = float(os.getenv("CLIENT_SEARCH_THRESHOLD", "0.4"))
+# Не меньше стольких цифр в запросе — ищем и по телефону
+PHONE_MIN_DIGITS = 3
+
+TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+}
+_TRANSLIT_TABLE = str.maketrans(TRANSLIT)
+_DIGITS = re.compile(r"\d+")
+
+
+def transliterate(value: str) -> str:
+    """Ключ поиска по имени: нижний регистр, латиница, одиночные пробелы."""
+    if not value:
+        return ""
+    return " ".join(value.lower().split()).translate(_TRANSLIT_TABLE)
+
+
+def normalize_phone(phone: str):
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits[0] == "8":
+        digits = PHONE_COUNTRY_CODE + digits[1:]
+    elif len(digits) == 10:
+        digits = PHONE_COUNTRY_CODE + digits
+    return digits or None
+
+
+def split_query(query: str):
+    """Делит запрос на имя и телефон: "Иванов +7 912 345" -> ("ivanov", "7912345")."""
+    digits = "".join(_DIGITS.findall(query or ""))
+    name = transliterate(re.sub(r"[\d+()\-]", " ", query or ""))
+    phone = normalize_phone(digits) if len(digits) >= PHONE_MIN_DIGITS else None
+    return name, phone
+
+
+# --- те же правила на SQL ---
+
+def sql_translit_function() -> str:
+    multi = [(source, target) for source, target in TRANSLIT.items() if len(target) > 1]
+    single = [(source, target) for source, target in TRANSLIT.items() if len(target) == 1]
+    # Буквы без пары в конце строки from — translate их удаляет (ъ, ь)
+    dropped = [source for source, target in TRANSLIT.items() if not target]
+    expression = "lower(btrim(regexp_replace(value, '\\s+', ' ', 'g')))"
+    for source, target in multi:
+        expression = f"replace({expression}, '{source}', '{target}')"
+    from_chars = "".join(source for source, _ in single) + "".join(dropped)
+    to_chars = "".join(target for _, target in single)
+    return f"""
+    CREATE OR REPLACE FUNCTION translit_ru(value text) RETURNS text AS $$
+        SELECT translate({expression}, '{from_chars}', '{to_chars}')
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    """
+
+
+def sql_phone_function() -> str:
+    return f"""
+    CREATE OR REPLACE FUNCTION phone_e164(value text) RETURNS text AS $$
+        SELECT NULLIF(CASE
+            WHEN length(d) = 11 AND left(d, 1) = '8' THEN '{PHONE_COUNTRY_CODE}' || substr(d, 2)
+            WHEN length(d) = 10 THEN '{PHONE_COUNTRY_CODE}' || d
+            ELSE d
+        END, '')
+        FROM (SELECT regexp_replace(COALESCE(value, ''), '\\D', '', 'g') AS d) s
+    $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    """